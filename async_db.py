@@ -0,0 +1,146 @@
+"""Асинхронный доступ к БД для async-представлений Flask (psycopg 3).
+
+Flask выполняет каждое async-представление в собственном цикле событий,
+а пул соединений psycopg привязан к тому циклу, в котором открыт. Поэтому
+пул живет в отдельном потоке со своим циклом, а методы AsyncDatabase
+передают туда корутины и ждут результат из цикла вызывающего запроса.
+
+Параметры запросов и результаты те же, что у Database: SQL с %s,
+список кортежей для SELECT, None/False при ошибке.
+"""
+import asyncio
+import threading
+import time
+
+try:
+    from psycopg import AsyncClientCursor, Error
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # psycopg 3 не установлен: асинхронный слой недоступен
+    AsyncConnectionPool = None
+    Error = Exception
+
+
+class AsyncDatabase:
+    def __init__(self, host='localhost', database='attendance_db', user='postgres', password='123654789',
+                 minconn=1, maxconn=10, timeout=5.0):
+        self.host = host
+        self.database = database
+        self.user = user
+        self.password = password
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.pool = None
+        self._loop = None
+        self._thread = None
+        self._query_observers = []
+
+    def add_query_observer(self, callback):
+        """Подписаться на выполненные запросы: callback(query, seconds, rows)"""
+        self._query_observers.append(callback)
+
+    def _observe(self, query, started, rows):
+        elapsed = time.perf_counter() - started
+        for callback in self._query_observers:
+            callback(query, elapsed, rows)
+
+    def connect(self):
+        if AsyncConnectionPool is None:
+            print("Асинхронный доступ к БД недоступен: не установлен psycopg 3")
+            return False
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-db', daemon=True)
+        self._thread.start()
+
+        pool = AsyncConnectionPool(
+            make_conninfo(host=self.host, dbname=self.database, user=self.user, password=self.password),
+            min_size=self.minconn, max_size=self.maxconn, timeout=self.timeout, open=False,
+            kwargs={'cursor_factory': AsyncClientCursor},
+        )
+        try:
+            asyncio.run_coroutine_threadsafe(pool.open(wait=True, timeout=self.timeout), self._loop).result()
+        except Exception as e:
+            print(f"Ошибка асинхронного подключения: {e}")
+            self._stop_loop()
+            return False
+
+        self.pool = pool
+        return True
+
+    def close(self):
+        if self.pool:
+            asyncio.run_coroutine_threadsafe(self.pool.close(), self._loop).result()
+            self.pool = None
+        self._stop_loop()
+
+    def _stop_loop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    async def _run(self, coro):
+        """Выполнить корутину в цикле пула и дождаться ее из текущего цикла"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def _query(self, query, params, fetch):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params or None)
+                if fetch and query.strip().upper().startswith(('SELECT', 'WITH')):
+                    return await cur.fetchall()
+                return None
+
+    async def _insert(self, query, params, return_id):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params or None)
+                if return_id and 'RETURNING' in query.upper():
+                    result = (await cur.fetchone())[0]
+                else:
+                    result = True
+            await conn.commit()
+            return result if return_id else True
+
+    async def execute_query(self, query, params=None, fetch=True):
+        if not self.pool:
+            print("Нет соединения с БД")
+            return None
+
+        started = time.perf_counter()
+        try:
+            result = await self._run(self._query(query, params, fetch))
+            self._observe(query, started, len(result) if result is not None else 0)
+            return result
+        except Error as e:
+            self._observe(query, started, 0)
+            print(f"Ошибка выполнения запроса: {e}")
+            print(f"Запрос: {query}")
+            if params:
+                print(f"Параметры: {params}")
+            return None
+
+    async def execute_insert(self, query, params=None, return_id=False):
+        if not self.pool:
+            print("Нет соединения с БД")
+            return False
+
+        started = time.perf_counter()
+        try:
+            result = await self._run(self._insert(query, params, return_id))
+            self._observe(query, started, 0)
+            return result
+        except Error as e:
+            self._observe(query, started, 0)
+            print(f"Ошибка вставки/обновления данных: {e}")
+            return False
+
+    async def gather(self, queries):
+        """Выполнить независимые запросы одновременно: {имя: (sql, параметры)} -> {имя: строки}"""
+        names = list(queries)
+        results = await asyncio.gather(*(self.execute_query(*queries[name]) for name in names))
+        return dict(zip(names, results))
@@ -0,0 +1,339 @@
+"""Нагрузочный тест приложения на локальной БД PostgreSQL.
+
+Скрипт заполняет отдельную БД синтетическим университетом (схема public
+ПЕРЕСОЗДАЕТСЯ), поднимает main.app на локальном порту и гоняет по реальным
+маршрутам параллельных виртуальных пользователей трех ролей. Итог - req/s,
+p50/p95/p99 и число SQL-запросов на маршрут; результат сохраняется в JSON
+и может сравниваться с предыдущим прогоном:
+
+    python benchmark.py --database attendance_bench --seed --groups 200 --students 6000
+    python benchmark.py --database attendance_bench --duration 60 --compare benchmark_results/base.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from psycopg2 import Error
+from werkzeug.serving import make_server
+
+import datagen
+import migrations
+
+# Длина семестра в учебных неделях
+SEMESTER_WEEKS = 17
+
+# Маршруты по ролям; страницы с параметрами подставляются из данных БД
+ROLE_ROUTES = {
+    'Студент': ['/dashboard', '/student/attendance', '/student/schedule'],
+    'Преподаватель': ['/dashboard', '/teacher/attendance/mark', 'POST /teacher/attendance/mark',
+                      '/teacher/statistics'],
+    'Администратор': ['/dashboard', '/admin/statistics', '/admin/users'],
+}
+
+# Доля виртуальных пользователей каждой роли
+ROLE_MIX = {'Студент': 0.7, 'Преподаватель': 0.25, 'Администратор': 0.05}
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def expect_status(code):
+    """Проверка ответа по коду: ошибки приложение отдает flash и редиректом,
+    поэтому код, отличный от ожидаемого, тоже считается ошибкой"""
+    return lambda status, body: status == code
+
+
+def mark_saved(status, body):
+    """Отметка сохранена: AJAX-ответ 200 с success = true"""
+    if status != 200:
+        return False
+    try:
+        return json.loads(body).get('success') is True
+    except ValueError:
+        return False
+
+
+def seed(db, groups, students, teachers, disciplines, semesters):
+    """Пересоздать схему и заполнить БД синтетическими данными"""
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        conn.commit()
+    migrations.migrate(db)
+    datagen.generate(db, groups=groups, students_per_group=max(1, students // groups), teachers=teachers,
+                     disciplines=disciplines, weeks=semesters * SEMESTER_WEEKS + 2, future_weeks=2)
+
+
+def load_accounts(db, limit=200):
+    """Учетные записи для виртуальных пользователей и занятия для отметок"""
+    accounts = {}
+    for role in ROLE_MIX:
+        accounts[role] = db.execute_query("""
+            SELECT id, login, password_hash FROM users
+            WHERE role = %s ORDER BY random() LIMIT %s
+        """, (role, limit)) or []
+
+    # Для каждого преподавателя - последнее проведенное занятие и его группа
+    lessons = db.execute_query("""
+        SELECT DISTINCT ON (s.teacher_id) s.teacher_id, s.id, s.lesson_date, array_agg(u.id)
+        FROM schedule s
+        JOIN users u ON u.group_id = s.group_id AND u.role = 'Студент'
+        WHERE s.lesson_date <= CURRENT_DATE
+          AND s.teacher_id = ANY(%s)
+          AND s.lesson_date >= CURRENT_DATE - 14
+        GROUP BY s.teacher_id, s.id, s.lesson_date
+        ORDER BY s.teacher_id, s.lesson_date DESC
+    """, ([row[0] for row in accounts['Преподаватель']],)) or []
+    return accounts, {row[0]: (row[1], row[2], row[3]) for row in lessons}
+
+
+class VirtualUser:
+    """Клиент с собственной сессией, выполняющий сценарий своей роли"""
+
+    def __init__(self, host, port, role, account, lesson=None):
+        self.host = host
+        self.port = port
+        self.role = role
+        self.user_id, self.login, self.password = account
+        self.lesson = lesson
+        self.cookie = None
+
+    def request(self, method, path, form=None, ajax=False):
+        body = urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+        if ajax:
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+        finally:
+            conn.close()
+
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        match = QUERIES_RE.search(response.getheader('Server-Timing') or '')
+        return response.status, int(match.group(1)) if match else None, content
+
+    def steps(self):
+        """Бесконечная последовательность шагов (метка, метод, путь, форма, проверка ответа)"""
+        # Успешный вход - редирект на главную, неудачный - снова страница входа (200)
+        yield '/login', 'POST', '/login', {'login': self.login, 'password': self.password}, expect_status(302)
+        while True:
+            for route in ROLE_ROUTES[self.role]:
+                if route.startswith('POST '):
+                    if not self.lesson:
+                        continue
+                    schedule_id, lesson_date, students = self.lesson
+                    form = {'schedule_id': schedule_id, 'lesson_date': lesson_date.isoformat(),
+                            'student_id': random.choice(students),
+                            'status': random.choice(('Присутствовал', 'Опоздал', 'Отсутствовал'))}
+                    # Отметка идет как AJAX: без него и успех, и ошибка - одинаковый редирект
+                    yield f'{self.role} {route}', 'POST', route[5:], form, mark_saved
+                else:
+                    yield f'{self.role} {route}', 'GET', route, None, expect_status(200)
+
+
+def run_load(host, port, accounts, lessons, users, duration, warmup):
+    """Запустить виртуальных пользователей и собрать замеры (метка, статус, мс, запросов, успех)"""
+    samples = []
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    roles = []
+    for role, share in ROLE_MIX.items():
+        if accounts[role]:
+            roles += [role] * max(1, round(users * share))
+
+    def worker(index):
+        role = roles[index % len(roles)]
+        account = accounts[role][index % len(accounts[role])]
+        user = VirtualUser(host, port, role, account, lessons.get(account[0]))
+        for label, method, path, form, check in user.steps():
+            if time.monotonic() >= deadline:
+                return
+            begin = time.monotonic()
+            try:
+                status, queries, content = user.request(method, path, form, ajax=check is mark_saved)
+                ok = check(status, content)
+            except (OSError, http.client.HTTPException):
+                status, queries, ok = 0, None, False
+            elapsed_ms = (time.monotonic() - begin) * 1000
+            if begin >= measure_from or label == '/login':
+                with lock:
+                    samples.append((label, status, elapsed_ms, queries, ok))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(roles))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return round(values[index], 2)
+
+
+def summarize(samples, duration):
+    """Сводка по меткам маршрутов и по всему прогону"""
+    def stats(rows):
+        latencies = sorted(row[2] for row in rows)
+        queries = [row[3] for row in rows if row[3] is not None]
+        return {
+            'requests': len(rows),
+            'rps': round(len(rows) / duration, 2),
+            'errors': sum(1 for row in rows if not row[4]),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+    routes = {}
+    for row in samples:
+        routes.setdefault(row[0], []).append(row)
+    return {
+        'totals': stats(samples),
+        'routes': {label: stats(rows) for label, rows in sorted(routes.items())},
+    }
+
+
+def compare(current, baseline, threshold=0.2):
+    """Регрессии относительно прошлого прогона: список строк с описанием"""
+    regressions = []
+    for label, now in current['routes'].items():
+        before = baseline.get('routes', {}).get(label)
+        if not before:
+            continue
+        if before['p95_ms'] and now['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{label}: p95 {before['p95_ms']} -> {now['p95_ms']} мс")
+        if before['rps'] and now['rps'] < before['rps'] * (1 - threshold):
+            regressions.append(f"{label}: req/s {before['rps']} -> {now['rps']}")
+        if (before['queries_per_request'] is not None and now['queries_per_request'] is not None
+                and now['queries_per_request'] > before['queries_per_request']):
+            regressions.append(f"{label}: запросов к БД {before['queries_per_request']} -> "
+                               f"{now['queries_per_request']}")
+    return regressions
+
+
+def print_report(result):
+    print(f"{'маршрут':<45} {'запросов':>8} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'SQL':>6} {'ошибок':>7}")
+    rows = list(result['routes'].items()) + [('ИТОГО', result['totals'])]
+    for label, row in rows:
+        queries = row['queries_per_request'] if row['queries_per_request'] is not None else '-'
+        print(f"{label:<45} {row['requests']:>8} {row['rps']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+              f"{row['p99_ms']:>8} {queries:>6} {row['errors']:>7}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест системы посещаемости')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--database', default='attendance_bench')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему и заполнить БД перед прогоном')
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--students', type=int, default=6000)
+    parser.add_argument('--teachers', type=int, default=300)
+    parser.add_argument('--disciplines', type=int, default=400)
+    parser.add_argument('--semesters', type=int, default=2)
+    parser.add_argument('--users', type=int, default=20, help='число параллельных виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера, с')
+    parser.add_argument('--warmup', type=float, default=5, help='прогрев без замеров, с')
+    parser.add_argument('--pool-size', type=int, default=20, help='максимум соединений в пуле приложения')
+    parser.add_argument('--output', help='файл для результатов (по умолчанию benchmark_results/<время>.json)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для поиска регрессий')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое ухудшение p95 и req/s')
+    args = parser.parse_args()
+
+    import main as app_module
+
+    db = app_module.db
+    db.host, db.database, db.user, db.password = args.host, args.database, args.user, args.password
+    db.minconn, db.maxconn = 2, args.pool_size
+    if not db.connect():
+        raise SystemExit(1)
+    # Построчный лог запросов в консоли только мешает отчету
+    logging.getLogger('attendance.requests').setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    try:
+        if args.seed:
+            print("Заполнение БД...")
+            begin = time.monotonic()
+            seed(db, args.groups, args.students, args.teachers, args.disciplines, args.semesters)
+            print(f"Готово за {time.monotonic() - begin:.1f} с")
+        else:
+            migrations.migrate(db)
+
+        accounts, lessons = load_accounts(db)
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Нагрузка: {args.users} пользователей, {args.duration:.0f} с (+{args.warmup:.0f} с прогрева)")
+        try:
+            samples = run_load('127.0.0.1', server.server_port, accounts, lessons,
+                               args.users, args.duration, args.warmup)
+        finally:
+            server.shutdown()
+    except Error as e:
+        print(f"Ошибка БД: {e}")
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+    result = summarize(samples, args.duration)
+    result.update({
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('password', 'output', 'compare')},
+    })
+    print_report(result)
+
+    output = args.output or os.path.join(
+        'benchmark_results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        if regressions:
+            raise SystemExit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Кэш в памяти процесса для редко меняющихся данных."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """Загрузка значения, которую ждут остальные потоки с тем же ключом"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+        self.stale = False
+
+
+class TTLCache:
+    """Потокобезопасный кэш с временем жизни записей и вытеснением по LRU.
+
+    Кэш живет в памяти одного процесса: при нескольких воркерах явная
+    инвалидация действует только в своем процессе, остальные увидят
+    изменения не позже чем через ttl секунд.
+    """
+
+    def __init__(self, ttl=300, maxsize=128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # ключ -> (значение, момент устаревания)
+        self._loading = {}          # ключ -> _Flight загрузки, которая идет сейчас
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """Значение из кэша или результат loader(); None не кэшируется.
+
+        Одновременные промахи по одному ключу не вызывают loader каждый
+        сам: первый поток загружает значение, остальные ждут его результат.
+        """
+        missing = object()
+        while True:
+            value = self.get(key, missing)
+            if value is not missing:
+                return value
+
+            with self._lock:
+                flight = self._loading.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._loading[key] = _Flight()
+
+            if leader:
+                break
+            flight.done.wait()
+            if not flight.failed:
+                return flight.value
+            # Загрузка у первого потока не удалась - пробуем сами
+
+        try:
+            value = loader()
+        except BaseException:
+            flight.failed = True
+            raise
+        else:
+            flight.value = value
+        finally:
+            with self._lock:
+                del self._loading[key]
+                # Ключ сбросили во время загрузки: значение могло устареть
+                if not flight.failed and not flight.stale and value is not None:
+                    self._store(key, value)
+            flight.done.set()
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                if key in self._loading:
+                    self._loading[key].stale = True
+
+    def invalidate_where(self, predicate):
+        """Сбросить все ключи, для которых predicate(ключ) истинно"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+            for key, flight in self._loading.items():
+                if predicate(key):
+                    flight.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            for flight in self._loading.values():
+                flight.stale = True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,357 @@
+"""Генератор синтетических данных для проверки производительности.
+
+Заполняет пустую БД согласованными данными (группы, преподаватели, студенты,
+дисциплины, расписание, отметки) через COPY. Результат полностью определяется
+параметрами и --seed, поэтому проблему можно воспроизвести на той же выборке:
+
+    python datagen.py --database attendance_big --groups 1000 --students-per-group 25 --weeks 36
+    python datagen.py --database attendance_big --truncate --statuses "Присутствовал=70,Отсутствовал=20,Опоздал=10"
+
+На время загрузки у schedule, attendance и сводных таблиц снимаются внешние
+ключи, уникальные ограничения и вторичные индексы: они создаются заново
+одним проходом после загрузки, что многократно быстрее построчной проверки.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from psycopg2 import Error
+
+from db import Database
+import migrations
+
+DEFAULT_STATUSES = {
+    'Присутствовал': 80,
+    'Отсутствовал': 10,
+    'Опоздал': 6,
+    'По уважительной причине': 4,
+}
+
+LESSON_TIMES = ('09:00', '10:40', '12:40', '14:20', '16:00', '17:40')
+LESSON_TYPES = ('Лекция', 'Практика', 'Лабораторная', 'Семинар')
+SPECIALIZATIONS = (
+    ('ИВТ', 'Информатика и вычислительная техника'),
+    ('ПМИ', 'Прикладная математика и информатика'),
+    ('ФИЗ', 'Физика'),
+    ('ЭКН', 'Экономика'),
+    ('БИО', 'Биология'),
+    ('ЛИН', 'Лингвистика'),
+)
+SUBJECTS = (
+    'Математический анализ', 'Линейная алгебра', 'Программирование', 'Базы данных', 'Физика',
+    'Дискретная математика', 'Операционные системы', 'Компьютерные сети', 'Экономическая теория',
+    'Философия', 'Английский язык', 'История', 'Теория вероятностей', 'Алгоритмы и структуры данных',
+    'Физическая культура', 'Численные методы', 'Информационная безопасность', 'Статистика',
+)
+SURNAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+    'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров',
+    'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин',
+    'Захаров', 'Зайцев', 'Соловьев', 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьев',
+)
+MALE_NAMES = ('Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Иван', 'Кирилл',
+              'Михаил', 'Никита', 'Егор', 'Артем')
+FEMALE_NAMES = ('Анна', 'Мария', 'Елена', 'Дарья', 'Алина', 'Ольга', 'Полина', 'Екатерина',
+                'Виктория', 'Ксения', 'Софья', 'Юлия')
+PATRONYMICS = ('Александров', 'Дмитриев', 'Сергеев', 'Андреев', 'Алексеев', 'Иванов',
+               'Михайлов', 'Николаев', 'Петров', 'Викторов')
+
+# Сколько строк attendance собирать в один кусок потока COPY
+COPY_CHUNK_LESSONS = 200
+
+# Размер блока, которым psycopg2 читает поток COPY
+COPY_BUFFER_SIZE = 1 << 16
+
+
+class CopyStream:
+    """Файлоподобный объект для COPY FROM STDIN поверх генератора строк"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size=-1):
+        while self._pos >= len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._buffer, self._pos = chunk.encode('utf-8'), 0
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+
+def copy_rows(cur, table, columns, rows):
+    """Загрузить строки (кортежи) в таблицу через COPY; None пишется как NULL"""
+    def lines():
+        batch = []
+        for row in rows:
+            batch.append('\t'.join('\\N' if value is None else str(value) for value in row))
+            if len(batch) >= 10000:
+                yield '\n'.join(batch) + '\n'
+                batch = []
+        if batch:
+            yield '\n'.join(batch) + '\n'
+
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", CopyStream(lines()), COPY_BUFFER_SIZE)
+
+
+def person_name(rng):
+    if rng.random() < 0.5:
+        return f"{rng.choice(SURNAMES)} {rng.choice(MALE_NAMES)} {rng.choice(PATRONYMICS)}ич"
+    return f"{rng.choice(SURNAMES)}а {rng.choice(FEMALE_NAMES)} {rng.choice(PATRONYMICS)}на"
+
+
+def parse_statuses(text):
+    """'Присутствовал=80,Отсутствовал=20' -> {'Присутствовал': 80, 'Отсутствовал': 20}"""
+    statuses = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_STATUSES:
+            raise ValueError(f"Неизвестный статус: {name}")
+        statuses[name] = float(weight)
+    if not statuses or sum(statuses.values()) <= 0:
+        raise ValueError("Нужен хотя бы один статус с положительным весом")
+    return statuses
+
+
+def detach_constraints(cur, table):
+    """Снять внешние ключи, уникальность и вторичные индексы таблицы.
+
+    Возвращает SQL, который создает их заново.
+    """
+    # Копии внешнего ключа на секции секционированной таблицы (conparentid <> 0)
+    # удаляются и создаются вместе с родительским ограничением
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('f', 'u') AND conparentid = 0
+    """, (table,))
+    constraints = cur.fetchall()
+    cur.execute("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    """, (table,))
+    indexes = cur.fetchall()
+
+    for name, _ in constraints:
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX "{name}"')
+
+    restore = [definition for _, definition in indexes]
+    restore += [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}' for name, definition in constraints]
+    return restore
+
+
+def generate(db, groups=100, students_per_group=25, teachers=None, disciplines=None,
+             disciplines_per_group=6, weeks=18, future_weeks=1, lessons_per_day=3,
+             statuses=None, seed=1, truncate=False, today=None, log=print):
+    """Заполнить БД; возвращает число загруженных строк по таблицам"""
+    rng = random.Random(seed)
+    today = today or date.today()
+    statuses = statuses or DEFAULT_STATUSES
+    teachers = teachers or max(1, groups // 2)
+    disciplines = disciplines or max(disciplines_per_group, groups)
+    disciplines_per_group = min(disciplines_per_group, disciplines)
+    lessons_per_day = min(lessons_per_day, len(LESSON_TIMES))
+    counts = {}
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        step_started = time.monotonic()
+
+        def step(name, rows_count=None):
+            nonlocal step_started
+            elapsed = time.monotonic() - step_started
+            suffix = f": {rows_count} строк" if rows_count is not None else ""
+            log(f"{name}{suffix} ({elapsed:.1f} с)")
+            step_started = time.monotonic()
+
+        # Память под построение индексов после загрузки
+        cur.execute("SET LOCAL maintenance_work_mem = '256MB'")
+
+        if truncate:
+            cur.execute("TRUNCATE attendance, schedule, group_disciplines, disciplines, users, "
+                        "student_groups, attendance_daily_stats, student_discipline_stats, teacher_groups "
+                        "RESTART IDENTITY CASCADE")
+        else:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM student_groups)")
+            if cur.fetchone()[0]:
+                raise ValueError("БД не пуста: запустите с --truncate, чтобы очистить таблицы")
+
+        # Группы
+        group_rows = []
+        for g in range(1, groups + 1):
+            abbr, specialization = SPECIALIZATIONS[(g - 1) % len(SPECIALIZATIONS)]
+            year = 1 + (g - 1) // len(SPECIALIZATIONS) % 4
+            group_rows.append((g, f"{abbr}-{year}{g:04d}", specialization, year))
+        copy_rows(cur, 'student_groups', ('id', 'group_code', 'specialization', 'year_of_study'), group_rows)
+        counts['student_groups'] = len(group_rows)
+
+        # Пользователи: преподаватели, администратор, студенты группами подряд
+        user_rows = [(t, f"teacher{t}", 'teacher123', person_name(rng), 'Преподаватель',
+                      f"teacher{t}@university.ru", None) for t in range(1, teachers + 1)]
+        admin_id = teachers + 1
+        user_rows.append((admin_id, 'admin', 'admin123', 'Администратор Системы', 'Администратор', None, None))
+        first_student = admin_id + 1
+        for g in range(groups):
+            for i in range(students_per_group):
+                number = g * students_per_group + i + 1
+                user_rows.append((first_student + number - 1, f"student{number}", 'student123', person_name(rng),
+                                  'Студент', f"student{number}@university.ru", g + 1))
+        copy_rows(cur, 'users', ('id', 'login', 'password_hash', 'full_name', 'role', 'email', 'group_id'),
+                  user_rows)
+        counts['users'] = len(user_rows)
+
+        # Дисциплины и их распределение по группам
+        discipline_teacher = {}
+        discipline_rows = []
+        for d in range(1, disciplines + 1):
+            subject = SUBJECTS[(d - 1) % len(SUBJECTS)]
+            cycle = (d - 1) // len(SUBJECTS)
+            name = subject if cycle == 0 else f"{subject} ({cycle + 1})"
+            teacher_id = rng.randint(1, teachers)
+            discipline_teacher[d] = teacher_id
+            discipline_rows.append((d, name, rng.choice((36, 72, 108, 144)), teacher_id))
+        copy_rows(cur, 'disciplines', ('id', 'name', 'total_hours', 'teacher_id'), discipline_rows)
+        counts['disciplines'] = len(discipline_rows)
+
+        group_disciplines = {g: rng.sample(range(1, disciplines + 1), disciplines_per_group)
+                             for g in range(1, groups + 1)}
+        copy_rows(cur, 'group_disciplines', ('group_id', 'discipline_id', 'semester'),
+                  ((g, d, 1) for g, ids in group_disciplines.items() for d in ids))
+        counts['group_disciplines'] = groups * disciplines_per_group
+        step('Справочники и пользователи', counts['users'])
+
+        # Расписание: по дням, внутри дня по группам - как оно наполняется в жизни
+        start = today - timedelta(days=today.weekday()) - timedelta(weeks=weeks - future_weeks)
+        lessons = []  # (schedule_id, group_id, teacher_id, дата занятия, момент отметки)
+        schedule_rows = []
+        for day_index in range(weeks * 7):
+            day = start + timedelta(days=day_index)
+            if day.weekday() >= 5:
+                continue
+            for g in range(1, groups + 1):
+                for slot in range(lessons_per_day):
+                    schedule_id = len(schedule_rows) + 1
+                    discipline_id = rng.choice(group_disciplines[g])
+                    teacher_id = discipline_teacher[discipline_id]
+                    schedule_rows.append((schedule_id, discipline_id, g, teacher_id, day, LESSON_TIMES[slot],
+                                          str(rng.randint(100, 599)), rng.choice(LESSON_TYPES)))
+                    if day < today:
+                        lessons.append((schedule_id, g, teacher_id, day.isoformat(),
+                                        f"{day.isoformat()} {LESSON_TIMES[slot]}:00"))
+        cur.execute("SELECT create_month_partitions(%s, %s)", (start, start + timedelta(weeks=weeks)))
+        restore = detach_constraints(cur, 'schedule')
+        copy_rows(cur, 'schedule', ('id', 'discipline_id', 'group_id', 'teacher_id', 'lesson_date',
+                                    'lesson_time', 'classroom', 'lesson_type'), schedule_rows)
+        counts['schedule'] = len(schedule_rows)
+        del schedule_rows
+        step('Расписание', counts['schedule'])
+
+        # Отметки: каждый студент группы на каждом прошедшем занятии
+        names = list(statuses)
+        cum_weights = []
+        total = 0
+        for name in names:
+            total += statuses[name]
+            cum_weights.append(total)
+
+        def attendance_chunks():
+            parts = []
+            for n, (schedule_id, group_id, teacher_id, lesson_date, marked_at) in enumerate(lessons, 1):
+                first = first_student + (group_id - 1) * students_per_group
+                picked = rng.choices(names, cum_weights=cum_weights, k=students_per_group)
+                suffix = f"\t{teacher_id}\t{marked_at}\t{lesson_date}\n"
+                parts.extend(f"{first + i}\t{schedule_id}\t{status}{suffix}" for i, status in enumerate(picked))
+                if n % COPY_CHUNK_LESSONS == 0:
+                    yield ''.join(parts)
+                    parts = []
+            if parts:
+                yield ''.join(parts)
+
+        restore += detach_constraints(cur, 'attendance')
+        cur.execute("ALTER TABLE attendance DISABLE TRIGGER USER")
+        cur.copy_expert("COPY attendance (student_id, schedule_id, status, marked_by, marked_at, lesson_date) "
+                        "FROM STDIN",
+                        CopyStream(attendance_chunks()), COPY_BUFFER_SIZE)
+        counts['attendance'] = len(lessons) * students_per_group
+        cur.execute("ALTER TABLE attendance ENABLE TRIGGER USER")
+        step('Отметки посещаемости', counts['attendance'])
+
+        for statement in restore:
+            cur.execute(statement)
+        step('Индексы и ограничения schedule и attendance')
+
+        for table in ('users', 'student_groups', 'disciplines', 'group_disciplines', 'schedule', 'attendance'):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        # Статистика нужна планировщику уже для пересчета сводных таблиц
+        cur.execute("ANALYZE")
+        restore = detach_constraints(cur, 'attendance_daily_stats')
+        restore += detach_constraints(cur, 'student_discipline_stats')
+        cur.execute(migrations.REBUILD_STATS_SQL)
+        for statement in restore:
+            cur.execute(statement)
+        cur.execute("ANALYZE attendance_daily_stats")
+        cur.execute("ANALYZE student_discipline_stats")
+        conn.commit()
+        step('Сводные таблицы и статистика')
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических данных системы посещаемости')
+    parser.add_argument('--host')
+    parser.add_argument('--database')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--students-per-group', type=int, default=25)
+    parser.add_argument('--teachers', type=int, help='по умолчанию - половина числа групп')
+    parser.add_argument('--disciplines', type=int, help='по умолчанию - по числу групп')
+    parser.add_argument('--disciplines-per-group', type=int, default=6)
+    parser.add_argument('--weeks', type=int, default=18, help='недель расписания, включая будущие')
+    parser.add_argument('--future-weeks', type=int, default=1, help='сколько из них после текущей даты')
+    parser.add_argument('--lessons-per-day', type=int, default=3)
+    parser.add_argument('--statuses', help='веса статусов, например "Присутствовал=80,Отсутствовал=20"')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', type=date.fromisoformat,
+                        help='дата, от которой отсчитывается расписание (ГГГГ-ММ-ДД), по умолчанию текущая')
+    parser.add_argument('--truncate', action='store_true', help='очистить таблицы перед загрузкой')
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ('host', 'database', 'user', 'password') if getattr(args, key)}
+    db = Database(minconn=1, maxconn=1, **params)
+    if not db.connect():
+        raise SystemExit(1)
+
+    try:
+        migrations.migrate(db)
+        started = time.monotonic()
+        counts = generate(
+            db, groups=args.groups, students_per_group=args.students_per_group, teachers=args.teachers,
+            disciplines=args.disciplines, disciplines_per_group=args.disciplines_per_group, weeks=args.weeks,
+            future_weeks=args.future_weeks, lessons_per_day=args.lessons_per_day,
+            statuses=parse_statuses(args.statuses) if args.statuses else None,
+            seed=args.seed, truncate=args.truncate, today=args.today,
+        )
+        print(f"Загружено за {time.monotonic() - started:.1f} с: "
+              + ', '.join(f"{table} {count}" for table, count in counts.items()))
+    except (Error, ValueError) as e:
+        print(f"Ошибка генерации данных: {e}")
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
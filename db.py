@@ -1,87 +1,584 @@
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import Error
-import pandas as pd
+from psycopg2 import Error, OperationalError, InterfaceError
+from psycopg2.errors import InvalidSqlStatementName
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection
+from psycopg2.pool import PoolError
+
+# Канал NOTIFY, в который публикуются сохраненные отметки посещаемости
+ATTENDANCE_CHANNEL = 'attendance_changes'
+
+# Сколько символов примечания попадает в уведомление (лимит NOTIFY - 8000 байт)
+NOTIFY_NOTES_LENGTH = 500
+
+# Вставка или обновление отметок группы; каждая сохраненная отметка публикуется
+# в канал ATTENDANCE_CHANNEL, NOTIFY доставляется слушателям после commit; занятие
+# ищется по id и дате один раз, чтобы читалась одна секция schedule
+ATTENDANCE_UPSERT_SQL = """
+WITH lesson AS (
+    SELECT s.id, s.lesson_date, s.group_id, d.name AS discipline, g.group_code
+    FROM schedule s
+    JOIN disciplines d ON d.id = s.discipline_id
+    JOIN student_groups g ON g.id = s.group_id
+    WHERE s.id = %s AND s.lesson_date = %s
+),
+saved AS (
+    INSERT INTO attendance (student_id, schedule_id, lesson_date, status, notes, marked_by)
+    SELECT v.student_id, l.id, l.lesson_date, v.status, v.notes, %s::bigint
+    FROM unnest(%s::bigint[], %s::text[], %s::text[]) AS v(student_id, status, notes)
+    CROSS JOIN lesson l
+    JOIN users u ON u.id = v.student_id AND u.role = 'Студент' AND u.group_id = l.group_id
+    ON CONFLICT (student_id, schedule_id, lesson_date) DO UPDATE
+    SET status = EXCLUDED.status, notes = EXCLUDED.notes,
+        marked_by = EXCLUDED.marked_by, marked_at = CURRENT_TIMESTAMP
+    RETURNING student_id, status, notes, marked_at
+)
+SELECT saved.student_id,
+       pg_notify('""" + ATTENDANCE_CHANNEL + """', json_build_object(
+           'schedule_id', l.id,
+           'student_id', saved.student_id,
+           'student_name', u.full_name,
+           'group_code', l.group_code,
+           'discipline', l.discipline,
+           'status', saved.status,
+           'notes', left(saved.notes, """ + str(NOTIFY_NOTES_LENGTH) + """),
+           'marked_at', saved.marked_at
+       )::text)
+FROM saved
+CROSS JOIN lesson l
+JOIN users u ON u.id = saved.student_id
+"""
+
+USER_BY_LOGIN_SQL = """
+SELECT id, login, password_hash, full_name, role, group_id
+FROM users
+WHERE login = %s
+"""
+
+# Параметры %s в тексте запроса и экранированный знак процента
+_PLACEHOLDER = re.compile(r'%[s%]')
+
+# Рабочему потоку execute_batch не досталось свободного соединения
+_POOL_BUSY = object()
+
+
+class PreparedConnection(PgConnection):
+    """Соединение, которое помнит имена подготовленных на нем запросов (PREPARE)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений с проверкой при выдаче"""
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0, check_interval=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные границы пула: minconn=%s, maxconn=%s" % (minconn, maxconn))
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.closed = False
+
+        self._cond = threading.Condition()
+        self._idle = []  # пары (соединение, время возврата в пул)
+        self._size = 0   # открытые соединения: свободные + выданные
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self, timeout=None):
+        """Выдать соединение; при исчерпании пула ждать не дольше timeout
+        (по умолчанию - таймаут пула, 0 - не ждать)"""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise PoolError("пул соединений закрыт")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Резервируем место под новое соединение, открываем вне блокировки
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError("пул соединений исчерпан")
+                self._cond.wait(remaining)
+
+        if conn is not None:
+            if self._is_healthy(conn, returned_at):
+                return conn
+            # Битое соединение заменяем новым, не освобождая его место в пуле
+            self._close_quietly(conn)
+
+        return self._open()
+
+    def putconn(self, conn, discard=False):
+        """Вернуть соединение в пул; битые и лишние соединения закрываются"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Error:
+                discard = True
+
+        with self._cond:
+            if self.closed or discard or conn.closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Закрыть пул и все свободные соединения"""
+        with self._cond:
+            self.closed = True
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        # Давно простаивающие соединения могли быть разорваны сервером
+        if time.monotonic() - returned_at < self.check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
 
 class Database:
-    def __init__(self, host='localhost', database='attendance_db', user='postgres', password='123654789'):
+    def __init__(self, host='localhost', database='attendance_db', user='postgres', password='123654789',
+                 minconn=1, maxconn=10, itersize=2000):
         self.host = host
         self.database = database
         self.user = user
         self.password = password
-        self.conn = None
+        self.minconn = minconn
+        self.maxconn = maxconn
+        # Сколько строк за раз читают iter_query/iter_chunks из серверного курсора
+        self.itersize = itersize
+        self.pool = None
+        self._local = threading.local()
+        self._query_observers = []
+        self._executor = None
+        # Реестр подготавливаемых запросов: имя -> (sql с %s, sql с $n, число параметров)
+        self._statements = {}
+        self._statement_stats = {}
+        self._stats_lock = threading.Lock()
+        self.prepare('user_by_login', USER_BY_LOGIN_SQL)
+        self.prepare('attendance_upsert', ATTENDANCE_UPSERT_SQL)
+
+    def add_query_observer(self, callback):
+        """Подписаться на выполненные запросы: callback(query, seconds, rows)"""
+        self._query_observers.append(callback)
+
+    def _observe(self, query, started, rows):
+        elapsed = time.perf_counter() - started
+        for callback in self._query_observers:
+            callback(query, elapsed, rows)
 
     def connect(self):
         try:
-            self.conn = psycopg2.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
+            self.pool = ConnectionPool(self._new_connection, self.minconn, self.maxconn)
+            # Не больше половины пула: остальное - соединениям, закрепленным за запросами
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.maxconn // 2),
+                                                thread_name_prefix='db-batch')
             return True
         except Error as e:
             print(f"Ошибка подключения: {e}")
             return False
 
+    def _new_connection(self):
+        return psycopg2.connect(
+            host=self.host,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            connection_factory=PreparedConnection
+        )
+
+    def listen_connection(self):
+        """Отдельное соединение вне пула в режиме autocommit (для LISTEN)"""
+        conn = self._new_connection()
+        conn.autocommit = True
+        return conn
+
     def close(self):
-        if self.conn:
-            self.conn.close()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.pool:
+            self.pool.closeall()
+
+    def begin_request(self):
+        """Начать запрос: первое обращение к БД закрепит соединение до end_request"""
+        if self.pool:
+            self._local.scoped = True
+
+    def end_request(self):
+        """Завершить запрос и вернуть закрепленное соединение в пул"""
+        self._local.scoped = False
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            self.pool.putconn(conn, discard=getattr(self._local, 'broken', False))
+        self._local.broken = False
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула: закрепленное за текущим запросом или на одну операцию"""
+        conn = getattr(self._local, 'conn', None)
+        scoped = conn is not None or getattr(self._local, 'scoped', False)
+        if conn is None:
+            conn = self.pool.getconn()
+            if scoped:
+                self._local.conn = conn
+
+        broken = False
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            broken = True
+            raise
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            if scoped:
+                if broken:
+                    self._local.broken = True
+            else:
+                self.pool.putconn(conn, discard=broken)
 
     def execute_query(self, query, params=None, fetch=True):
-        if not self.conn:
+        if not self.pool:
             print("Нет соединения с БД")
             return None
-        
+
+        started = time.perf_counter()
         try:
-            cur = self.conn.cursor()
-            if params:
-                cur.execute(query, params)
-            else:
-                cur.execute(query)
-            
-            if fetch and query.strip().upper().startswith('SELECT'):
-                result = cur.fetchall()
-            else:
-                result = None
-            
-            cur.close()
-            return result
+            with self.connection() as conn:
+                cur = conn.cursor()
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+
+                if fetch and query.strip().upper().startswith(('SELECT', 'WITH')):
+                    result = cur.fetchall()
+                else:
+                    result = None
+
+                cur.close()
+                self._observe(query, started, len(result) if result is not None else 0)
+                return result
         except Error as e:
+            self._observe(query, started, 0)
             print(f"Ошибка выполнения запроса: {e}")
             print(f"Запрос: {query}")
             if params:
                 print(f"Параметры: {params}")
             return None
 
+    def execute_batch(self, queries):
+        """Выполнить независимые запросы одновременно: {имя: (sql, параметры)} -> {имя: строки}.
+
+        Первый запрос идет через соединение текущего запроса, остальные -
+        в рабочих потоках, каждый на своем соединении из пула. Рабочий поток
+        не ждет соединения: если свободных в пуле нет, его запрос выполняется
+        следом на соединении текущего запроса, так что пакет не может
+        исчерпать пул. Ошибка отдельного запроса дает None под его именем,
+        как в execute_query.
+        """
+        items = list(queries.items())
+        if not items:
+            return {}
+        if not self.pool or len(items) == 1:
+            return {name: self.execute_query(query, params) for name, (query, params) in items}
+
+        # Копия контекста на каждый запрос: наблюдатели видят контекст Flask
+        futures = [
+            (name, self._executor.submit(contextvars.copy_context().run, self._execute_if_free, query, params))
+            for name, (query, params) in items[1:]
+        ]
+        name, (query, params) = items[0]
+        results = {name: self.execute_query(query, params)}
+        for name, future in futures:
+            results[name] = future.result()
+            if results[name] is _POOL_BUSY:
+                query, params = queries[name]
+                results[name] = self.execute_query(query, params)
+        return {name: results[name] for name, _ in items}
+
+    def _execute_if_free(self, query, params):
+        """Запрос рабочего потока на свободном соединении пула или _POOL_BUSY"""
+        try:
+            self._local.conn = self.pool.getconn(timeout=0)
+        except PoolError:
+            return _POOL_BUSY
+        try:
+            return self.execute_query(query, params)
+        finally:
+            self.end_request()
+
+    def iter_chunks(self, query, params=None, size=None):
+        """Результат запроса списками по size строк из именованного (серверного) курсора.
+
+        Память не зависит от размера результата. Генератор берет собственное
+        соединение из пула, а не закрепленное за запросом, поэтому его можно
+        читать и после того, как обработчик вернул ответ (потоковая выдача).
+        Соединение возвращается в пул, когда генератор исчерпан или закрыт.
+        Ошибка БД после записи в лог пробрасывается дальше: потоковый ответ
+        обрывается, а не заканчивается молча на неполных данных.
+        """
+        if not self.pool:
+            print("Нет соединения с БД")
+            return
+
+        size = size or self.itersize
+        started = time.perf_counter()
+        rows = 0
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            cur = conn.cursor(name=f'iter_{id(conn):x}_{time.monotonic_ns()}')
+            cur.itersize = size
+            cur.execute(query, params or None)
+            while True:
+                chunk = cur.fetchmany(size)
+                if not chunk:
+                    break
+                rows += len(chunk)
+                yield chunk
+            cur.close()
+        except (OperationalError, InterfaceError) as e:
+            broken = True
+            print(f"Ошибка чтения результата запроса: {e}")
+            raise
+        except Error as e:
+            print(f"Ошибка чтения результата запроса: {e}")
+            raise
+        finally:
+            self._observe(query, started, rows)
+            self.pool.putconn(conn, discard=broken)
+
+    def iter_query(self, query, params=None, itersize=None):
+        """Строки запроса по одной; из БД читаются пачками по itersize (см. iter_chunks)"""
+        for chunk in self.iter_chunks(query, params, itersize):
+            yield from chunk
+
+    def prepare(self, name, query):
+        """Зарегистрировать частый запрос (SQL с %s) для execute_prepared.
+
+        На каждом соединении пула запрос подготавливается (PREPARE) при первом
+        вызове, дальше выполняется по имени (EXECUTE) без разбора и
+        планирования текста.
+        """
+        count = 0
+
+        def positional(match):
+            nonlocal count
+            if match.group() == '%%':
+                return '%'
+            count += 1
+            return f'${count}'
+
+        self._statements[name] = (query, _PLACEHOLDER.sub(positional, query), count)
+        self._statement_stats.setdefault(name, {'calls': 0, 'prepares': 0})
+
+    def statement_sql(self, name):
+        """Текст зарегистрированного запроса (с %s)"""
+        return self._statements[name][0]
+
+    def statement_stats(self):
+        """Число вызовов и подготовок по зарегистрированным запросам, частые первыми"""
+        with self._stats_lock:
+            stats = {name: dict(counts) for name, counts in self._statement_stats.items()}
+        return dict(sorted(stats.items(), key=lambda item: -item[1]['calls']))
+
+    def _count_statement(self, name, key):
+        with self._stats_lock:
+            self._statement_stats[name][key] += 1
+
+    def _execute_statement(self, conn, cur, name, params):
+        """EXECUTE по имени; PREPARE, если на этом соединении запрос еще не готовился.
+
+        Если сервер потерял подготовленный запрос (соединение сброшено через
+        DISCARD ALL или пересоздано за пулом), он подготавливается заново -
+        когда до вызова не было открытой транзакции, терять в ней нечего.
+        """
+        _, positional, count = self._statements[name]
+        prepared = getattr(conn, 'prepared', None)
+        if prepared is None:
+            prepared = conn.prepared = set()
+        idle = conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        execute = f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f"EXECUTE {name}"
+
+        for attempt in (1, 2):
+            if name not in prepared:
+                cur.execute(f"PREPARE {name} AS {positional}")
+                prepared.add(name)
+                self._count_statement(name, 'prepares')
+            try:
+                cur.execute(execute, params or None)
+                break
+            except InvalidSqlStatementName:
+                if attempt == 2 or not idle:
+                    raise
+                conn.rollback()
+                prepared.clear()
+        self._count_statement(name, 'calls')
+
+    def execute_prepared(self, name, params=None, fetch=True):
+        """Выполнить зарегистрированный запрос; результат - как у execute_query"""
+        if not self.pool:
+            print("Нет соединения с БД")
+            return None
+
+        query = self._statements[name][0]
+        started = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor()
+                self._execute_statement(conn, cur, name, params)
+                result = cur.fetchall() if fetch and cur.description is not None else None
+                cur.close()
+                self._observe(query, started, len(result) if result is not None else 0)
+                return result
+        except Error as e:
+            self._observe(query, started, 0)
+            print(f"Ошибка выполнения запроса {name}: {e}")
+            if params:
+                print(f"Параметры: {params}")
+            return None
+
     def execute_insert(self, query, params=None, return_id=False):
-        if not self.conn:
+        if not self.pool:
             print("Нет соединения с БД")
             return False
-        
+
+        started = time.perf_counter()
         try:
-            cur = self.conn.cursor()
-            if params:
-                cur.execute(query, params)
-            else:
-                cur.execute(query)
-            
-            if return_id and 'RETURNING' in query.upper():
-                result = cur.fetchone()[0]
-            else:
-                result = True
-                
-            self.conn.commit()
-            cur.close()
-            return result if return_id else True
+            with self.connection() as conn:
+                cur = conn.cursor()
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+
+                if return_id and 'RETURNING' in query.upper():
+                    result = cur.fetchone()[0]
+                else:
+                    result = True
+
+                conn.commit()
+                cur.close()
+                self._observe(query, started, 0)
+                return result if return_id else True
         except Error as e:
+            self._observe(query, started, 0)
             print(f"Ошибка вставки/обновления данных: {e}")
-            self.conn.rollback()
             return False
 
+    def estimate_count(self, query, params=None):
+        """Оценка числа строк запроса по плану (EXPLAIN), без его выполнения"""
+        if not self.pool:
+            return None
+
+        started = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("EXPLAIN (FORMAT JSON) " + query, params or None)
+                plan = cur.fetchone()[0][0]['Plan']
+                cur.close()
+                self._observe("EXPLAIN (FORMAT JSON) " + query, started, 1)
+                return int(plan['Plan Rows'])
+        except Error as e:
+            print(f"Ошибка оценки количества строк: {e}")
+            return None
+
+    def upsert_attendance_batch(self, schedule_id, lesson_date, marks, marked_by):
+        """Записать отметки группы одним запросом в одной транзакции.
+
+        Дата занятия lesson_date ограничивает поиск одной секцией schedule.
+        marks - список кортежей (student_id, status, notes). Учитываются только
+        студенты группы, к которой относится занятие. Возвращает множество
+        id студентов, для которых отметка сохранена, или None при ошибке.
+        """
+        if not self.pool:
+            print("Нет соединения с БД")
+            return None
+
+        student_ids = [int(mark[0]) for mark in marks]
+        statuses = [mark[1] for mark in marks]
+        notes = [mark[2] for mark in marks]
+
+        started = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor()
+                self._execute_statement(conn, cur, 'attendance_upsert',
+                                        (schedule_id, lesson_date, marked_by, student_ids, statuses, notes))
+                saved = {row[0] for row in cur.fetchall()}
+                conn.commit()
+                cur.close()
+                self._observe(ATTENDANCE_UPSERT_SQL, started, len(saved))
+                return saved
+        except Error as e:
+            print(f"Ошибка сохранения посещаемости: {e}")
+            return None
+
+    def upsert_attendance(self, student_id, schedule_id, lesson_date, status, notes, marked_by):
+        """Отметить одного студента: вставка или обновление одним запросом"""
+        saved = self.upsert_attendance_batch(schedule_id, lesson_date, [(student_id, status, notes)], marked_by)
+        return bool(saved) and student_id in saved
+
     def get_id_by_name(self, table, column, value):
-        if not self.conn:
+        if not self.pool:
             return None
-        
+
         try:
             query = f"SELECT id FROM {table} WHERE {column} = %s"
             result = self.execute_query(query, (value,))
@@ -91,9 +588,4 @@ class Database:
             return None
 
     def get_user_by_login(self, login):
-        query = """
-        SELECT id, login, password_hash, full_name, role, group_id 
-        FROM users 
-        WHERE login = %s
-        """
-        return self.execute_query(query, (login,))
\ No newline at end of file
+        return self.execute_prepared('user_by_login', (login,))
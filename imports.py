@@ -0,0 +1,287 @@
+"""Пакетная загрузка студентов и расписания из CSV.
+
+Файл целиком проверяется в Python (обязательные поля, форматы, повторы
+внутри файла), затем корректные строки загружаются через COPY во временную
+промежуточную таблицу. Коды групп, логины преподавателей и названия
+дисциплин сопоставляются с id одним UPDATE ... FROM на справочник, занятые
+логины и слоты расписания находятся одним соединением с users/schedule.
+Оставшиеся строки вставляются одним INSERT ... SELECT в той же транзакции.
+
+Результат - словарь с числом строк, числом загруженных и списком ошибок
+(номер строки файла, сообщение).
+"""
+import csv
+import io
+from datetime import datetime
+
+from psycopg2 import Error
+
+LESSON_TYPES = ('Лекция', 'Практика', 'Лабораторная', 'Семинар')
+
+# Колонки файлов: обязательные и необязательные
+STUDENT_COLUMNS = ('login', 'password', 'full_name', 'group_code')
+STUDENT_OPTIONAL_COLUMNS = ('email', 'phone')
+SCHEDULE_COLUMNS = ('group_code', 'discipline', 'teacher_login', 'lesson_date', 'lesson_time', 'lesson_type')
+SCHEDULE_OPTIONAL_COLUMNS = ('classroom',)
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+TIME_FORMATS = ('%H:%M', '%H:%M:%S')
+
+STUDENTS_STAGING_SQL = """
+CREATE TEMP TABLE import_students(
+    line INTEGER PRIMARY KEY,
+    login TEXT NOT NULL,
+    password TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    group_code TEXT NOT NULL,
+    email TEXT,
+    phone TEXT,
+    group_id BIGINT,
+    error TEXT
+) ON COMMIT DROP
+"""
+
+# Сопоставление и проверки: каждый шаг - один проход по справочнику. Временные
+# таблицы не анализируются автоматически, статистику собираем после COPY
+STUDENTS_RESOLVE_SQL = """
+ANALYZE import_students;
+
+UPDATE import_students st SET group_id = g.id
+FROM student_groups g WHERE g.group_code = st.group_code;
+
+UPDATE import_students SET error = 'Группа не найдена'
+WHERE group_id IS NULL;
+
+UPDATE import_students st SET error = 'Пользователь с таким логином уже существует'
+FROM users u WHERE u.login = st.login AND st.error IS NULL;
+"""
+
+STUDENTS_INSERT_SQL = """
+INSERT INTO users (login, password_hash, full_name, role, email, phone, group_id)
+SELECT login, password, full_name, 'Студент', email, phone, group_id
+FROM import_students
+WHERE error IS NULL
+ORDER BY line
+"""
+
+SCHEDULE_STAGING_SQL = """
+CREATE TEMP TABLE import_schedule(
+    line INTEGER PRIMARY KEY,
+    group_code TEXT NOT NULL,
+    discipline TEXT NOT NULL,
+    teacher_login TEXT NOT NULL,
+    lesson_date DATE NOT NULL,
+    lesson_time TIME NOT NULL,
+    lesson_type TEXT NOT NULL,
+    classroom TEXT,
+    group_id BIGINT,
+    teacher_id BIGINT,
+    discipline_id BIGINT,
+    error TEXT
+) ON COMMIT DROP
+"""
+
+# Дисциплина ищется по названию; если названий несколько - среди дисциплин
+# преподавателя из той же строки
+SCHEDULE_RESOLVE_SQL = """
+ANALYZE import_schedule;
+
+UPDATE import_schedule st SET group_id = g.id
+FROM student_groups g WHERE g.group_code = st.group_code;
+
+UPDATE import_schedule st SET teacher_id = u.id
+FROM users u WHERE u.login = st.teacher_login AND u.role = 'Преподаватель';
+
+UPDATE import_schedule st SET discipline_id = d.id
+FROM (
+    SELECT name, MIN(id) AS id FROM disciplines
+    WHERE name IN (SELECT discipline FROM import_schedule)
+    GROUP BY name HAVING COUNT(*) = 1
+) d
+WHERE d.name = st.discipline;
+
+UPDATE import_schedule st SET discipline_id = d.id
+FROM disciplines d
+WHERE st.discipline_id IS NULL AND d.name = st.discipline AND d.teacher_id = st.teacher_id;
+
+UPDATE import_schedule SET error = CASE
+    WHEN group_id IS NULL THEN 'Группа не найдена'
+    WHEN teacher_id IS NULL THEN 'Преподаватель не найден'
+    ELSE 'Дисциплина не найдена или неоднозначна'
+END
+WHERE group_id IS NULL OR teacher_id IS NULL OR discipline_id IS NULL;
+
+UPDATE import_schedule st SET error = 'В это время у группы уже есть занятие'
+FROM schedule s
+WHERE st.error IS NULL AND s.group_id = st.group_id
+  AND s.lesson_date = st.lesson_date AND s.lesson_time = st.lesson_time;
+"""
+
+SCHEDULE_INSERT_SQL = """
+SELECT create_month_partitions(MIN(lesson_date), MAX(lesson_date))
+FROM import_schedule
+WHERE error IS NULL;
+
+INSERT INTO schedule (discipline_id, group_id, teacher_id, lesson_date, lesson_time, classroom, lesson_type)
+SELECT discipline_id, group_id, teacher_id, lesson_date, lesson_time, classroom, lesson_type
+FROM import_schedule
+WHERE error IS NULL
+ORDER BY line
+"""
+
+
+def read_csv(data, required, optional=()):
+    """Строки CSV-файла: (список (номер строки, словарь), ошибки).
+
+    Разделитель (запятая, точка с запятой, табуляция) определяется по
+    заголовку; BOM, который добавляет Excel, отбрасывается.
+    """
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return [], [(0, 'Файл должен быть в кодировке UTF-8')]
+    data = data.lstrip('\ufeff')
+
+    header_line = data.split('\n', 1)[0]
+    delimiter = max(',;\t', key=header_line.count)
+    reader = csv.reader(io.StringIO(data), delimiter=delimiter)
+    header = [name.strip().lower() for name in next(reader, [])]
+
+    missing = [name for name in required if name not in header]
+    if missing:
+        return [], [(1, 'Нет обязательных колонок: ' + ', '.join(missing))]
+
+    columns = [(name, header.index(name)) for name in required + tuple(optional) if name in header]
+    rows = []
+    for line, values in enumerate(reader, 2):
+        if not any(value.strip() for value in values):
+            continue
+        rows.append((line, {name: values[i].strip() if i < len(values) else '' for name, i in columns}))
+    return rows, []
+
+
+def _parse(value, formats):
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def validate_students(rows):
+    """Проверка строк студентов без обращения к БД: (корректные кортежи, ошибки)"""
+    valid, errors = [], []
+    seen = {}
+    for line, row in rows:
+        empty = [name for name in STUDENT_COLUMNS if not row[name]]
+        if empty:
+            errors.append((line, 'Не заполнено: ' + ', '.join(empty)))
+        elif len(row['login']) < 3 or len(row['password']) < 3:
+            errors.append((line, 'Логин и пароль должны быть не короче 3 символов'))
+        elif len(row['full_name']) < 2:
+            errors.append((line, 'Слишком короткое ФИО'))
+        elif row['login'] in seen:
+            errors.append((line, f"Логин повторяет строку {seen[row['login']]}"))
+        else:
+            seen[row['login']] = line
+            valid.append((line, row['login'], row['password'], row['full_name'], row['group_code'],
+                          row.get('email') or None, row.get('phone') or None))
+    return valid, errors
+
+
+def validate_schedule(rows):
+    """Проверка строк расписания без обращения к БД: (корректные кортежи, ошибки)"""
+    valid, errors = [], []
+    seen = {}
+    for line, row in rows:
+        empty = [name for name in SCHEDULE_COLUMNS if not row[name]]
+        lesson_date = _parse(row['lesson_date'], DATE_FORMATS)
+        lesson_time = _parse(row['lesson_time'], TIME_FORMATS)
+        if empty:
+            errors.append((line, 'Не заполнено: ' + ', '.join(empty)))
+        elif lesson_date is None:
+            errors.append((line, 'Дата должна быть в формате ГГГГ-ММ-ДД или ДД.ММ.ГГГГ'))
+        elif lesson_time is None:
+            errors.append((line, 'Время должно быть в формате ЧЧ:ММ'))
+        elif row['lesson_type'] not in LESSON_TYPES:
+            errors.append((line, 'Тип занятия должен быть одним из: ' + ', '.join(LESSON_TYPES)))
+        else:
+            slot = (row['group_code'], lesson_date.date(), lesson_time.time())
+            if slot in seen:
+                errors.append((line, f"Занятие группы в это время уже есть в строке {seen[slot]}"))
+                continue
+            seen[slot] = line
+            valid.append((line, row['group_code'], row['discipline'], row['teacher_login'],
+                          slot[1].isoformat(), slot[2].isoformat(), row['lesson_type'],
+                          row.get('classroom') or None))
+    return valid, errors
+
+
+def _copy_csv(cur, table, columns, rows):
+    """Загрузить кортежи во временную таблицу через COPY (формат CSV, None -> NULL)"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _load(db, staging_sql, table, columns, rows, resolve_sql, insert_sql, dry_run):
+    """Промежуточная таблица -> сопоставление -> одна вставка; (загружено, ошибки БД)"""
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(staging_sql)
+        _copy_csv(cur, table, columns, rows)
+        cur.execute(resolve_sql)
+        cur.execute(f"SELECT line, error FROM {table} WHERE error IS NOT NULL ORDER BY line")
+        errors = cur.fetchall()
+        if dry_run:
+            imported = len(rows) - len(errors)
+            conn.rollback()
+        else:
+            cur.execute(insert_sql)
+            imported = cur.rowcount
+            conn.commit()
+        cur.close()
+        return imported, errors
+
+
+def _run(db, rows, errors, load, dry_run):
+    result = {'total': len(rows) + len(errors), 'imported': 0, 'errors': errors, 'dry_run': dry_run}
+    if not rows:
+        return result
+    try:
+        result['imported'], db_errors = load(rows)
+    except Error as e:
+        print(f"Ошибка импорта: {e}")
+        return None
+    result['errors'] = sorted(errors + db_errors)
+    return result
+
+
+def import_students(db, data, dry_run=False):
+    """Импорт студентов из CSV (login, password, full_name, group_code[, email, phone]).
+
+    Возвращает {'total', 'imported', 'errors', 'dry_run'} или None при ошибке
+    БД. При dry_run проверки выполняются полностью, но транзакция
+    откатывается.
+    """
+    rows, errors = read_csv(data, STUDENT_COLUMNS, STUDENT_OPTIONAL_COLUMNS)
+    valid, invalid = validate_students(rows)
+    return _run(db, valid, errors + invalid, lambda staged: _load(
+        db, STUDENTS_STAGING_SQL, 'import_students',
+        ('line', 'login', 'password', 'full_name', 'group_code', 'email', 'phone'), staged,
+        STUDENTS_RESOLVE_SQL, STUDENTS_INSERT_SQL, dry_run), dry_run)
+
+
+def import_schedule(db, data, dry_run=False):
+    """Импорт занятий из CSV (group_code, discipline, teacher_login, lesson_date,
+    lesson_time, lesson_type[, classroom]); результат - как у import_students"""
+    rows, errors = read_csv(data, SCHEDULE_COLUMNS, SCHEDULE_OPTIONAL_COLUMNS)
+    valid, invalid = validate_schedule(rows)
+    return _run(db, valid, errors + invalid, lambda staged: _load(
+        db, SCHEDULE_STAGING_SQL, 'import_schedule',
+        ('line', 'group_code', 'discipline', 'teacher_login', 'lesson_date', 'lesson_time',
+         'lesson_type', 'classroom'), staged,
+        SCHEDULE_RESOLVE_SQL, SCHEDULE_INSERT_SQL, dry_run), dry_run)
@@ -0,0 +1,200 @@
+"""Замеры времени запросов Flask и SQL-запросов внутри них."""
+import bisect
+import json
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+
+logger = logging.getLogger('attendance.requests')
+
+# Границы корзин гистограммы, мс; последняя корзина - все, что дольше
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Сколько символов SQL попадает в лог
+SQL_PREVIEW_LENGTH = 120
+
+
+class RequestMetrics:
+    """Замеры одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # тройки (sql, секунды, строк)
+        self.render_time = 0.0
+        self._render_started = None
+
+    def add_query(self, query, seconds, rows):
+        self.queries.append((query, seconds, rows))
+
+    @property
+    def db_time(self):
+        return sum(seconds for _, seconds, _ in self.queries)
+
+    @property
+    def rows(self):
+        return sum(rows for _, _, rows in self.queries)
+
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+class Histogram:
+    """Распределение длительностей по фиксированным корзинам"""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, fraction):
+        """Верхняя граница корзины, в которую попадает перцентиль"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 2)
+        return round(self.max, 2)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.sum / self.count, 2) if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max, 2),
+            # Число значений по корзинам BUCKETS_MS, последнее - сверх верхней границы
+            'counts': list(self.counts),
+        }
+
+
+class RouteStats:
+    """Гистограммы по маршрутам: общее время, время в БД, число запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, endpoint, metrics, total_ms):
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = {
+                    'total': Histogram(), 'db': Histogram(), 'render': Histogram(), 'queries': 0, 'rows': 0,
+                }
+            route['total'].add(total_ms)
+            route['db'].add(metrics.db_time * 1000)
+            route['render'].add(metrics.render_time * 1000)
+            route['queries'] += len(metrics.queries)
+            route['rows'] += metrics.rows
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, route in self._routes.items():
+                requests_count = route['total'].count
+                result[endpoint] = {
+                    'requests': requests_count,
+                    'queries_per_request': round(route['queries'] / requests_count, 2),
+                    'rows_per_request': round(route['rows'] / requests_count, 2),
+                    'total': route['total'].snapshot(),
+                    'db': route['db'].snapshot(),
+                    'render': route['render'].snapshot(),
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_stats = RouteStats()
+
+
+def current_metrics():
+    """Замеры текущего HTTP-запроса или None вне запроса"""
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+def _on_query(query, seconds, rows):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_query(query, seconds, rows)
+
+
+def _on_before_render(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics._render_started = time.perf_counter()
+
+
+def _on_rendered(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None and metrics._render_started is not None:
+        metrics.render_time += time.perf_counter() - metrics._render_started
+        metrics._render_started = None
+
+
+def _start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def _finish_request(response):
+    metrics = current_metrics()
+    if metrics is None:
+        return response
+
+    total_ms = metrics.total_time() * 1000
+    db_ms = metrics.db_time * 1000
+    render_ms = metrics.render_time * 1000
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={db_ms:.1f};desc="{len(metrics.queries)} queries"',
+        f'render;dur={render_ms:.1f}',
+        f'total;dur={total_ms:.1f}',
+    ])
+
+    endpoint = request.endpoint or 'unknown'
+    route_stats.record(endpoint, metrics, total_ms)
+
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(db_ms, 2),
+        'render_ms': round(render_ms, 2),
+        'queries': len(metrics.queries),
+        'rows': metrics.rows,
+        'query_ms': [
+            {'sql': ' '.join(query.split())[:SQL_PREVIEW_LENGTH], 'ms': round(seconds * 1000, 2), 'rows': rows}
+            for query, seconds, rows in metrics.queries
+        ],
+    }, ensure_ascii=False))
+    return response
+
+
+def init_app(app, *databases):
+    """Подключить замеры к приложению и к базам данных (синхронной и асинхронной)"""
+    for db in databases:
+        db.add_query_observer(_on_query)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
@@ -0,0 +1,136 @@
+"""Живые обновления посещаемости: LISTEN/NOTIFY -> Server-Sent Events."""
+import itertools
+import json
+import queue
+import select
+import threading
+import time
+from collections import deque
+
+from psycopg2 import Error
+
+from db import ATTENDANCE_CHANNEL
+
+# Интервал комментария-пинга в потоке SSE, секунды
+HEARTBEAT_INTERVAL = 15
+
+# Пауза перед переподключением слушателя после обрыва соединения, секунды
+RECONNECT_DELAY = 3
+
+
+class Subscription:
+    """Очередь событий одного клиента SSE"""
+
+    def __init__(self, schedule_id=None, maxsize=100):
+        self.schedule_id = schedule_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Клиент не успевал читать и пропустил события: поток закрывается,
+        # браузер переподключится и заново загрузит данные
+        self.lost = False
+
+    def matches(self, event):
+        return self.schedule_id is None or event.get('schedule_id') == self.schedule_id
+
+
+class AttendanceFeed:
+    """Раздача отметок из канала NOTIFY подписчикам.
+
+    Один фоновый поток держит отдельное соединение с LISTEN и рассылает
+    уведомления по подпискам: на конкретное занятие или на все отметки.
+    Последние события хранятся в памяти для повтора по Last-Event-ID.
+    """
+
+    def __init__(self, connect, channel=ATTENDANCE_CHANNEL, history=100):
+        self._connect = connect
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._history = deque(maxlen=history)  # пары (id события, событие)
+        self._ids = itertools.count(1)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Запустить слушателя, если он еще не запущен"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._listen, name='attendance-feed', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def subscribe(self, schedule_id=None, last_event_id=None):
+        """Подписаться на отметки занятия (или на все); пропущенные события повторяются"""
+        self.start()
+        subscription = Subscription(schedule_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if last_event_id is not None:
+                for event_id, event in self._history:
+                    if event_id > last_event_id and subscription.matches(event):
+                        subscription.queue.put_nowait((event_id, event))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        """Разослать событие подписчикам; возвращает его id"""
+        with self._lock:
+            event_id = next(self._ids)
+            self._history.append((event_id, event))
+            for subscription in list(self._subscriptions):
+                if not subscription.matches(event):
+                    continue
+                try:
+                    subscription.queue.put_nowait((event_id, event))
+                except queue.Full:
+                    subscription.lost = True
+                    self._subscriptions.discard(subscription)
+        return event_id
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                cur = conn.cursor()
+                cur.execute(f'LISTEN "{self.channel}"')
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            self.publish(json.loads(notify.payload))
+            except (Error, OSError) as e:
+                print(f"Ошибка канала обновлений посещаемости: {e}")
+                self._stopped.wait(RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Error:
+                        pass
+
+    def stream(self, subscription, heartbeat=HEARTBEAT_INTERVAL):
+        """Тело ответа text/event-stream для подписки"""
+        try:
+            yield f'retry: {RECONNECT_DELAY * 1000}\n\n'
+            while not subscription.lost:
+                try:
+                    event_id, event = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                data = json.dumps(event, ensure_ascii=False)
+                yield f'id: {event_id}\nevent: mark\ndata: {data}\n\n'
+            yield 'event: reload\ndata: {}\n\n'
+        finally:
+            self.unsubscribe(subscription)
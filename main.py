@@ -1,90 +1,256 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
 from db import Database
+from async_db import AsyncDatabase
+from cache import TTLCache
+import reports
+import imports
+import recurrence
+import instrumentation
+from live_updates import AttendanceFeed
+import migrations
+import partitions
 from datetime import datetime, date, timedelta
 import calendar
+import base64
+import json
+import logging
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
 
-db = Database()
+db = Database(minconn=2, maxconn=20)
+
+# Асинхронный пул для страниц, выполняющих несколько независимых запросов
+adb = AsyncDatabase(minconn=1, maxconn=10)
+
+# Справочники (группы, преподаватели, дисциплины) меняются несколько раз за семестр
+reference_cache = TTLCache(ttl=600, maxsize=64)
+
+# Расписание групп по неделям: одно на всех студентов группы, сбрасывается при
+# записи в расписание (invalidate_group_schedule)
+schedule_cache = TTLCache(ttl=300, maxsize=4096)
+
+# Отметки посещаемости в реальном времени (LISTEN/NOTIFY -> SSE)
+attendance_feed = AttendanceFeed(lambda: db.listen_connection())
+
+# ========== ПУЛ СОЕДИНЕНИЙ ==========
+
+@app.before_request
+def acquire_db_connection():
+    """Соединение из пула выдается один раз на весь запрос"""
+    db.begin_request()
+
+@app.teardown_request
+def release_db_connection(exc):
+    db.end_request()
+
+# Время запроса, SQL и шаблонов: заголовок Server-Timing, лог и /admin/metrics
+instrumentation.init_app(app, db, adb)
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
-def get_today_schedule(user_id, user_role, group_id=None):
-    """Получить расписание на сегодня"""
+ATTENDANCE_STATUSES = ('Присутствовал', 'Отсутствовал', 'По уважительной причине', 'Опоздал')
+
+# Размер страницы в списках администратора
+PAGE_SIZE = 50
+
+# Частые запросы: на каждом соединении пула подготавливаются один раз (PREPARE)
+# и дальше выполняются по имени через db.execute_prepared
+HOT_STATEMENTS = {
+    'today_schedule_student': """
+    SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type, 
+           u.full_name as teacher_name, s.lesson_date
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN users u ON s.teacher_id = u.id
+    WHERE s.group_id = %s AND s.lesson_date = %s
+    ORDER BY s.lesson_time
+    """,
+    'today_schedule_teacher': """
+    SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type,
+           g.group_code, s.lesson_date
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN student_groups g ON s.group_id = g.id
+    WHERE s.teacher_id = %s AND s.lesson_date = %s
+    ORDER BY s.lesson_time
+    """,
+    'today_schedule_admin': """
+    SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type,
+           g.group_code, u.full_name as teacher_name, s.lesson_date
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN student_groups g ON s.group_id = g.id
+    JOIN users u ON s.teacher_id = u.id
+    WHERE s.lesson_date = %s
+    ORDER BY s.lesson_time, g.group_code
+    """,
+    # Период повторен для schedule: диапазон по соединению не переносится,
+    # а без него читались бы все секции расписания
+    'student_attendance': """
+    SELECT a.id, d.name, s.lesson_date, s.lesson_time, a.status, a.notes,
+           u.full_name as teacher_name, s.classroom
+    FROM attendance a
+    JOIN schedule s ON a.schedule_id = s.id AND a.lesson_date = s.lesson_date
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN users u ON s.teacher_id = u.id
+    WHERE a.student_id = %s AND a.lesson_date BETWEEN %s AND %s
+      AND s.lesson_date BETWEEN %s AND %s
+    ORDER BY s.lesson_date DESC, s.lesson_time DESC
+    """,
+    'group_students': """
+    SELECT id, full_name, login, email
+    FROM users
+    WHERE role = 'Студент' AND group_id = %s
+    ORDER BY full_name
+    """,
+    'group_schedule': """
+    SELECT s.id, d.name, s.lesson_date, s.lesson_time, s.classroom, 
+           s.lesson_type, u.full_name as teacher_name
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN users u ON s.teacher_id = u.id
+    WHERE s.group_id = %s AND s.lesson_date BETWEEN %s AND %s
+    ORDER BY s.lesson_date, s.lesson_time
+    """,
+    'teacher_today_classes': """
+    SELECT s.id, d.name, s.lesson_time, g.group_code, s.classroom, s.lesson_type
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN student_groups g ON s.group_id = g.id
+    WHERE s.teacher_id = %s AND s.lesson_date = %s
+    ORDER BY s.lesson_time
+    """,
+}
+
+for statement_name, statement_sql in HOT_STATEMENTS.items():
+    db.prepare(statement_name, statement_sql)
+
+def today_schedule_statement(user_id, user_role, group_id=None):
+    """Расписание на сегодня: пара (имя запроса из HOT_STATEMENTS, параметры)"""
     today = date.today()
     
     if user_role == 'Студент':
-        query = """
-        SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type, 
-               u.full_name as teacher_name, s.lesson_date
-        FROM schedule s
-        JOIN disciplines d ON s.discipline_id = d.id
-        JOIN users u ON s.teacher_id = u.id
-        WHERE s.group_id = %s AND s.lesson_date = %s
-        ORDER BY s.lesson_time
-        """
-        result = db.execute_query(query, (group_id, today))
-        # Добавляем дату к результату
-        return result
-    
+        return 'today_schedule_student', (group_id, today)
     elif user_role == 'Преподаватель':
-        query = """
-        SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type,
-               g.group_code, s.lesson_date
-        FROM schedule s
-        JOIN disciplines d ON s.discipline_id = d.id
-        JOIN student_groups g ON s.group_id = g.id
-        WHERE s.teacher_id = %s AND s.lesson_date = %s
-        ORDER BY s.lesson_time
-        """
-        return db.execute_query(query, (user_id, today))
-    
+        return 'today_schedule_teacher', (user_id, today)
     else:  # Администратор
-        query = """
-        SELECT s.id, d.name, s.lesson_time, s.classroom, s.lesson_type,
-               g.group_code, u.full_name as teacher_name, s.lesson_date
-        FROM schedule s
-        JOIN disciplines d ON s.discipline_id = d.id
-        JOIN student_groups g ON s.group_id = g.id
-        JOIN users u ON s.teacher_id = u.id
-        WHERE s.lesson_date = %s
-        ORDER BY s.lesson_time, g.group_code
-        """
-        return db.execute_query(query, (today,))
+        return 'today_schedule_admin', (today,)
 
-def get_student_attendance(student_id, start_date=None, end_date=None):
-    """Получить посещаемость студента за период"""
+def today_schedule_query(user_id, user_role, group_id=None):
+    """Запрос расписания на сегодня: пара (sql, параметры)"""
+    name, params = today_schedule_statement(user_id, user_role, group_id)
+    return HOT_STATEMENTS[name], params
+
+def get_today_schedule(user_id, user_role, group_id=None):
+    """Получить расписание на сегодня"""
+    if user_role == 'Студент':
+        return get_group_day_schedule(group_id, date.today())
+    return db.execute_prepared(*today_schedule_statement(user_id, user_role, group_id))
+
+def week_bounds(day):
+    """Понедельник и воскресенье недели, в которую попадает day"""
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
+
+def get_group_schedule(group_id, start_date, end_date):
+    """Занятия группы за период (колонки group_schedule) из общего кэша.
+
+    Все студенты группы получают одну запись кэша; одновременные промахи
+    ждут единственный запрос к БД.
+    """
+    return schedule_cache.get_or_load(
+        (int(group_id), start_date, end_date),
+        lambda: db.execute_prepared('group_schedule', (group_id, start_date, end_date)))
+
+def get_group_day_schedule(group_id, day):
+    """Занятия группы на день из кэша ее недели, в колонках today_schedule_student"""
+    rows = get_group_schedule(group_id, *week_bounds(day)) or []
+    return [(r[0], r[1], r[3], r[4], r[5], r[6], r[2]) for r in rows if r[2] == day]
+
+def invalidate_group_schedule(group_id=None, start_date=None, end_date=None):
+    """Сбросить кэш расписания, пересекающийся с периодом; по умолчанию - все группы и даты"""
+    def touches(key):
+        key_group, key_start, key_end = key
+        return ((group_id is None or key_group == int(group_id))
+                and (end_date is None or key_start <= end_date)
+                and (start_date is None or key_end >= start_date))
+    schedule_cache.invalidate_where(touches)
+
+def student_attendance_query(student_id, start_date=None, end_date=None):
+    """Запрос посещаемости студента за период: пара (sql, параметры)"""
     if not start_date:
         start_date = date.today() - timedelta(days=30)
     if not end_date:
         end_date = date.today()
-    
+    return HOT_STATEMENTS['student_attendance'], (student_id, start_date, end_date, start_date, end_date)
+
+def get_student_attendance(student_id, start_date=None, end_date=None):
+    """Получить посещаемость студента за период"""
+    _, params = student_attendance_query(student_id, start_date, end_date)
+    return db.execute_prepared('student_attendance', params)
+
+def attendance_report_query(start_date, end_date, teacher_id=None, group_id=None, student_id=None):
+    """Сводный отчет по сводке посещаемости: группа, студент, дисциплина, итоги.
+
+    Сначала суммируется по id, названия подставляются к уже свернутым строкам:
+    сортировать приходится результат, а не все строки сводки за период.
+    """
+    filters = ""
+    params = [start_date, end_date]
+    if teacher_id:
+        filters += " AND teacher_id = %s"
+        params.append(teacher_id)
+    if student_id:
+        filters += " AND student_id = %s"
+        params.append(student_id)
+    elif group_id:
+        filters += " AND group_id = %s"
+        params.append(group_id)
     query = """
-    SELECT a.id, d.name, s.lesson_date, s.lesson_time, a.status, a.notes,
-           u.full_name as teacher_name, s.classroom
-    FROM attendance a
-    JOIN schedule s ON a.schedule_id = s.id
-    JOIN disciplines d ON s.discipline_id = d.id
-    JOIN users u ON s.teacher_id = u.id
-    WHERE a.student_id = %s AND s.lesson_date BETWEEN %s AND %s
-    ORDER BY s.lesson_date DESC, s.lesson_time DESC
+    WITH totals AS (
+        SELECT group_id, student_id, discipline_id,
+               SUM(total) as total, SUM(attended) as attended, SUM(absent) as absent,
+               SUM(excused) as excused, SUM(late) as late
+        FROM attendance_daily_stats
+        WHERE lesson_date BETWEEN %s AND %s""" + filters + """
+        GROUP BY group_id, student_id, discipline_id
+        HAVING SUM(total) > 0
+    )
+    SELECT g.group_code, u.full_name, d.name,
+           t.total, t.attended, t.absent, t.excused, t.late,
+           ROUND(t.attended * 100.0 / t.total, 1)
+    FROM totals t
+    JOIN student_groups g ON t.group_id = g.id
+    JOIN users u ON t.student_id = u.id
+    JOIN disciplines d ON t.discipline_id = d.id
+    ORDER BY g.group_code, u.full_name, d.name
     """
-    return db.execute_query(query, (student_id, start_date, end_date))
+    return query, params
+
+ATTENDANCE_REPORT_HEADER = ('Группа', 'Студент', 'Дисциплина', 'Всего занятий', 'Присутствовал',
+                            'Отсутствовал', 'По уважительной причине', 'Опоздал', '% посещаемости')
+
+def parse_date(value):
+    """Дата из строки ГГГГ-ММ-ДД; None, если строка пустая или некорректная"""
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def report_period(default_days=30):
+    """Период отчета из параметров start_date/end_date (по умолчанию - последние дни)"""
+    end_date = parse_date(request.args.get('end_date')) or date.today()
+    start_date = parse_date(request.args.get('start_date')) or end_date - timedelta(days=default_days)
+    return start_date, end_date
 
 def get_group_students(group_id):
     """Получить всех студентов группы"""
-    query = """
-    SELECT id, full_name, login, email
-    FROM users
-    WHERE role = 'Студент' AND group_id = %s
-    ORDER BY full_name
-    """
-    return db.execute_query(query, (group_id,))
+    return db.execute_prepared('group_students', (group_id,))
 
-def get_teacher_disciplines(teacher_id):
-    """Получить дисциплины преподавателя с названиями групп"""
+def teacher_disciplines_query(teacher_id):
+    """Запрос дисциплин преподавателя с названиями групп: пара (sql, параметры)"""
     query = """
     SELECT d.id, d.name, d.total_hours,
            COALESCE(STRING_AGG(g.group_code, ', ' ORDER BY g.group_code), 'Нет групп') as group_names
@@ -95,7 +261,219 @@ def get_teacher_disciplines(teacher_id):
     GROUP BY d.id, d.name, d.total_hours
     ORDER BY d.name
     """
-    return db.execute_query(query, (teacher_id,))
+    return query, (teacher_id,)
+
+def semester_bounds(day):
+    """Начало и конец семестра, в который попадает day: осенний - сентябрь-январь,
+    весенний - февраль-август"""
+    if day.month >= 9:
+        return date(day.year, 9, 1), date(day.year + 1, 1, 31)
+    if day.month == 1:
+        return date(day.year - 1, 9, 1), date(day.year, 1, 31)
+    return date(day.year, 2, 1), date(day.year, 8, 31)
+
+def teacher_groups_query(teacher_id, current_semester=False):
+    """Группы преподавателя (id, group_code) из teacher_groups: пара (sql, параметры).
+
+    При current_semester - только группы, у которых с преподавателем есть
+    занятия в текущем семестре. Период пары в teacher_groups отбирает
+    кандидатов, но пересечение периода с семестром не значит, что занятия
+    есть в самом семестре (прошлой осенью и следующей весной - нет), поэтому
+    занятие в семестре ищется по индексу (teacher_id, group_id, lesson_date).
+    """
+    query = """
+    SELECT g.id, g.group_code
+    FROM teacher_groups tg
+    JOIN student_groups g ON tg.group_id = g.id
+    WHERE tg.teacher_id = %s
+    """
+    params = [teacher_id]
+    if current_semester:
+        start, end = semester_bounds(date.today())
+        query += """
+      AND tg.last_lesson >= %s AND tg.first_lesson <= %s
+      AND EXISTS (SELECT 1 FROM schedule s
+                  WHERE s.teacher_id = tg.teacher_id AND s.group_id = tg.group_id
+                    AND s.lesson_date BETWEEN %s AND %s)"""
+        params += [start, end, start, end]
+    return query + " ORDER BY g.group_code", params
+
+def get_teacher_disciplines(teacher_id):
+    """Получить дисциплины преподавателя с названиями групп"""
+    return db.execute_query(*teacher_disciplines_query(teacher_id))
+
+def get_all_groups():
+    """Все группы (id, group_code) для списков выбора"""
+    return reference_cache.get_or_load('groups', lambda: db.execute_query(
+        "SELECT id, group_code FROM student_groups ORDER BY group_code"))
+
+def get_all_teachers():
+    """Все преподаватели (id, full_name) для списков выбора"""
+    return reference_cache.get_or_load('teachers', lambda: db.execute_query(
+        "SELECT id, full_name FROM users WHERE role = 'Преподаватель' ORDER BY full_name"))
+
+def get_all_disciplines():
+    """Все дисциплины (id, name) для списков выбора"""
+    return reference_cache.get_or_load('disciplines', lambda: db.execute_query(
+        "SELECT id, name FROM disciplines ORDER BY name"))
+
+def event_stream(schedule_id=None):
+    """Ответ text/event-stream с отметками занятия или всеми отметками"""
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    subscription = attendance_feed.subscribe(schedule_id, last_event_id)
+    return Response(attendance_feed.stream(subscription), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def fetch_named(queries):
+    """Выполнить независимые запросы {имя: (sql, параметры)} -> {имя: строки}.
+
+    Запросы идут одновременно: через асинхронный пул, если он открыт,
+    иначе пакетом по соединениям синхронного пула.
+    """
+    if adb.pool:
+        return await adb.gather(queries)
+    return db.execute_batch(queries)
+
+def encode_cursor(values):
+    """Курсор страницы: ключ сортировки последней строки в виде строки для URL"""
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    encoded = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+    return encoded.rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Ключ сортировки из курсора; None, если курсор не передан или испорчен"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+def paginate(query, params, order_by, key, cursor):
+    """Выполнить запрос постранично по ключу (keyset).
+
+    order_by - выражения сортировки, уникальные в совокупности; key(row)
+    возвращает их значения для строки. Возвращает (строки, курсор следующей
+    страницы или None).
+    """
+    after = decode_cursor(cursor, len(order_by))
+    params = list(params)
+    if after is not None:
+        query += " AND (%s) > (%s)" % (', '.join(order_by), ', '.join(['%s'] * len(after)))
+        params.extend(after)
+    query += " ORDER BY %s LIMIT %%s" % ', '.join(order_by)
+    params.append(PAGE_SIZE + 1)
+
+    rows = db.execute_query(query, params) or []
+    if len(rows) > PAGE_SIZE:
+        rows = rows[:PAGE_SIZE]
+        return rows, encode_cursor(key(rows[-1]))
+    return rows, None
+
+# Поиск пользователей по триграммам (pg_trgm): подстрока в ФИО, логине или
+# email либо нечеткое совпадение слова в ФИО. Все условия обслуживаются
+# GIN-индексами из миграции 5.
+USER_MATCH_SQL = """(u.full_name ILIKE %s OR u.login ILIKE %s OR u.email ILIKE %s
+     OR %s <%% u.full_name)"""
+USER_DISTANCE_SQL = """(1 - GREATEST(word_similarity(%s, u.full_name), similarity(u.login, %s),
+                        similarity(COALESCE(u.email, ''), %s)))::float8"""
+
+# Подсказки при вводе: сколько вариантов отдавать и с какой длины запроса
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_LENGTH = 2
+
+def escape_like(text):
+    """Экранировать спецсимволы шаблона LIKE"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def user_search_params(text, prefix=False):
+    """Параметры для USER_DISTANCE_SQL и USER_MATCH_SQL"""
+    pattern = escape_like(text) + '%'
+    if not prefix:
+        pattern = '%' + pattern
+    return [text] * 3, [pattern] * 3 + [text]
+
+def admin_users_query(role_filter, group_filter, search_query):
+    """Список пользователей с фильтрами: (sql, параметры, сортировка, ключ курсора)"""
+    params = []
+    distance_column = ""
+    if search_query:
+        distance_params, match_params = user_search_params(search_query)
+        distance_column = ", " + USER_DISTANCE_SQL + " AS distance"
+        params.extend(distance_params)
+    
+    query = """
+    SELECT u.id, u.login, u.full_name, u.role, u.email, u.phone, 
+           g.group_code""" + distance_column + """
+    FROM users u
+    LEFT JOIN student_groups g ON u.group_id = g.id
+    WHERE 1=1
+    """
+    
+    if role_filter:
+        query += " AND u.role = %s"
+        params.append(role_filter)
+    
+    if group_filter:
+        query += " AND u.group_id = %s"
+        params.append(group_filter)
+    
+    if search_query:
+        query += " AND " + USER_MATCH_SQL
+        params.extend(match_params)
+        # Результаты поиска упорядочены по похожести, курсор - (расстояние, id)
+        query = "SELECT * FROM (" + query + ") found WHERE 1=1"
+        order_by = ('found.distance', 'found.id')
+        key = lambda row: (row[7], row[0])
+    else:
+        order_by = ('u.role', 'u.full_name', 'u.id')
+        key = lambda row: (row[3], row[2], row[0])
+    return query, params, order_by, key
+
+def schedule_period():
+    """Период расписания из start_date/end_date (по умолчанию - неделя с сегодняшнего дня)"""
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    
+    if not start_date:
+        start_date = date.today()
+    else:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    
+    if not end_date:
+        end_date = start_date + timedelta(days=6)
+    else:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return start_date, end_date
+
+def admin_schedule_query(start_date, end_date, group_id=None):
+    """Расписание всех групп (или одной) за период: пара (sql, параметры) без сортировки"""
+    query = """
+    SELECT s.id, d.name, s.lesson_date, s.lesson_time, s.classroom, 
+           s.lesson_type, g.group_code, u.full_name as teacher_name
+    FROM schedule s
+    JOIN disciplines d ON s.discipline_id = d.id
+    JOIN student_groups g ON s.group_id = g.id
+    JOIN users u ON s.teacher_id = u.id
+    WHERE s.lesson_date BETWEEN %s AND %s
+    """
+    
+    params = [start_date, end_date]
+    
+    if group_id:
+        query += " AND s.group_id = %s"
+        params.append(group_id)
+    return query, params
+
+# Порядок строк расписания администратора (он же ключ постраничного курсора)
+ADMIN_SCHEDULE_ORDER = ('s.lesson_date', 's.lesson_time', 'g.group_code', 's.id')
 
 # ========== МАРШРУТЫ АУТЕНТИФИКАЦИИ ==========
 
@@ -132,93 +510,92 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
-def dashboard():
+async def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
     user_id = session['user_id']
     role = session['role']
     group_id = session.get('group_id')
-    
-    # Получаем расписание на сегодня
-    today_schedule = get_today_schedule(user_id, role, group_id)
     today_date = date.today()
     
+    # Независимые запросы страницы выполняются одновременно
+    queries = {}
+    
     if role == 'Студент':
-        # Получаем дисциплины студента
-        query = """
-        SELECT d.name, d.total_hours, gd.semester
-        FROM group_disciplines gd
-        JOIN disciplines d ON gd.discipline_id = d.id
-        WHERE gd.group_id = %s
-        ORDER BY d.name
-        """
-        disciplines = db.execute_query(query, (group_id,)) if group_id else []
+        if group_id:
+            queries['disciplines'] = ("""
+            SELECT d.name, d.total_hours, gd.semester
+            FROM group_disciplines gd
+            JOIN disciplines d ON gd.discipline_id = d.id
+            WHERE gd.group_id = %s
+            ORDER BY d.name
+            """, (group_id,))
+            queries['group'] = ("SELECT group_code FROM student_groups WHERE id = %s", (group_id,))
         
-        # Получаем статистику посещаемости
-        start_date = date.today() - timedelta(days=30)
-        attendance_stats = db.execute_query("""
+        # Статистика посещаемости за 30 дней
+        start_date = today_date - timedelta(days=30)
+        queries['stats'] = ("""
             SELECT 
-                COUNT(*) as total_classes,
-                SUM(CASE WHEN status = 'Присутствовал' THEN 1 ELSE 0 END) as attended,
-                SUM(CASE WHEN status = 'Отсутствовал' THEN 1 ELSE 0 END) as absent,
-                SUM(CASE WHEN status = 'По уважительной причине' THEN 1 ELSE 0 END) as excused,
-                SUM(CASE WHEN status = 'Опоздал' THEN 1 ELSE 0 END) as late
-            FROM attendance a
-            JOIN schedule s ON a.schedule_id = s.id
-            WHERE a.student_id = %s AND s.lesson_date BETWEEN %s AND %s
-        """, (user_id, start_date, date.today()))
-
+                COALESCE(SUM(total), 0) as total_classes,
+                COALESCE(SUM(attended), 0) as attended,
+                COALESCE(SUM(absent), 0) as absent,
+                COALESCE(SUM(excused), 0) as excused,
+                COALESCE(SUM(late), 0) as late
+            FROM attendance_daily_stats
+            WHERE student_id = %s AND lesson_date BETWEEN %s AND %s
+        """, (user_id, start_date, today_date))
+        
+        results = await fetch_named(queries)
+        # Расписание на сегодня - из общего кэша группы
+        today_schedule = get_group_day_schedule(group_id, today_date) if group_id else []
+        attendance_stats = results['stats']
         stats = attendance_stats[0] if attendance_stats else (0, 0, 0, 0, 0)
         
-        # Получаем название группы для отображения
+        # Название группы для отображения
         group_name = ""
-        if group_id:
-            group_query = "SELECT group_code FROM student_groups WHERE id = %s"
-            group_info = db.execute_query(group_query, (group_id,))
-            if group_info:
-                group_name = group_info[0][0]
-                session['group_name'] = group_name
+        group_info = results.get('group')
+        if group_info:
+            group_name = group_info[0][0]
+            session['group_name'] = group_name
         
         return render_template('student_dashboard.html',
                              full_name=session['full_name'],
                              role=role,
                              today_schedule=today_schedule,
-                             disciplines=disciplines,
+                             disciplines=results.get('disciplines', []),
                              stats=stats,
                              today_date=today_date,
                              group_name=group_name)
     
     elif role == 'Преподаватель':
-        disciplines = get_teacher_disciplines(user_id)
-        
-        groups_query = """
-        SELECT DISTINCT g.id, g.group_code
-        FROM schedule s
-        JOIN student_groups g ON s.group_id = g.id
-        WHERE s.teacher_id = %s
-        ORDER BY g.group_code
-        """
-        groups = db.execute_query(groups_query, (user_id,))
+        queries['today_schedule'] = today_schedule_query(user_id, role)
+        queries['disciplines'] = teacher_disciplines_query(user_id)
+        queries['groups'] = teacher_groups_query(user_id)
+        results = await fetch_named(queries)
         
         return render_template('teacher_dashboard.html',
                              full_name=session['full_name'],
                              role=role,
-                             today_schedule=today_schedule,
-                             disciplines=disciplines,
-                             groups=groups,
+                             today_schedule=results['today_schedule'],
+                             disciplines=results['disciplines'],
+                             groups=results['groups'],
                              today_date=today_date)
     
     else:  # Администратор
+        queries['today_schedule'] = today_schedule_query(user_id, role)
         # Статистика системы
-        stats_query = """
+        queries['stats'] = ("""
         SELECT 
             (SELECT COUNT(*) FROM users WHERE role = 'Студент') as student_count,
             (SELECT COUNT(*) FROM users WHERE role = 'Преподаватель') as teacher_count,
             (SELECT COUNT(*) FROM student_groups) as group_count,
             (SELECT COUNT(*) FROM disciplines) as discipline_count
-        """
-        stats = db.execute_query(stats_query)[0] if db.execute_query(stats_query) else (0, 0, 0, 0)
+        """, None)
+        results = await fetch_named(queries)
+        today_schedule = results['today_schedule']
+        result = results['stats']
+        stats = result[0] if result else (0, 0, 0, 0)
         
         # Текущее время
         from datetime import datetime
@@ -251,26 +628,15 @@ def student_schedule():
     target_date = today + timedelta(weeks=week_offset)
     
     # Находим начало и конец недели
-    start_of_week = target_date - timedelta(days=target_date.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
+    start_of_week, end_of_week = week_bounds(target_date)
     
     # Получаем информацию о группе
     group_query = "SELECT group_code FROM student_groups WHERE id = %s"
     group_info = db.execute_query(group_query, (group_id,))
     group_name = group_info[0][0] if group_info else "Неизвестная группа"
     
-    # Получаем расписание на неделю
-    query = """
-    SELECT s.id, d.name, s.lesson_date, s.lesson_time, s.classroom, 
-           s.lesson_type, u.full_name as teacher_name
-    FROM schedule s
-    JOIN disciplines d ON s.discipline_id = d.id
-    JOIN users u ON s.teacher_id = u.id
-    WHERE s.group_id = %s AND s.lesson_date BETWEEN %s AND %s
-    ORDER BY s.lesson_date, s.lesson_time
-    """
-    
-    schedule = db.execute_query(query, (group_id, start_of_week, end_of_week))
+    # Получаем расписание на неделю (общий кэш группы)
+    schedule = get_group_schedule(group_id, start_of_week, end_of_week) or []
     
     # Группируем по дням
     schedule_by_day = {}
@@ -311,6 +677,20 @@ def student_attendance():
                          start_date=start_date or (date.today() - timedelta(days=30)),
                          end_date=end_date or date.today())
 
+@app.route('/student/attendance/export')
+def student_attendance_export():
+    """Выгрузка посещаемости студента (CSV/XLSX)"""
+    if session.get('role') != 'Студент':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    start_date, end_date = report_period()
+    rows = db.iter_query(*student_attendance_query(session['user_id'], start_date, end_date))
+    return reports.export_response(
+        request.args.get('format'), f'моя_посещаемость_{start_date}_{end_date}',
+        ('Дата', 'Время', 'Дисциплина', 'Преподаватель', 'Аудитория', 'Статус', 'Примечание'),
+        ((r[2], r[3], r[1], r[6], r[7], r[4], r[5]) for r in rows))
+
 @app.route('/student/disciplines')
 def student_disciplines():
     if session.get('role') != 'Студент':
@@ -322,15 +702,17 @@ def student_disciplines():
         flash('Вы не привязаны к группе')
         return redirect(url_for('dashboard'))
     
+    # Отметки по дисциплинам - из счетчиков student_discipline_stats
     query = """
     SELECT d.id, d.name, d.description, d.total_hours, gd.semester,
            u.full_name as teacher_name,
-           (SELECT COUNT(*) FROM attendance a 
-            JOIN schedule s ON a.schedule_id = s.id 
-            WHERE s.discipline_id = d.id AND a.student_id = %s) as attended_classes
+           COALESCE(st.total, 0) as marked_classes,
+           COALESCE(st.attended, 0), COALESCE(st.absent, 0),
+           COALESCE(st.excused, 0), COALESCE(st.late, 0)
     FROM group_disciplines gd
     JOIN disciplines d ON gd.discipline_id = d.id
     JOIN users u ON d.teacher_id = u.id
+    LEFT JOIN student_discipline_stats st ON st.discipline_id = d.id AND st.student_id = %s
     WHERE gd.group_id = %s
     ORDER BY d.name
     """
@@ -370,6 +752,8 @@ def edit_discipline(discipline_id):
         """
         
         if db.execute_insert(update_query, (name, description, total_hours, discipline_id, teacher_id)):
+            reference_cache.invalidate('disciplines')
+            invalidate_group_schedule()
             # Обновляем группы (можно добавить логику изменения групп)
             flash('Дисциплина успешно обновлена')
             return redirect(url_for('teacher_disciplines'))
@@ -392,8 +776,7 @@ def edit_discipline(discipline_id):
         return redirect(url_for('teacher_disciplines'))
     
     # Получаем все группы для выбора
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
     return render_template('edit_discipline.html',
                          discipline=discipline_data[0],
@@ -424,6 +807,8 @@ def delete_discipline(discipline_id):
     delete_query = "DELETE FROM disciplines WHERE id = %s AND teacher_id = %s"
     
     if db.execute_insert(delete_query, (discipline_id, teacher_id)):
+        reference_cache.invalidate('disciplines')
+        invalidate_group_schedule()
         flash(f'Дисциплина "{discipline_name}" успешно удалена', 'success')
     else:
         flash('Ошибка при удалении дисциплины', 'danger')
@@ -482,8 +867,7 @@ def manage_discipline_groups(discipline_id):
     discipline_data = db.execute_query(discipline_query, (discipline_id,))[0]
     
     # Получаем все группы
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    all_groups = db.execute_query(groups_query)
+    all_groups = get_all_groups()
     
     # Получаем текущие группы дисциплины
     current_groups_query = """
@@ -574,6 +958,8 @@ def add_discipline():
         discipline_id = db.execute_insert(query, (name, description, total_hours, teacher_id), return_id=True)
         
         if discipline_id:
+            reference_cache.invalidate('disciplines')
+            
             # Добавляем группы к дисциплине
             success = True
             for group_id, semester in group_semesters.items():
@@ -592,8 +978,7 @@ def add_discipline():
             flash('Ошибка при создании дисциплины', 'danger')
     
     # GET запрос - показываем форму
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
     return render_template('add_discipline.html', groups=groups)
 
@@ -606,115 +991,187 @@ def mark_attendance():
     teacher_id = session['user_id']
     
     if request.method == 'POST':
-        schedule_id = request.form['schedule_id']
-        student_id = request.form['student_id']
+        schedule_id = request.form.get('schedule_id', '')
+        lesson_date = parse_date(request.form.get('lesson_date'))
+        student_id = request.form.get('student_id', '')
         status = request.form['status']
         notes = request.form.get('notes', '')
+        ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         
-        # Проверяем, существует ли уже запись о посещаемости
-        check_query = "SELECT id FROM attendance WHERE student_id = %s AND schedule_id = %s"
-        existing = db.execute_query(check_query, (student_id, schedule_id))
+        error = None
+        if not (schedule_id.isdigit() and student_id.isdigit()):
+            error = 'Некорректный студент или занятие'
+        elif lesson_date is None:
+            error = 'Некорректная дата занятия'
+        if error:
+            if ajax:
+                return jsonify({'success': False, 'error': error}), 400
+            flash(error)
+            return redirect(url_for('mark_attendance'))
         
-        if existing:
-            # Обновляем существующую запись
-            update_query = """
-            UPDATE attendance 
-            SET status = %s, notes = %s, marked_by = %s, marked_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-            """
-            db.execute_insert(update_query, (status, notes, teacher_id, existing[0][0]))
-        else:
-            # Создаем новую запись
-            insert_query = """
-            INSERT INTO attendance (student_id, schedule_id, status, notes, marked_by)
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            db.execute_insert(insert_query, (student_id, schedule_id, status, notes, teacher_id))
+        # Вставка или обновление одним запросом (уникальность student_id, schedule_id)
+        success = db.upsert_attendance(int(student_id), int(schedule_id), lesson_date, status, notes, teacher_id)
         
         # Возвращаем успешный ответ для AJAX
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({'success': True})
+        if ajax:
+            return jsonify({'success': success})
         
-        flash('Посещаемость отмечена')
+        flash('Посещаемость отмечена' if success else 'Ошибка при сохранении посещаемости')
         return redirect(url_for('mark_attendance'))
     
     # GET запрос - показываем форму
     today = date.today()
-    query = """
-    SELECT s.id, d.name, s.lesson_time, g.group_code, s.classroom, s.lesson_type
-    FROM schedule s
-    JOIN disciplines d ON s.discipline_id = d.id
-    JOIN student_groups g ON s.group_id = g.id
-    WHERE s.teacher_id = %s AND s.lesson_date = %s
-    ORDER BY s.lesson_time
-    """
-    
-    today_classes = db.execute_query(query, (teacher_id, today))
+    today_classes = db.execute_prepared('teacher_today_classes', (teacher_id, today))
     
     return render_template('mark_attendance.html', 
                          today_classes=today_classes,
                          today=today)
 
+@app.route('/teacher/attendance/mark/batch', methods=['POST'])
+def mark_attendance_batch():
+    """Отметить посещаемость всей группы за одно занятие одним запросом"""
+    if session.get('role') != 'Преподаватель':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    payload = request.get_json(silent=True) or {}
+    schedule_id = payload.get('schedule_id')
+    lesson_date = parse_date(payload.get('lesson_date'))
+    marks = payload.get('marks')
+    
+    if not schedule_id or lesson_date is None or not isinstance(marks, list):
+        return jsonify({'error': 'Ожидается schedule_id, lesson_date и список marks'}), 400
+    
+    # Дата занятия ограничивает поиск одной секцией schedule
+    check_query = "SELECT id FROM schedule WHERE id = %s AND lesson_date = %s AND teacher_id = %s"
+    if not db.execute_query(check_query, (schedule_id, lesson_date, session['user_id'])):
+        return jsonify({'error': 'Занятие не найдено'}), 404
+    
+    # Проверяем отметки; повторная отметка студента заменяет предыдущую.
+    # Отметка без корректного student_id попадает в ответ под своим номером в списке
+    results = {}
+    invalid = []
+    valid_marks = {}
+    for index, mark in enumerate(marks):
+        raw_id = mark.get('student_id') if isinstance(mark, dict) else None
+        student_id = int(raw_id) if isinstance(raw_id, str) and raw_id.isdigit() else raw_id
+        if not isinstance(student_id, int) or isinstance(student_id, bool):
+            invalid.append({'index': index, 'student_id': raw_id, 'success': False,
+                            'error': 'Некорректный student_id'})
+            continue
+        status = mark.get('status')
+        notes = mark.get('notes') or ''
+        if status not in ATTENDANCE_STATUSES:
+            error = 'Некорректный статус'
+        elif not isinstance(notes, str):
+            error = 'Примечание должно быть строкой'
+        else:
+            results.pop(student_id, None)
+            valid_marks[student_id] = (student_id, status, notes)
+            continue
+        results[student_id] = error
+        valid_marks.pop(student_id, None)
+    
+    if valid_marks:
+        saved = db.upsert_attendance_batch(schedule_id, lesson_date, list(valid_marks.values()),
+                                           session['user_id'])
+        for student_id in valid_marks:
+            if saved is None:
+                results[student_id] = 'Ошибка сохранения'
+            elif student_id not in saved:
+                results[student_id] = 'Студент не найден в группе'
+            else:
+                results[student_id] = None
+    
+    return jsonify({
+        'success': bool(results) and not invalid and all(error is None for error in results.values()),
+        'saved': sum(1 for error in results.values() if error is None),
+        'results': [
+            {'student_id': student_id, 'success': error is None, 'error': error}
+            for student_id, error in results.items()
+        ] + invalid
+    })
+
 @app.route('/teacher/attendance/class/<int:schedule_id>')
 def attendance_class(schedule_id):
     if session.get('role') != 'Преподаватель':
         return jsonify({'error': 'Доступ запрещен'}), 403
     
-    # Получаем информацию о занятии
-    class_query = """
-    SELECT s.id, d.name, s.lesson_date, s.lesson_time, g.group_code, 
-           s.classroom, s.lesson_type, g.id as group_id
+    # Дата занятия (?date=ГГГГ-ММ-ДД) ограничивает чтение одной секцией schedule
+    # и attendance; в LATERAL она передается константой, иначе секции attendance
+    # при планировании не отсекаются
+    lesson_date = parse_date(request.args.get('date'))
+    if lesson_date is None:
+        return jsonify({'error': 'Не указана дата занятия'}), 400
+    
+    # Готовый JSON ответа собирается в одном запросе: занятие и студенты
+    # группы с их отметками (LEFT JOIN), плюс данные для ETag
+    query = """
+    SELECT json_build_object(
+               'class_info', json_build_object(
+                   'id', s.id,
+                   'lesson_date', s.lesson_date,
+                   'name', d.name,
+                   'date', to_char(s.lesson_date, 'DD.MM.YYYY'),
+                   'time', s.lesson_time::text,
+                   'group', g.group_code,
+                   'classroom', s.classroom,
+                   'type', s.lesson_type
+               ),
+               'students', COALESCE(st.students, '[]'::json)
+           ),
+           st.student_count, st.marked_count, st.last_marked_at
     FROM schedule s
     JOIN disciplines d ON s.discipline_id = d.id
     JOIN student_groups g ON s.group_id = g.id
-    WHERE s.id = %s AND s.teacher_id = %s
+    CROSS JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'id', u.id,
+                   'name', u.full_name,
+                   'login', u.login,
+                   'email', u.email,
+                   'status', COALESCE(a.status, 'Не отмечен'),
+                   'notes', CASE WHEN a.student_id IS NULL THEN '' ELSE a.notes END
+               ) ORDER BY u.full_name, u.id) AS students,
+               COUNT(*) AS student_count,
+               COUNT(a.student_id) AS marked_count,
+               MAX(a.marked_at) AS last_marked_at
+        FROM users u
+        LEFT JOIN attendance a ON a.student_id = u.id AND a.schedule_id = s.id
+                               AND a.lesson_date = %s
+        WHERE u.role = 'Студент' AND u.group_id = s.group_id
+    ) st
+    WHERE s.id = %s AND s.lesson_date = %s AND s.teacher_id = %s
     """
-    
-    class_info = db.execute_query(class_query, (schedule_id, session['user_id']))
-    if not class_info:
+    result = db.execute_query(query, (lesson_date, schedule_id, lesson_date, session['user_id']))
+    if not result:
         return jsonify({'error': 'Занятие не найдено'}), 404
     
-    # Получаем студентов группы
-    group_id = class_info[0][7]  # group_id из запроса
-    students_query = """
-    SELECT id, full_name, login, email
-    FROM users
-    WHERE role = 'Студент' AND group_id = %s
-    ORDER BY full_name
-    """
-    students = db.execute_query(students_query, (group_id,))
+    payload, student_count, marked_count, last_marked_at = result[0]
     
-    # Получаем текущую посещаемость
-    attendance_query = """
-    SELECT student_id, status, notes
-    FROM attendance
-    WHERE schedule_id = %s
-    """
-    attendance_data = db.execute_query(attendance_query, (schedule_id,))
-    attendance_dict = {row[0]: {'status': row[1], 'notes': row[2]} for row in attendance_data}
+    # Повторное открытие без новых отметок: 304 без тела
+    response = jsonify(payload)
+    last_marked = last_marked_at.isoformat() if last_marked_at else ''
+    response.set_etag(f'{schedule_id}-{student_count}-{marked_count}-{last_marked}')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/teacher/attendance/class/<int:schedule_id>/events')
+def attendance_class_events(schedule_id):
+    """Поток SSE с новыми отметками занятия"""
+    role = session.get('role')
+    if role == 'Преподаватель':
+        lesson_date = parse_date(request.args.get('date'))
+        if lesson_date is None:
+            return jsonify({'error': 'Не указана дата занятия'}), 400
+        owned = db.execute_query("SELECT 1 FROM schedule WHERE id = %s AND lesson_date = %s AND teacher_id = %s",
+                                 (schedule_id, lesson_date, session['user_id']))
+        if not owned:
+            return jsonify({'error': 'Занятие не найдено'}), 404
+    elif role != 'Администратор':
+        return jsonify({'error': 'Доступ запрещен'}), 403
     
-    return jsonify({
-        'class_info': {
-            'id': class_info[0][0],
-            'name': class_info[0][1],
-            'date': class_info[0][2].strftime('%d.%m.%Y'),
-            'time': str(class_info[0][3]),
-            'group': class_info[0][4],
-            'classroom': class_info[0][5],
-            'type': class_info[0][6]
-        },
-        'students': [
-            {
-                'id': s[0],
-                'name': s[1],
-                'login': s[2],
-                'email': s[3],
-                'status': attendance_dict.get(s[0], {}).get('status', 'Не отмечен'),
-                'notes': attendance_dict.get(s[0], {}).get('notes', '')
-            }
-            for s in students
-        ]
-    })
+    return event_stream(schedule_id)
 
 @app.route('/teacher/statistics')
 def teacher_statistics():
@@ -729,6 +1186,7 @@ def teacher_statistics():
     student_id = request.args.get('student_id')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    current_semester = request.args.get('current_semester') == '1'
     
     if start_date:
         start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
@@ -740,60 +1198,52 @@ def teacher_statistics():
     else:
         end_date = date.today()
     
-    # Получаем группы преподавателя
-    groups_query = """
-    SELECT DISTINCT g.id, g.group_code
-    FROM schedule s
-    JOIN student_groups g ON s.group_id = g.id
-    WHERE s.teacher_id = %s
-    ORDER BY g.group_code
-    """
-    groups = db.execute_query(groups_query, (teacher_id,))
+    # Группы преподавателя, студенты выбранной группы и статистика
+    # запрашиваются одновременно
+    queries = {'groups': teacher_groups_query(teacher_id, current_semester)}
     
-    # Получаем студентов выбранной группы
-    students = []
     if group_id:
-        students_query = """
+        queries['students'] = ("""
         SELECT u.id, u.full_name
         FROM users u
         WHERE u.role = 'Студент' AND u.group_id = %s
         ORDER BY u.full_name
-        """
-        students = db.execute_query(students_query, (group_id,))
+        """, (group_id,))
     
-    statistics = None
     if group_id or student_id:
         # Строим запрос для статистики - ТОЛЬКО ДЛЯ СТУДЕНТОВ
+        # Сводка attendance_daily_stats содержит только отметки студентов
         query = """
         SELECT 
             u.full_name,
             d.name as discipline,
-            COUNT(*) as total_classes,
-            SUM(CASE WHEN a.status = 'Присутствовал' THEN 1 ELSE 0 END) as attended,
-            SUM(CASE WHEN a.status = 'Отсутствовал' THEN 1 ELSE 0 END) as absent,
-            SUM(CASE WHEN a.status = 'По уважительной причине' THEN 1 ELSE 0 END) as excused,
-            SUM(CASE WHEN a.status = 'Опоздал' THEN 1 ELSE 0 END) as late
-        FROM attendance a
-        JOIN schedule s ON a.schedule_id = s.id
-        JOIN disciplines d ON s.discipline_id = d.id
-        JOIN users u ON a.student_id = u.id
-        WHERE s.teacher_id = %s 
-          AND u.role = 'Студент'  -- Добавлено: только студенты
-          AND s.lesson_date BETWEEN %s AND %s
+            SUM(st.total) as total_classes,
+            SUM(st.attended) as attended,
+            SUM(st.absent) as absent,
+            SUM(st.excused) as excused,
+            SUM(st.late) as late
+        FROM attendance_daily_stats st
+        JOIN disciplines d ON st.discipline_id = d.id
+        JOIN users u ON st.student_id = u.id
+        WHERE st.teacher_id = %s 
+          AND st.lesson_date BETWEEN %s AND %s
         """
         
         params = [teacher_id, start_date, end_date]
         
         if student_id:
-            query += " AND a.student_id = %s"
+            query += " AND st.student_id = %s"
             params.append(student_id)
-            query += " GROUP BY u.full_name, d.name"
         elif group_id:
-            query += " AND s.group_id = %s"
+            query += " AND st.group_id = %s"
             params.append(group_id)
-            query += " GROUP BY u.full_name, d.name"
-        
-        statistics = db.execute_query(query, params)
+        query += " GROUP BY u.full_name, d.name HAVING SUM(st.total) > 0"
+        queries['statistics'] = (query, params)
+    
+    results = db.execute_batch(queries)
+    groups = results['groups']
+    students = results.get('students', [])
+    statistics = results.get('statistics')
     
     return render_template('teacher_statistics.html',
                          groups=groups,
@@ -802,7 +1252,22 @@ def teacher_statistics():
                          start_date=start_date,
                          end_date=end_date,
                          selected_group=group_id,
-                         selected_student=student_id)
+                         selected_student=student_id,
+                         current_semester=current_semester)
+
+@app.route('/teacher/statistics/export')
+def teacher_statistics_export():
+    """Выгрузка статистики преподавателя (CSV/XLSX) потоком из серверного курсора"""
+    if session.get('role') != 'Преподаватель':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    start_date, end_date = report_period()
+    query, params = attendance_report_query(start_date, end_date, teacher_id=session['user_id'],
+                                            group_id=request.args.get('group_id'),
+                                            student_id=request.args.get('student_id'))
+    return reports.export_response(request.args.get('format'), f'посещаемость_{start_date}_{end_date}',
+                                   ATTENDANCE_REPORT_HEADER, db.iter_query(query, params))
 
 # ========== МАРШРУТЫ ДЛЯ АДМИНИСТРАТОРА ==========
 
@@ -814,36 +1279,18 @@ def admin_users():
     
     role_filter = request.args.get('role', '')
     group_filter = request.args.get('group_id', '')
-    search_query = request.args.get('search', '')
-    
-    query = """
-    SELECT u.id, u.login, u.full_name, u.role, u.email, u.phone, 
-           g.group_code
-    FROM users u
-    LEFT JOIN student_groups g ON u.group_id = g.id
-    WHERE 1=1
-    """
+    search_query = request.args.get('search', '').strip()
+    cursor = request.args.get('after', '')
     
-    params = []
+    query, params, order_by, key = admin_users_query(role_filter, group_filter, search_query)
     
-    if role_filter:
-        query += " AND u.role = %s"
-        params.append(role_filter)
+    # Оценка общего количества только по запросу: она требует отдельного EXPLAIN
+    total_estimate = db.estimate_count(query, params) if request.args.get('count') else None
     
-    if group_filter:
-        query += " AND u.group_id = %s"
-        params.append(group_filter)
-    
-    if search_query:
-        query += " AND u.full_name ILIKE %s"
-        params.append(f"%{search_query}%")
-    
-    query += " ORDER BY u.role, u.full_name"
-    users = db.execute_query(query, params) if params else db.execute_query(query)
+    users, next_cursor = paginate(query, params, order_by, key, cursor)
     
     # Получаем список групп для фильтра
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    all_groups = db.execute_query(groups_query)
+    all_groups = get_all_groups()
 
     now = datetime.now()
     current_time = now.strftime('%H:%M')
@@ -853,9 +1300,54 @@ def admin_users():
                          role_filter=role_filter,
                          group_filter=group_filter,
                          search_query=search_query,
+                         next_cursor=next_cursor,
+                         is_first_page=not cursor,
+                         total_estimate=total_estimate,
                          current_time=current_time,
                          all_groups=all_groups)
 
+@app.route('/admin/users/export')
+def admin_users_export():
+    """Выгрузка всех пользователей по текущим фильтрам (CSV/XLSX) потоком из серверного курсора"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    query, params, order_by, _ = admin_users_query(request.args.get('role', ''),
+                                                   request.args.get('group_id', ''),
+                                                   request.args.get('search', '').strip())
+    rows = db.iter_query(query + " ORDER BY " + ', '.join(order_by), params)
+    return reports.export_response(
+        request.args.get('format'), f'пользователи_{date.today()}',
+        ('Логин', 'ФИО', 'Роль', 'Email', 'Телефон', 'Группа'),
+        (r[1:7] for r in rows), sheet_name='Пользователи')
+
+@app.route('/admin/users/autocomplete')
+def autocomplete_users():
+    """Подсказки для поиска пользователя: JSON с лучшими совпадениями"""
+    if session.get('role') != 'Администратор':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    text = request.args.get('q', '').strip()
+    if len(text) < AUTOCOMPLETE_MIN_LENGTH:
+        return jsonify([])
+    
+    distance_params, match_params = user_search_params(text, prefix=True)
+    query = """
+    SELECT u.id, u.full_name, u.login, u.role, g.group_code
+    FROM users u
+    LEFT JOIN student_groups g ON u.group_id = g.id
+    WHERE """ + USER_MATCH_SQL + """
+    ORDER BY """ + USER_DISTANCE_SQL + """, u.full_name
+    LIMIT %s
+    """
+    rows = db.execute_query(query, match_params + distance_params + [AUTOCOMPLETE_LIMIT]) or []
+    
+    return jsonify([
+        {'id': row[0], 'full_name': row[1], 'login': row[2], 'role': row[3], 'group_code': row[4]}
+        for row in rows
+    ])
+
 @app.route('/admin/user/add', methods=['GET', 'POST'])
 def add_user():
     if session.get('role') != 'Администратор':
@@ -885,12 +1377,12 @@ def add_user():
         """
         
         if db.execute_insert(query, (login, password, full_name, role, email, phone, group_id)):
+            reference_cache.invalidate('teachers')
             flash('Пользователь успешно добавлен')
             return redirect(url_for('admin_users'))
     
     # GET запрос - показываем форму
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
     return render_template('add_user.html', groups=groups)
 
@@ -915,6 +1407,9 @@ def edit_user(user_id):
         """
         
         if db.execute_insert(query, (login, full_name, role, email, phone, group_id, user_id)):
+            reference_cache.invalidate('teachers')
+            # ФИО преподавателя есть в кэшированном расписании
+            invalidate_group_schedule()
             flash('Пользователь успешно обновлен')
             return redirect(url_for('admin_users'))
     
@@ -926,8 +1421,7 @@ def edit_user(user_id):
         flash('Пользователь не найден')
         return redirect(url_for('admin_users'))
     
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
     return render_template('edit_user.html', 
                          user=user_data[0], 
@@ -947,6 +1441,9 @@ def delete_user(user_id):
     
     delete_query = "DELETE FROM users WHERE id = %s"
     if db.execute_insert(delete_query, (user_id,)):
+        # Вместе с преподавателем каскадно удаляются его дисциплины
+        reference_cache.invalidate('teachers', 'disciplines')
+        invalidate_group_schedule()
         flash('Пользователь удален')
     
     return redirect(url_for('admin_users'))
@@ -983,43 +1480,19 @@ def admin_schedule():
     
     # Получаем параметры фильтрации
     group_id = request.args.get('group_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    if not start_date:
-        start_date = date.today()
-    else:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    
-    if not end_date:
-        end_date = start_date + timedelta(days=6)
-    else:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    cursor = request.args.get('after', '')
+    start_date, end_date = schedule_period()
     
     # Получаем все группы
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
     # Получаем расписание
-    query = """
-    SELECT s.id, d.name, s.lesson_date, s.lesson_time, s.classroom, 
-           s.lesson_type, g.group_code, u.full_name as teacher_name
-    FROM schedule s
-    JOIN disciplines d ON s.discipline_id = d.id
-    JOIN student_groups g ON s.group_id = g.id
-    JOIN users u ON s.teacher_id = u.id
-    WHERE s.lesson_date BETWEEN %s AND %s
-    """
+    query, params = admin_schedule_query(start_date, end_date, group_id)
     
-    params = [start_date, end_date]
+    total_estimate = db.estimate_count(query, params) if request.args.get('count') else None
     
-    if group_id:
-        query += " AND s.group_id = %s"
-        params.append(group_id)
-    
-    query += " ORDER BY s.lesson_date, s.lesson_time, g.group_code"
-    
-    schedule = db.execute_query(query, params) if params else db.execute_query(query)
+    schedule, next_cursor = paginate(query, params, ADMIN_SCHEDULE_ORDER,
+                                     lambda row: (row[2], row[3], row[6], row[0]), cursor)
     
     # Группируем по дням
     schedule_by_day = {}
@@ -1037,9 +1510,27 @@ def admin_schedule():
                          groups=groups,
                          start_date=start_date,
                          end_date=end_date,
+                         next_cursor=next_cursor,
+                         is_first_page=not cursor,
+                         total_estimate=total_estimate,
                          current_time=current_time,
                          selected_group=group_id)
 
+@app.route('/admin/schedule/export')
+def admin_schedule_export():
+    """Выгрузка расписания за период (CSV/XLSX) потоком из серверного курсора"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    start_date, end_date = schedule_period()
+    query, params = admin_schedule_query(start_date, end_date, request.args.get('group_id'))
+    rows = db.iter_query(query + " ORDER BY " + ', '.join(ADMIN_SCHEDULE_ORDER), params)
+    return reports.export_response(
+        request.args.get('format'), f'расписание_{start_date}_{end_date}',
+        ('Дата', 'Время', 'Группа', 'Дисциплина', 'Тип', 'Аудитория', 'Преподаватель'),
+        ((r[2], r[3], r[6], r[1], r[5], r[4], r[7]) for r in rows), sheet_name='Расписание')
+
 @app.route('/admin/schedule/add', methods=['GET', 'POST'])
 def add_schedule():
     if session.get('role') != 'Администратор':
@@ -1066,32 +1557,200 @@ def add_schedule():
             flash('В это время у группы уже есть занятие')
             return redirect(url_for('add_schedule'))
         
+        # Секция месяца создается в той же транзакции, если ее еще нет
         query = """
+        SELECT create_month_partitions(%s, %s);
         INSERT INTO schedule (discipline_id, group_id, teacher_id, lesson_date, 
                              lesson_time, classroom, lesson_type)
         VALUES (%s, %s, %s, %s, %s, %s, %s)
         """
         
-        if db.execute_insert(query, (discipline_id, group_id, teacher_id, lesson_date,
+        if db.execute_insert(query, (lesson_date, lesson_date, discipline_id, group_id, teacher_id, lesson_date,
                                    lesson_time, classroom, lesson_type)):
+            day = datetime.strptime(lesson_date, '%Y-%m-%d').date()
+            invalidate_group_schedule(group_id, day, day)
             flash('Занятие добавлено в расписание')
             return redirect(url_for('admin_schedule'))
     
     # GET запрос - получаем данные для формы
-    disciplines_query = "SELECT id, name FROM disciplines ORDER BY name"
-    disciplines = db.execute_query(disciplines_query)
+    disciplines = get_all_disciplines()
     
-    groups_query = "SELECT id, group_code FROM student_groups ORDER BY group_code"
-    groups = db.execute_query(groups_query)
+    groups = get_all_groups()
     
-    teachers_query = "SELECT id, full_name FROM users WHERE role = 'Преподаватель' ORDER BY full_name"
-    teachers = db.execute_query(teachers_query)
+    teachers = get_all_teachers()
     
     return render_template('add_schedule.html',
                          disciplines=disciplines,
                          groups=groups,
                          teachers=teachers)
 
+@app.route('/admin/import', methods=['GET', 'POST'])
+def admin_import():
+    """Пакетная загрузка студентов или расписания из CSV с отчетом по строкам"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    kind = request.values.get('kind', 'students')
+    result = None
+    
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Выберите CSV-файл')
+            return redirect(url_for('admin_import', kind=kind))
+        
+        load = imports.import_schedule if kind == 'schedule' else imports.import_students
+        result = load(db, upload.read(), dry_run=bool(request.form.get('dry_run')))
+        
+        if result is None:
+            flash('Ошибка при загрузке файла в базу данных')
+        elif not result['dry_run'] and result['imported']:
+            if kind == 'schedule':
+                invalidate_group_schedule()
+            flash(f"Загружено строк: {result['imported']} из {result['total']}")
+    
+    now = datetime.now()
+    current_time = now.strftime('%H:%M')
+    
+    return render_template('admin_import.html',
+                         kind=kind,
+                         result=result,
+                         student_columns=imports.STUDENT_COLUMNS + imports.STUDENT_OPTIONAL_COLUMNS,
+                         schedule_columns=imports.SCHEDULE_COLUMNS + imports.SCHEDULE_OPTIONAL_COLUMNS,
+                         current_time=current_time)
+
+@app.route('/admin/schedule/series', methods=['GET', 'POST'])
+def schedule_series():
+    """Повторяющиеся занятия: список действующих серий и создание новой"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        try:
+            start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+            weekday = int(request.form['weekday'])
+        except ValueError:
+            flash('Некорректные даты или день недели')
+            return redirect(url_for('schedule_series'))
+        
+        excluded_dates, invalid = recurrence.parse_dates(request.form.get('excluded_dates', ''))
+        if invalid:
+            flash('Не удалось разобрать даты исключений: ' + ', '.join(invalid))
+            return redirect(url_for('schedule_series'))
+        if end_date < start_date or not 1 <= weekday <= 7:
+            flash('Дата окончания раньше даты начала или неверный день недели')
+            return redirect(url_for('schedule_series'))
+        
+        result = recurrence.create_series(
+            db, request.form['discipline_id'], request.form['group_id'], request.form['teacher_id'],
+            weekday, request.form['lesson_time'], request.form.get('classroom', ''),
+            request.form['lesson_type'], start_date, end_date, excluded_dates,
+            skip_conflicts=bool(request.form.get('skip_conflicts')))
+        
+        if result is None:
+            flash('Ошибка при создании серии занятий')
+        elif result['series_id'] is None and not result['conflicts']:
+            flash('В выбранном периоде нет ни одного занятия серии')
+        elif result['series_id'] is None:
+            flash('В это время у группы уже есть занятия: ' +
+                  ', '.join(day.strftime('%d.%m.%Y') for day in result['conflicts']))
+        else:
+            invalidate_group_schedule(request.form['group_id'], start_date, end_date)
+            message = f"Создано занятий: {result['created']}"
+            if result['conflicts']:
+                message += '; пропущены занятые даты: ' + ', '.join(
+                    day.strftime('%d.%m.%Y') for day in result['conflicts'])
+            flash(message)
+        return redirect(url_for('schedule_series'))
+    
+    group_id = request.args.get('group_id')
+    query = """
+    SELECT ss.id, d.name, g.group_code, u.full_name, ss.weekday, ss.lesson_time, ss.classroom,
+           ss.lesson_type, ss.start_date, ss.end_date, ss.teacher_id,
+           COUNT(s.id) FILTER (WHERE s.lesson_date >= CURRENT_DATE) AS upcoming
+    FROM schedule_series ss
+    JOIN disciplines d ON ss.discipline_id = d.id
+    JOIN student_groups g ON ss.group_id = g.id
+    JOIN users u ON ss.teacher_id = u.id
+    LEFT JOIN schedule s ON s.series_id = ss.id
+    WHERE ss.cancelled_at IS NULL AND ss.end_date >= CURRENT_DATE
+    """
+    params = []
+    if group_id:
+        query += " AND ss.group_id = %s"
+        params.append(group_id)
+    query += """
+    GROUP BY ss.id, d.name, g.group_code, u.full_name
+    ORDER BY g.group_code, ss.weekday, ss.lesson_time
+    """
+    series = db.execute_query(query, params) or []
+    
+    return render_template('admin_schedule_series.html',
+                         series=series,
+                         weekdays=recurrence.WEEKDAYS,
+                         disciplines=get_all_disciplines(),
+                         groups=get_all_groups(),
+                         teachers=get_all_teachers(),
+                         selected_group=group_id,
+                         today=date.today())
+
+@app.route('/admin/schedule/series/<int:series_id>/edit', methods=['POST'])
+def edit_schedule_series(series_id):
+    """Изменить все занятия серии начиная с указанной даты"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    from_date = parse_date(request.form['from_date']) if request.form.get('from_date') else date.today()
+    if from_date is None:
+        flash('Некорректная дата начала изменений')
+        return redirect(url_for('schedule_series'))
+    result = recurrence.update_series(db, series_id, request.form['teacher_id'], request.form['lesson_time'],
+                                      request.form.get('classroom', ''), request.form['lesson_type'], from_date)
+    
+    if result is None:
+        flash('Ошибка при изменении серии занятий')
+    elif result['conflicts']:
+        flash('Новое время занято у группы: ' +
+              ', '.join(day.strftime('%d.%m.%Y') for day in result['conflicts']))
+    elif result['group_id'] is None:
+        flash('Серия занятий не найдена')
+    else:
+        invalidate_group_schedule(result['group_id'], from_date)
+        message = f"Изменено занятий: {result['updated']}"
+        if result['kept']:
+            message += f"; оставлены без изменений занятия с отметками: {result['kept']}"
+        flash(message)
+    return redirect(url_for('schedule_series'))
+
+@app.route('/admin/schedule/series/<int:series_id>/cancel', methods=['POST'])
+def cancel_schedule_series(series_id):
+    """Отменить серию: удалить ее занятия начиная с указанной даты"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    from_date = parse_date(request.form['from_date']) if request.form.get('from_date') else date.today()
+    if from_date is None:
+        flash('Некорректная дата начала отмены')
+        return redirect(url_for('schedule_series'))
+    result = recurrence.cancel_series(db, series_id, from_date)
+    
+    if result is None:
+        flash('Ошибка при отмене серии занятий')
+    elif result['group_id'] is None:
+        flash('Серия занятий не найдена')
+    else:
+        invalidate_group_schedule(result['group_id'], from_date)
+        message = f"Удалено занятий: {result['deleted']}"
+        if result['kept']:
+            message += f"; оставлены занятия с отметками: {result['kept']}"
+        flash(message)
+    return redirect(url_for('schedule_series'))
+
 @app.route('/admin/group/<int:group_id>/disciplines')
 def group_disciplines(group_id):
     if session.get('role') != 'Администратор':
@@ -1131,60 +1790,66 @@ def admin_statistics():
         flash('Доступ запрещен')
         return redirect(url_for('dashboard'))
     
-    # Получаем общую статистику
-    stats_query = """
+    # Вся статистика страницы одним запросом: счетчики, проценты посещаемости
+    # студентов за 30 дней, топ групп и последние отметки (в виде JSON)
+    query = """
+    WITH attendance_30d AS (
+        SELECT group_id,
+               SUM(total) as total, SUM(attended) as attended, SUM(absent) as absent,
+               SUM(excused) as excused, SUM(late) as late
+        FROM attendance_daily_stats
+        WHERE lesson_date >= CURRENT_DATE - INTERVAL '30 days'
+        GROUP BY group_id
+    ),
+    top_groups AS (
+        SELECT g.group_code, a.total,
+               ROUND(a.attended * 100.0 / a.total, 1) as attendance_rate
+        FROM attendance_30d a
+        JOIN student_groups g ON a.group_id = g.id
+        WHERE a.total > 0
+        ORDER BY attendance_rate DESC
+        LIMIT 5
+    ),
+    recent AS (
+        SELECT a.id, u.full_name, d.name, a.status, a.marked_at, g.group_code
+        FROM attendance a
+        JOIN users u ON a.student_id = u.id
+        JOIN schedule s ON a.schedule_id = s.id AND a.lesson_date = s.lesson_date
+        JOIN disciplines d ON s.discipline_id = d.id
+        JOIN student_groups g ON s.group_id = g.id
+        WHERE u.role = 'Студент'
+        ORDER BY a.marked_at DESC
+        LIMIT 10
+    )
     SELECT 
         (SELECT COUNT(*) FROM users WHERE role = 'Студент') as student_count,
         (SELECT COUNT(*) FROM users WHERE role = 'Преподаватель') as teacher_count,
         (SELECT COUNT(*) FROM student_groups) as group_count,
         (SELECT COUNT(*) FROM disciplines) as discipline_count,
-        (SELECT COUNT(*) FROM schedule WHERE lesson_date >= CURRENT_DATE - INTERVAL '7 days') as recent_classes,
-        (SELECT COUNT(DISTINCT student_id) FROM attendance WHERE marked_at >= CURRENT_DATE - INTERVAL '7 days') as recent_attendance
+        (SELECT COUNT(*) FROM schedule
+         WHERE lesson_date BETWEEN CURRENT_DATE - INTERVAL '7 days' AND CURRENT_DATE) as recent_classes,
+        (SELECT COUNT(DISTINCT student_id) FROM attendance_daily_stats
+         WHERE lesson_date BETWEEN CURRENT_DATE - INTERVAL '7 days' AND CURRENT_DATE AND total > 0) as recent_attendance,
+        COALESCE(ROUND(SUM(a.attended) * 100.0 / NULLIF(SUM(a.total), 0), 1), 0) as attendance_percent,
+        COALESCE(ROUND(SUM(a.absent) * 100.0 / NULLIF(SUM(a.total), 0), 1), 0) as absence_percent,
+        COALESCE(ROUND(SUM(a.excused) * 100.0 / NULLIF(SUM(a.total), 0), 1), 0) as excused_percent,
+        COALESCE(ROUND(SUM(a.late) * 100.0 / NULLIF(SUM(a.total), 0), 1), 0) as late_percent,
+        (SELECT json_agg(json_build_array(group_code, total, attendance_rate) ORDER BY attendance_rate DESC)
+         FROM top_groups) as top_groups,
+        (SELECT json_agg(json_build_array(id, full_name, name, status, marked_at, group_code) ORDER BY marked_at DESC)
+         FROM recent) as recent_attendance
+    FROM attendance_30d a
     """
-    stats = db.execute_query(stats_query)[0] if db.execute_query(stats_query) else (0, 0, 0, 0, 0, 0)
+    result = db.execute_query(query)
+    row = result[0] if result else (0,) * 10 + (None, None)
     
-    # Статистика по посещаемости (ТОЛЬКО СТУДЕНТЫ)
-    attendance_stats_query = """
-    SELECT 
-        ROUND(COUNT(CASE WHEN status = 'Присутствовал' THEN 1 END) * 100.0 / COUNT(*), 1) as attendance_percent,
-        ROUND(COUNT(CASE WHEN status = 'Отсутствовал' THEN 1 END) * 100.0 / COUNT(*), 1) as absence_percent,
-        ROUND(COUNT(CASE WHEN status = 'По уважительной причине' THEN 1 END) * 100.0 / COUNT(*), 1) as excused_percent,
-        ROUND(COUNT(CASE WHEN status = 'Опоздал' THEN 1 END) * 100.0 / COUNT(*), 1) as late_percent
-    FROM attendance a
-    JOIN users u ON a.student_id = u.id
-    WHERE u.role = 'Студент' AND a.marked_at >= CURRENT_DATE - INTERVAL '30 days'
-    """
-    attendance_stats = db.execute_query(attendance_stats_query)[0] if db.execute_query(attendance_stats_query) else (0, 0, 0, 0)
-    
-    # Топ групп по посещаемости (ТОЛЬКО СТУДЕНТЫ)
-    top_groups_query = """
-    SELECT g.group_code, 
-           COUNT(*) as total_classes,
-           ROUND(COUNT(CASE WHEN a.status = 'Присутствовал' THEN 1 END) * 100.0 / COUNT(*), 1) as attendance_rate
-    FROM attendance a
-    JOIN schedule s ON a.schedule_id = s.id
-    JOIN student_groups g ON s.group_id = g.id
-    JOIN users u ON a.student_id = u.id
-    WHERE u.role = 'Студент' AND a.marked_at >= CURRENT_DATE - INTERVAL '30 days'
-    GROUP BY g.id, g.group_code
-    ORDER BY attendance_rate DESC
-    LIMIT 5
-    """
-    top_groups = db.execute_query(top_groups_query) or []
-    
-    # Последние отметки посещаемости (ТОЛЬКО СТУДЕНТЫ)
-    recent_attendance_query = """
-    SELECT a.id, u.full_name, d.name, a.status, a.marked_at, g.group_code
-    FROM attendance a
-    JOIN users u ON a.student_id = u.id
-    JOIN schedule s ON a.schedule_id = s.id
-    JOIN disciplines d ON s.discipline_id = d.id
-    JOIN student_groups g ON s.group_id = g.id
-    WHERE u.role = 'Студент'
-    ORDER BY a.marked_at DESC
-    LIMIT 10
-    """
-    recent_attendance = db.execute_query(recent_attendance_query) or []
+    stats = row[0:6]
+    attendance_stats = row[6:10]
+    top_groups = [tuple(group) for group in row[10] or []]
+    recent_attendance = [
+        (r[0], r[1], r[2], r[3], datetime.fromisoformat(r[4]), r[5])
+        for r in row[11] or []
+    ]
     
     now = datetime.now()
     current_time = now.strftime('%H:%M')
@@ -1196,6 +1861,41 @@ def admin_statistics():
                          recent_attendance=recent_attendance,
                          current_time = current_time)
 
+@app.route('/admin/statistics/export')
+def admin_statistics_export():
+    """Выгрузка посещаемости всех групп за период (CSV/XLSX)"""
+    if session.get('role') != 'Администратор':
+        flash('Доступ запрещен')
+        return redirect(url_for('dashboard'))
+    
+    start_date, end_date = report_period()
+    query, params = attendance_report_query(start_date, end_date, group_id=request.args.get('group_id'))
+    return reports.export_response(request.args.get('format'), f'посещаемость_{start_date}_{end_date}',
+                                   ATTENDANCE_REPORT_HEADER, db.iter_query(query, params))
+
+@app.route('/admin/attendance/events')
+def admin_attendance_events():
+    """Поток SSE со всеми новыми отметками для ленты на странице статистики"""
+    if session.get('role') != 'Администратор':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    return event_stream()
+
+# Метрики времени ответа
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Гистограммы времени ответа по маршрутам с момента запуска процесса"""
+    if session.get('role') != 'Администратор':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    routes = instrumentation.route_stats.snapshot()
+    endpoint = request.args.get('endpoint')
+    if endpoint:
+        routes = {endpoint: routes[endpoint]} if endpoint in routes else {}
+    
+    return jsonify({'buckets_ms': list(instrumentation.BUCKETS_MS), 'routes': routes,
+                    'statements': db.statement_stats()})
+
 # Добавление группы
 @app.route('/admin/group/add', methods=['GET', 'POST'])
 def add_group():
@@ -1222,6 +1922,7 @@ def add_group():
         """
         
         if db.execute_insert(query, (group_code, specialization, year_of_study)):
+            reference_cache.invalidate('groups')
             flash('Группа успешно создана')
             return redirect(url_for('admin_groups'))
     
@@ -1274,6 +1975,7 @@ def update_group(group_id):
     """
     
     if db.execute_insert(update_query, (group_code, specialization, year_of_study, group_id)):
+        reference_cache.invalidate('groups')
         flash('Группа успешно обновлена')
     
     return redirect(url_for('edit_group', group_id=group_id))
@@ -1289,6 +1991,8 @@ def delete_group(group_id):
     delete_query = "DELETE FROM student_groups WHERE id = %s"
     
     if db.execute_insert(delete_query, (group_id,)):
+        reference_cache.invalidate('groups')
+        invalidate_group_schedule(group_id)
         flash('Группа удалена')
     
     return redirect(url_for('admin_groups'))
@@ -1326,11 +2030,17 @@ def add_student_to_group(group_id):
 # ========== ЗАПУСК ПРИЛОЖЕНИЯ ==========
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    
     # Проверяем соединение с БД при запуске
     if not db.connect():
         print("Внимание: не удалось подключиться к базе данных!")
         print("Приложение будет работать с ограниченной функциональностью.")
     else:
         print("Соединение с базой данных установлено успешно!")
+        migrations.migrate(db)
+        partitions.ensure_future_partitions(db)
+        if not adb.connect():
+            print("Асинхронный пул недоступен: запросы страниц выполняются пакетом через синхронный пул (db.execute_batch).")
     
     app.run(debug=True, port=5001)
\ No newline at end of file
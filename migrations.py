@@ -0,0 +1,714 @@
+"""Версионные миграции схемы БД.
+
+Каждая миграция - это номер версии, название и SQL. Примененные версии
+хранятся в таблице schema_migrations, поэтому повторный запуск выполняет
+только новые миграции. Миграции запускаются при старте приложения
+(main.py) или вручную:
+
+    python migrations.py            # применить ожидающие миграции
+    python migrations.py --status   # показать состояние
+"""
+import argparse
+
+from psycopg2 import Error
+
+from db import Database
+
+# Пересчет сводки attendance_daily_stats по сырым отметкам. Триггер счетчиков
+# по дисциплинам на время пересчета отключен (TRUNCATE их не обнуляет, и вставка
+# прибавила бы все отметки второй раз), поэтому после этого пересчета
+# student_discipline_stats нужно пересчитать REBUILD_DISCIPLINE_STATS_SQL -
+# оба шага сразу выполняет REBUILD_STATS_SQL
+REBUILD_ATTENDANCE_STATS_SQL = """
+ALTER TABLE attendance_daily_stats DISABLE TRIGGER USER;
+TRUNCATE attendance_daily_stats;
+INSERT INTO attendance_daily_stats
+    (student_id, lesson_date, discipline_id, group_id, teacher_id, total, attended, absent, excused, late)
+SELECT a.student_id, s.lesson_date, s.discipline_id, s.group_id, s.teacher_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE a.status = 'Присутствовал'),
+       COUNT(*) FILTER (WHERE a.status = 'Отсутствовал'),
+       COUNT(*) FILTER (WHERE a.status = 'По уважительной причине'),
+       COUNT(*) FILTER (WHERE a.status = 'Опоздал')
+FROM attendance a
+JOIN schedule s ON a.schedule_id = s.id
+JOIN users u ON a.student_id = u.id AND u.role = 'Студент'
+GROUP BY a.student_id, s.lesson_date, s.discipline_id, s.group_id, s.teacher_id;
+ALTER TABLE attendance_daily_stats ENABLE TRIGGER USER;
+"""
+
+# Пересчет счетчиков student_discipline_stats по дневной сводке
+REBUILD_DISCIPLINE_STATS_SQL = """
+TRUNCATE student_discipline_stats;
+INSERT INTO student_discipline_stats (student_id, discipline_id, total, attended, absent, excused, late)
+SELECT student_id, discipline_id, SUM(total), SUM(attended), SUM(absent), SUM(excused), SUM(late)
+FROM attendance_daily_stats
+GROUP BY student_id, discipline_id;
+"""
+
+# Полный пересчет сводки и счетчиков по дисциплинам (после миграции 7)
+REBUILD_STATS_SQL = REBUILD_ATTENDANCE_STATS_SQL + REBUILD_DISCIPLINE_STATS_SQL
+
+# Пересчет связей преподаватель - группа по расписанию
+REBUILD_TEACHER_GROUPS_SQL = """
+TRUNCATE teacher_groups;
+INSERT INTO teacher_groups (teacher_id, group_id, first_lesson, last_lesson)
+SELECT teacher_id, group_id, MIN(lesson_date), MAX(lesson_date)
+FROM schedule
+GROUP BY teacher_id, group_id;
+"""
+
+# Триггеры сводки на attendance и schedule (пересоздаются вместе с таблицами)
+ATTENDANCE_STATS_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS attendance_stats_on_write ON attendance;
+CREATE TRIGGER attendance_stats_on_write
+AFTER INSERT OR DELETE ON attendance
+FOR EACH ROW EXECUTE FUNCTION attendance_stats_attendance_trigger();
+
+DROP TRIGGER IF EXISTS attendance_stats_on_update ON attendance;
+CREATE TRIGGER attendance_stats_on_update
+AFTER UPDATE ON attendance
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status
+      OR OLD.student_id IS DISTINCT FROM NEW.student_id
+      OR OLD.schedule_id IS DISTINCT FROM NEW.schedule_id)
+EXECUTE FUNCTION attendance_stats_attendance_trigger();
+
+DROP TRIGGER IF EXISTS attendance_stats_on_schedule_delete ON schedule;
+CREATE TRIGGER attendance_stats_on_schedule_delete
+BEFORE DELETE ON schedule
+FOR EACH ROW EXECUTE FUNCTION attendance_stats_schedule_trigger();
+
+DROP TRIGGER IF EXISTS attendance_stats_on_schedule_update ON schedule;
+CREATE TRIGGER attendance_stats_on_schedule_update
+AFTER UPDATE ON schedule
+FOR EACH ROW
+WHEN (OLD.lesson_date IS DISTINCT FROM NEW.lesson_date
+      OR OLD.discipline_id IS DISTINCT FROM NEW.discipline_id
+      OR OLD.group_id IS DISTINCT FROM NEW.group_id
+      OR OLD.teacher_id IS DISTINCT FROM NEW.teacher_id)
+EXECUTE FUNCTION attendance_stats_schedule_trigger();
+"""
+
+# Триггеры teacher_groups на schedule
+TEACHER_GROUPS_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS teacher_groups_insert ON schedule;
+CREATE TRIGGER teacher_groups_insert
+AFTER INSERT ON schedule
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION teacher_groups_on_insert();
+
+DROP TRIGGER IF EXISTS teacher_groups_delete ON schedule;
+CREATE TRIGGER teacher_groups_delete
+AFTER DELETE ON schedule
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION teacher_groups_on_delete();
+
+DROP TRIGGER IF EXISTS teacher_groups_update ON schedule;
+CREATE TRIGGER teacher_groups_update
+AFTER UPDATE ON schedule
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION teacher_groups_on_update();
+"""
+
+MIGRATIONS = [
+    (1, 'Базовая схема', """
+CREATE TABLE IF NOT EXISTS users(
+    id BIGSERIAL PRIMARY KEY,
+    login TEXT NOT NULL UNIQUE CHECK (char_length(login) >= 3),
+    password_hash TEXT NOT NULL CHECK (char_length(password_hash) >= 3),
+    full_name TEXT NOT NULL CHECK (char_length(full_name) >= 2),
+    role TEXT NOT NULL CHECK (role IN ('Студент', 'Преподаватель', 'Администратор')),
+    email TEXT,
+    phone TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS student_groups(
+    id BIGSERIAL PRIMARY KEY,
+    group_code TEXT NOT NULL UNIQUE,
+    specialization TEXT,
+    year_of_study INTEGER CHECK (year_of_study >= 1 AND year_of_study <= 6),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS group_id BIGINT REFERENCES student_groups(id) ON DELETE SET NULL;
+
+CREATE TABLE IF NOT EXISTS disciplines(
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    total_hours INTEGER NOT NULL CHECK (total_hours > 0),
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS group_disciplines(
+    id BIGSERIAL PRIMARY KEY,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    semester INTEGER CHECK (semester >= 1 AND semester <= 12),
+    UNIQUE(group_id, discipline_id)
+);
+
+CREATE TABLE IF NOT EXISTS schedule(
+    id BIGSERIAL PRIMARY KEY,
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    lesson_date DATE NOT NULL,
+    lesson_time TIME NOT NULL,
+    classroom TEXT,
+    lesson_type TEXT CHECK (lesson_type IN ('Лекция', 'Практика', 'Лабораторная', 'Семинар')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS attendance(
+    id BIGSERIAL PRIMARY KEY,
+    student_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    schedule_id BIGINT NOT NULL REFERENCES schedule(id) ON DELETE CASCADE,
+    status TEXT NOT NULL CHECK (status IN ('Присутствовал', 'Отсутствовал', 'По уважительной причине', 'Опоздал')),
+    notes TEXT,
+    marked_by BIGINT REFERENCES users(id) ON DELETE SET NULL,
+    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(student_id, schedule_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+CREATE INDEX IF NOT EXISTS idx_users_group ON users(group_id);
+CREATE INDEX IF NOT EXISTS idx_disciplines_teacher ON disciplines(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_schedule_date ON schedule(lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_group_date ON schedule(group_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance(student_id, marked_at);
+CREATE INDEX IF NOT EXISTS idx_attendance_schedule ON attendance(schedule_id);
+"""),
+
+    (2, 'Сводная посещаемость attendance_daily_stats', """
+CREATE TABLE IF NOT EXISTS attendance_daily_stats(
+    student_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    lesson_date DATE NOT NULL,
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total INTEGER NOT NULL DEFAULT 0,
+    attended INTEGER NOT NULL DEFAULT 0,
+    absent INTEGER NOT NULL DEFAULT 0,
+    excused INTEGER NOT NULL DEFAULT 0,
+    late INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, lesson_date, discipline_id, group_id, teacher_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_stats_teacher_date ON attendance_daily_stats(teacher_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_daily_stats_date ON attendance_daily_stats(lesson_date);
+
+CREATE OR REPLACE FUNCTION attendance_stats_apply(
+    p_student_id BIGINT, p_lesson_date DATE, p_discipline_id BIGINT, p_group_id BIGINT,
+    p_teacher_id BIGINT, p_status TEXT, p_delta INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    IF p_delta > 0 THEN
+        INSERT INTO attendance_daily_stats AS st
+            (student_id, lesson_date, discipline_id, group_id, teacher_id, total, attended, absent, excused, late)
+        SELECT p_student_id, p_lesson_date, p_discipline_id, p_group_id, p_teacher_id, p_delta,
+               CASE WHEN p_status = 'Присутствовал' THEN p_delta ELSE 0 END,
+               CASE WHEN p_status = 'Отсутствовал' THEN p_delta ELSE 0 END,
+               CASE WHEN p_status = 'По уважительной причине' THEN p_delta ELSE 0 END,
+               CASE WHEN p_status = 'Опоздал' THEN p_delta ELSE 0 END
+        FROM users u
+        WHERE u.id = p_student_id AND u.role = 'Студент'
+        ON CONFLICT (student_id, lesson_date, discipline_id, group_id, teacher_id) DO UPDATE
+        SET total = st.total + EXCLUDED.total,
+            attended = st.attended + EXCLUDED.attended,
+            absent = st.absent + EXCLUDED.absent,
+            excused = st.excused + EXCLUDED.excused,
+            late = st.late + EXCLUDED.late;
+    ELSE
+        UPDATE attendance_daily_stats
+        SET total = total + p_delta,
+            attended = attended + CASE WHEN p_status = 'Присутствовал' THEN p_delta ELSE 0 END,
+            absent = absent + CASE WHEN p_status = 'Отсутствовал' THEN p_delta ELSE 0 END,
+            excused = excused + CASE WHEN p_status = 'По уважительной причине' THEN p_delta ELSE 0 END,
+            late = late + CASE WHEN p_status = 'Опоздал' THEN p_delta ELSE 0 END
+        WHERE student_id = p_student_id AND lesson_date = p_lesson_date
+          AND discipline_id = p_discipline_id AND group_id = p_group_id AND teacher_id = p_teacher_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_stats_attendance_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    s schedule%ROWTYPE;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT * INTO s FROM schedule WHERE id = OLD.schedule_id;
+        IF FOUND THEN
+            PERFORM attendance_stats_apply(OLD.student_id, s.lesson_date, s.discipline_id, s.group_id,
+                                           s.teacher_id, OLD.status, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT * INTO s FROM schedule WHERE id = NEW.schedule_id;
+        IF FOUND THEN
+            PERFORM attendance_stats_apply(NEW.student_id, s.lesson_date, s.discipline_id, s.group_id,
+                                           s.teacher_id, NEW.status, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_stats_schedule_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN SELECT student_id, status FROM attendance WHERE schedule_id = OLD.id LOOP
+        PERFORM attendance_stats_apply(r.student_id, OLD.lesson_date, OLD.discipline_id, OLD.group_id,
+                                       OLD.teacher_id, r.status, -1);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM attendance_stats_apply(r.student_id, NEW.lesson_date, NEW.discipline_id, NEW.group_id,
+                                           NEW.teacher_id, r.status, 1);
+        END IF;
+    END LOOP;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+""" + ATTENDANCE_STATS_TRIGGERS_SQL + REBUILD_ATTENDANCE_STATS_SQL),
+
+    (3, 'Индексы для горячих запросов', """
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_date ON schedule(teacher_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_discipline ON schedule(discipline_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_marked_at ON attendance(marked_at);
+CREATE INDEX IF NOT EXISTS idx_users_role_group ON users(role, group_id);
+"""),
+    (4, 'Индекс для постраничного списка пользователей', """
+CREATE INDEX IF NOT EXISTS idx_users_role_name_id ON users(role, full_name, id);
+"""),
+    (5, 'Триграммный поиск пользователей', """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_users_full_name_trgm ON users USING gin (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_login_trgm ON users USING gin (login gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING gin (email gin_trgm_ops);
+"""),
+    (6, 'Повторяющиеся занятия schedule_series', """
+CREATE TABLE IF NOT EXISTS schedule_series(
+    id BIGSERIAL PRIMARY KEY,
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    weekday INTEGER NOT NULL CHECK (weekday >= 1 AND weekday <= 7),
+    lesson_time TIME NOT NULL,
+    classroom TEXT,
+    lesson_type TEXT CHECK (lesson_type IN ('Лекция', 'Практика', 'Лабораторная', 'Семинар')),
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL CHECK (end_date >= start_date),
+    excluded_dates DATE[] NOT NULL DEFAULT '{}',
+    cancelled_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE schedule ADD COLUMN IF NOT EXISTS series_id BIGINT REFERENCES schedule_series(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_schedule_series_date ON schedule(series_id, lesson_date) WHERE series_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_schedule_series_group ON schedule_series(group_id, end_date);
+"""),
+    # Счетчики ведутся триггером на дневной сводке: она уже отслеживает
+    # отметки, перенос и удаление занятий
+    (7, 'Счетчики посещаемости по дисциплинам student_discipline_stats', """
+CREATE TABLE IF NOT EXISTS student_discipline_stats(
+    student_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    total INTEGER NOT NULL DEFAULT 0,
+    attended INTEGER NOT NULL DEFAULT 0,
+    absent INTEGER NOT NULL DEFAULT 0,
+    excused INTEGER NOT NULL DEFAULT 0,
+    late INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, discipline_id)
+);
+
+CREATE OR REPLACE FUNCTION discipline_stats_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.student_id = NEW.student_id AND OLD.discipline_id = NEW.discipline_id THEN
+        UPDATE student_discipline_stats
+        SET total = total + NEW.total - OLD.total,
+            attended = attended + NEW.attended - OLD.attended,
+            absent = absent + NEW.absent - OLD.absent,
+            excused = excused + NEW.excused - OLD.excused,
+            late = late + NEW.late - OLD.late
+        WHERE student_id = NEW.student_id AND discipline_id = NEW.discipline_id;
+        IF FOUND THEN
+            RETURN NULL;
+        END IF;
+    ELSIF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE student_discipline_stats
+        SET total = total - OLD.total,
+            attended = attended - OLD.attended,
+            absent = absent - OLD.absent,
+            excused = excused - OLD.excused,
+            late = late - OLD.late
+        WHERE student_id = OLD.student_id AND discipline_id = OLD.discipline_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO student_discipline_stats AS st
+            (student_id, discipline_id, total, attended, absent, excused, late)
+        VALUES (NEW.student_id, NEW.discipline_id, NEW.total, NEW.attended, NEW.absent, NEW.excused, NEW.late)
+        ON CONFLICT (student_id, discipline_id) DO UPDATE
+        SET total = st.total + EXCLUDED.total,
+            attended = st.attended + EXCLUDED.attended,
+            absent = st.absent + EXCLUDED.absent,
+            excused = st.excused + EXCLUDED.excused,
+            late = st.late + EXCLUDED.late;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS discipline_stats_on_write ON attendance_daily_stats;
+CREATE TRIGGER discipline_stats_on_write
+AFTER INSERT OR UPDATE OR DELETE ON attendance_daily_stats
+FOR EACH ROW EXECUTE FUNCTION discipline_stats_trigger();
+""" + REBUILD_DISCIPLINE_STATS_SQL),
+    # Триггеры уровня оператора: пакетная вставка (серия, импорт) обновляет
+    # связи одним запросом по таблице переходов
+    (8, 'Группы преподавателей teacher_groups', """
+CREATE TABLE IF NOT EXISTS teacher_groups(
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    first_lesson DATE NOT NULL,
+    last_lesson DATE NOT NULL,
+    PRIMARY KEY (teacher_id, group_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_teacher_groups_period
+    ON teacher_groups(teacher_id, last_lesson, first_lesson, group_id);
+-- Для пересчета периода пары после удаления или переноса занятий
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_group_date ON schedule(teacher_id, group_id, lesson_date);
+
+-- Новые занятия только расширяют период пары
+CREATE OR REPLACE FUNCTION teacher_groups_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO teacher_groups AS tg (teacher_id, group_id, first_lesson, last_lesson)
+    SELECT teacher_id, group_id, MIN(lesson_date), MAX(lesson_date)
+    FROM new_rows
+    GROUP BY teacher_id, group_id
+    ON CONFLICT (teacher_id, group_id) DO UPDATE
+    SET first_lesson = LEAST(tg.first_lesson, EXCLUDED.first_lesson),
+        last_lesson = GREATEST(tg.last_lesson, EXCLUDED.last_lesson);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пара, у которой убрали или перенесли занятия, пересчитывается по расписанию
+CREATE OR REPLACE FUNCTION teacher_groups_recount(teacher_ids BIGINT[], group_ids BIGINT[]) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM teacher_groups tg
+    USING unnest(teacher_ids, group_ids) AS p(teacher_id, group_id)
+    WHERE tg.teacher_id = p.teacher_id AND tg.group_id = p.group_id
+      AND NOT EXISTS (SELECT 1 FROM schedule s
+                      WHERE s.teacher_id = p.teacher_id AND s.group_id = p.group_id);
+
+    UPDATE teacher_groups tg
+    SET first_lesson = r.first_lesson, last_lesson = r.last_lesson
+    FROM (
+        SELECT s.teacher_id, s.group_id, MIN(s.lesson_date) AS first_lesson, MAX(s.lesson_date) AS last_lesson
+        FROM schedule s
+        JOIN unnest(teacher_ids, group_ids) AS p(teacher_id, group_id)
+          ON s.teacher_id = p.teacher_id AND s.group_id = p.group_id
+        GROUP BY s.teacher_id, s.group_id
+    ) r
+    WHERE tg.teacher_id = r.teacher_id AND tg.group_id = r.group_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION teacher_groups_on_delete() RETURNS TRIGGER AS $$
+DECLARE
+    teacher_ids BIGINT[];
+    group_ids BIGINT[];
+BEGIN
+    SELECT array_agg(teacher_id), array_agg(group_id) INTO teacher_ids, group_ids
+    FROM (SELECT DISTINCT teacher_id, group_id FROM old_rows) p;
+    PERFORM teacher_groups_recount(teacher_ids, group_ids);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION teacher_groups_on_update() RETURNS TRIGGER AS $$
+DECLARE
+    teacher_ids BIGINT[];
+    group_ids BIGINT[];
+BEGIN
+    -- Учитываются только занятия, у которых сменились преподаватель, группа или дата
+    INSERT INTO teacher_groups AS tg (teacher_id, group_id, first_lesson, last_lesson)
+    SELECT n.teacher_id, n.group_id, MIN(n.lesson_date), MAX(n.lesson_date)
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE (o.teacher_id, o.group_id, o.lesson_date) IS DISTINCT FROM (n.teacher_id, n.group_id, n.lesson_date)
+    GROUP BY n.teacher_id, n.group_id
+    ON CONFLICT (teacher_id, group_id) DO UPDATE
+    SET first_lesson = LEAST(tg.first_lesson, EXCLUDED.first_lesson),
+        last_lesson = GREATEST(tg.last_lesson, EXCLUDED.last_lesson);
+
+    SELECT array_agg(teacher_id), array_agg(group_id) INTO teacher_ids, group_ids
+    FROM (
+        SELECT DISTINCT o.teacher_id, o.group_id
+        FROM old_rows o JOIN new_rows n ON n.id = o.id
+        WHERE (o.teacher_id, o.group_id, o.lesson_date) IS DISTINCT FROM (n.teacher_id, n.group_id, n.lesson_date)
+    ) p;
+    PERFORM teacher_groups_recount(teacher_ids, group_ids);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+""" + TEACHER_GROUPS_TRIGGERS_SQL + REBUILD_TEACHER_GROUPS_SQL),
+    # schedule и attendance секционируются по дате занятия помесячно с общими
+    # границами; в attendance дата занятия копируется из schedule, чтобы
+    # отсекать секции обеих таблиц. Таблицы пересоздаются, данные переносятся
+    # в этой же транзакции (partitions.py - создание и отсоединение секций)
+    (9, 'Секционирование schedule и attendance по месяцам', """
+-- Перенос занятия в другой месяц перемещает строку между секциями; сохранение
+-- отметок при этом (ON UPDATE CASCADE между секциями) есть только с PostgreSQL 15
+DO $$
+BEGIN
+    IF current_setting('server_version_num')::int < 150000 THEN
+        RAISE EXCEPTION 'Секционирование schedule и attendance требует PostgreSQL 15 или новее';
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION create_month_partitions(p_from DATE, p_to DATE) RETURNS INTEGER AS $$
+DECLARE
+    first_day DATE := date_trunc('month', p_from)::date;
+    parent_name TEXT;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE first_day <= p_to LOOP
+        FOREACH parent_name IN ARRAY ARRAY['schedule', 'attendance'] LOOP
+            part_name := parent_name || '_' || to_char(first_day, 'YYYY_MM');
+            IF to_regclass(part_name) IS NULL THEN
+                EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, parent_name, first_day, (first_day + INTERVAL '1 month')::date);
+                created := created + 1;
+            END IF;
+        END LOOP;
+        first_day := (first_day + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Последовательности id переходят к новым таблицам
+ALTER SEQUENCE schedule_id_seq OWNED BY NONE;
+ALTER SEQUENCE attendance_id_seq OWNED BY NONE;
+
+ALTER TABLE attendance RENAME TO attendance_unpartitioned;
+ALTER TABLE attendance_unpartitioned RENAME CONSTRAINT attendance_pkey TO attendance_unpartitioned_pkey;
+ALTER TABLE attendance_unpartitioned
+    RENAME CONSTRAINT attendance_student_id_schedule_id_key TO attendance_unpartitioned_key;
+ALTER TABLE schedule RENAME TO schedule_unpartitioned;
+ALTER TABLE schedule_unpartitioned RENAME CONSTRAINT schedule_pkey TO schedule_unpartitioned_pkey;
+
+CREATE TABLE schedule(
+    id BIGINT NOT NULL DEFAULT nextval('schedule_id_seq'),
+    discipline_id BIGINT NOT NULL REFERENCES disciplines(id) ON DELETE CASCADE,
+    group_id BIGINT NOT NULL REFERENCES student_groups(id) ON DELETE CASCADE,
+    teacher_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    lesson_date DATE NOT NULL,
+    lesson_time TIME NOT NULL,
+    classroom TEXT,
+    lesson_type TEXT CHECK (lesson_type IN ('Лекция', 'Практика', 'Лабораторная', 'Семинар')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    series_id BIGINT REFERENCES schedule_series(id) ON DELETE SET NULL,
+    PRIMARY KEY (id, lesson_date)
+) PARTITION BY RANGE (lesson_date);
+
+CREATE TABLE attendance(
+    id BIGINT NOT NULL DEFAULT nextval('attendance_id_seq'),
+    student_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    schedule_id BIGINT NOT NULL,
+    status TEXT NOT NULL CHECK (status IN ('Присутствовал', 'Отсутствовал', 'По уважительной причине', 'Опоздал')),
+    notes TEXT,
+    marked_by BIGINT REFERENCES users(id) ON DELETE SET NULL,
+    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    lesson_date DATE NOT NULL,
+    PRIMARY KEY (id, lesson_date),
+    UNIQUE (student_id, schedule_id, lesson_date),
+    FOREIGN KEY (schedule_id, lesson_date) REFERENCES schedule(id, lesson_date)
+        ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (lesson_date);
+
+SELECT create_month_partitions(
+    LEAST((SELECT MIN(lesson_date) FROM schedule_unpartitioned), CURRENT_DATE),
+    GREATEST((SELECT MAX(lesson_date) FROM schedule_unpartitioned), CURRENT_DATE + 365));
+
+INSERT INTO schedule (id, discipline_id, group_id, teacher_id, lesson_date, lesson_time,
+                      classroom, lesson_type, created_at, series_id)
+SELECT id, discipline_id, group_id, teacher_id, lesson_date, lesson_time,
+       classroom, lesson_type, created_at, series_id
+FROM schedule_unpartitioned;
+
+INSERT INTO attendance (id, student_id, schedule_id, status, notes, marked_by, marked_at, lesson_date)
+SELECT a.id, a.student_id, a.schedule_id, a.status, a.notes, a.marked_by, a.marked_at, s.lesson_date
+FROM attendance_unpartitioned a
+JOIN schedule_unpartitioned s ON s.id = a.schedule_id;
+
+DROP TABLE attendance_unpartitioned;
+DROP TABLE schedule_unpartitioned;
+ALTER SEQUENCE schedule_id_seq OWNED BY schedule.id;
+ALTER SEQUENCE attendance_id_seq OWNED BY attendance.id;
+
+CREATE INDEX IF NOT EXISTS idx_schedule_date ON schedule(lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_group_date ON schedule(group_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_date ON schedule(teacher_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_group_date ON schedule(teacher_id, group_id, lesson_date);
+CREATE INDEX IF NOT EXISTS idx_schedule_discipline ON schedule(discipline_id);
+CREATE INDEX IF NOT EXISTS idx_schedule_series_date ON schedule(series_id, lesson_date) WHERE series_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance(student_id, marked_at);
+CREATE INDEX IF NOT EXISTS idx_attendance_schedule ON attendance(schedule_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_marked_at ON attendance(marked_at);
+
+-- Занятие отметки ищется вместе с датой: в одной секции, а не во всех
+CREATE OR REPLACE FUNCTION attendance_stats_attendance_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    s schedule%ROWTYPE;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT * INTO s FROM schedule WHERE id = OLD.schedule_id AND lesson_date = OLD.lesson_date;
+        IF FOUND THEN
+            PERFORM attendance_stats_apply(OLD.student_id, s.lesson_date, s.discipline_id, s.group_id,
+                                           s.teacher_id, OLD.status, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT * INTO s FROM schedule WHERE id = NEW.schedule_id AND lesson_date = NEW.lesson_date;
+        IF FOUND THEN
+            PERFORM attendance_stats_apply(NEW.student_id, s.lesson_date, s.discipline_id, s.group_id,
+                                           s.teacher_id, NEW.status, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- При переносе даты внутри месяца каскад мог уже перенести отметки на новую
+-- дату, поэтому ищутся обе. Перенос в другой месяц - это DELETE и INSERT
+-- секций: сводку правят триггеры удаления занятия и вставки отметок
+CREATE OR REPLACE FUNCTION attendance_stats_schedule_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN SELECT student_id, status FROM attendance
+             WHERE schedule_id = OLD.id AND lesson_date IN (OLD.lesson_date, NEW.lesson_date) LOOP
+        PERFORM attendance_stats_apply(r.student_id, OLD.lesson_date, OLD.discipline_id, OLD.group_id,
+                                       OLD.teacher_id, r.status, -1);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM attendance_stats_apply(r.student_id, NEW.lesson_date, NEW.discipline_id, NEW.group_id,
+                                           NEW.teacher_id, r.status, 1);
+        END IF;
+    END LOOP;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""" + ATTENDANCE_STATS_TRIGGERS_SQL + TEACHER_GROUPS_TRIGGERS_SQL + """
+ANALYZE schedule;
+ANALYZE attendance;
+"""),
+]
+
+MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations(
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Ключ advisory-блокировки: миграции не выполняются параллельно из нескольких процессов
+MIGRATIONS_LOCK_KEY = 7305001
+
+
+def applied_versions(db):
+    """Множество уже примененных версий"""
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(MIGRATIONS_TABLE_SQL)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        cur.close()
+        return versions
+
+
+def migrate(db, target=None):
+    """Применить ожидающие миграции (до версии target включительно).
+
+    Каждая миграция выполняется в своей транзакции. Возвращает список
+    примененных версий; при ошибке транзакция откатывается и исключение
+    пробрасывается дальше.
+    """
+    applied = []
+    pending = [m for m in MIGRATIONS if target is None or m[0] <= target]
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(MIGRATIONS_TABLE_SQL)
+        conn.commit()
+
+        for version, name, sql in pending:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+
+            print(f"Применяется миграция {version}: {name}")
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            applied.append(version)
+
+        cur.close()
+
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы БД посещаемости')
+    parser.add_argument('--status', action='store_true', help='показать примененные и ожидающие миграции')
+    parser.add_argument('--target', type=int, help='применить миграции до указанной версии')
+    parser.add_argument('--host')
+    parser.add_argument('--database')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ('host', 'database', 'user', 'password') if getattr(args, key)}
+    db = Database(minconn=1, maxconn=1, **params)
+    if not db.connect():
+        raise SystemExit(1)
+
+    try:
+        if args.status:
+            done = applied_versions(db)
+            for version, name, _ in MIGRATIONS:
+                mark = 'x' if version in done else ' '
+                print(f"[{mark}] {version:>3} {name}")
+        else:
+            applied = migrate(db, args.target)
+            print(f"Применено миграций: {len(applied)}")
+    except Error as e:
+        print(f"Ошибка миграции: {e}")
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
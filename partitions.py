@@ -0,0 +1,163 @@
+"""Помесячные секции таблиц schedule и attendance.
+
+Обе таблицы секционированы по дате занятия (миграция 9) с одинаковыми
+границами: на каждый месяц - schedule_ГГГГ_ММ и attendance_ГГГГ_ММ.
+Запросы с условием на lesson_date читают только нужные месяцы.
+
+Секции на PARTITION_MONTHS_AHEAD месяцев вперед создаются при старте
+приложения и этой командой (ее удобно запускать из cron); запись занятий
+на более поздние даты создает недостающие месяцы в той же транзакции
+(SQL-функция create_month_partitions). Прошедшие семестры отсоединяются
+целиком: отсоединенные таблицы остаются в БД обычными таблицами, их можно
+выгрузить и удалить. Сводки посещаемости сохраняют итоги этих месяцев.
+
+    python partitions.py                              # создать будущие секции
+    python partitions.py --list                       # показать секции
+    python partitions.py --detach-before 2024-09-01   # отсоединить месяцы до даты
+"""
+import argparse
+import re
+from datetime import date, datetime
+
+from psycopg2 import Error
+
+from db import Database
+
+# Расписание составляют на семестр-два вперед
+PARTITION_MONTHS_AHEAD = 12
+
+PARTITION_NAME = re.compile(r'^(schedule|attendance)_(\d{4})_(\d{2})$')
+
+PARTITIONS_SQL = """
+SELECT c.relname, c.reltuples::bigint
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent IN ('schedule'::regclass, 'attendance'::regclass)
+ORDER BY c.relname
+"""
+
+
+def add_months(day, months):
+    """Первое число месяца, отстоящего от day на months месяцев"""
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def ensure_partitions(db, start_date, end_date):
+    """Создать недостающие секции с месяца start_date по месяц end_date.
+
+    Возвращает число созданных таблиц или None при ошибке БД.
+    """
+    try:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT create_month_partitions(%s, %s)", (start_date, end_date))
+            created = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+            return created
+    except Error as e:
+        print(f"Ошибка создания секций: {e}")
+        return None
+
+
+def ensure_future_partitions(db, months_ahead=PARTITION_MONTHS_AHEAD, today=None):
+    """Секции с текущего месяца на months_ahead месяцев вперед"""
+    today = today or date.today()
+    return ensure_partitions(db, today.replace(day=1), add_months(today, months_ahead))
+
+
+def list_partitions(db):
+    """Присоединенные секции: список (таблица, первое число месяца, оценка строк)"""
+    rows = db.execute_query(PARTITIONS_SQL)
+    if rows is None:
+        return None
+    partitions = []
+    for name, estimate in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((match.group(1), date(int(match.group(2)), int(match.group(3)), 1),
+                               max(estimate, 0)))
+    return partitions
+
+
+def detach_before(db, before):
+    """Отсоединить секции месяцев, которые целиком раньше before.
+
+    Месяц отсоединяется в своей транзакции: сначала attendance (у отсоединенной
+    таблицы снимается внешний ключ на schedule), затем schedule. Возвращает
+    имена отсоединенных таблиц или None при ошибке БД.
+    """
+    partitions = list_partitions(db)
+    if partitions is None:
+        return None
+    attached = {(table, month) for table, month, _ in partitions}
+    months = sorted({month for _, month in attached if add_months(month, 1) <= before})
+
+    detached = []
+    try:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            for month in months:
+                for table in ('attendance', 'schedule'):
+                    if (table, month) not in attached:
+                        continue
+                    name = f"{table}_{month:%Y_%m}"
+                    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    if table == 'attendance':
+                        cur.execute("""
+                            SELECT conname FROM pg_constraint
+                            WHERE conrelid = %s::regclass AND confrelid = 'schedule'::regclass
+                        """, (name,))
+                        for conname, in cur.fetchall():
+                            cur.execute(f'ALTER TABLE {name} DROP CONSTRAINT "{conname}"')
+                    detached.append(name)
+                conn.commit()
+            cur.close()
+    except Error as e:
+        print(f"Ошибка отсоединения секций: {e}")
+        return None
+    return detached
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Секции таблиц schedule и attendance')
+    parser.add_argument('--list', action='store_true', help='показать секции и оценку числа строк')
+    parser.add_argument('--ahead', type=int, default=PARTITION_MONTHS_AHEAD,
+                        help='на сколько месяцев вперед создать секции')
+    parser.add_argument('--detach-before', help='отсоединить месяцы раньше даты (ГГГГ-ММ-ДД)')
+    parser.add_argument('--host')
+    parser.add_argument('--database')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ('host', 'database', 'user', 'password') if getattr(args, key)}
+    db = Database(minconn=1, maxconn=1, **params)
+    if not db.connect():
+        raise SystemExit(1)
+
+    try:
+        if args.list:
+            partitions = list_partitions(db) or []
+            for table, month, estimate in partitions:
+                print(f"{table:<12} {month:%Y-%m} {estimate:>12}")
+        elif args.detach_before:
+            before = datetime.strptime(args.detach_before, '%Y-%m-%d').date()
+            detached = detach_before(db, before)
+            if detached is None:
+                raise SystemExit(1)
+            print(f"Отсоединено секций: {len(detached)}")
+            for name in detached:
+                print(f"  {name}")
+        else:
+            created = ensure_future_partitions(db, args.ahead)
+            if created is None:
+                raise SystemExit(1)
+            print(f"Создано секций: {created}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
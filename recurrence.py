@@ -0,0 +1,209 @@
+"""Повторяющиеся занятия: еженедельный слот, развернутый в строки schedule.
+
+Серия (schedule_series) хранит шаблон - дисциплину, группу, преподавателя,
+день недели, время, аудиторию, тип, период и исключенные даты (праздники).
+Занятия серии создаются одним INSERT ... SELECT по массиву дат, занятые
+слоты группы находятся одним запросом по всем датам сразу. Правка и отмена
+действуют на все занятия серии начиная с указанной даты; прошедшие занятия
+и занятия с отметками посещаемости не трогаются.
+"""
+import re
+from datetime import datetime, timedelta
+
+from psycopg2 import Error
+
+WEEKDAYS = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+# Занятия группы, уже стоящие в этот день недели и время
+BUSY_SLOTS_SQL = """
+SELECT lesson_date FROM schedule
+WHERE group_id = %s AND lesson_time = %s AND lesson_date = ANY(%s::date[])
+ORDER BY lesson_date
+"""
+
+INSERT_LESSONS_SQL = """
+INSERT INTO schedule (discipline_id, group_id, teacher_id, lesson_date, lesson_time,
+                      classroom, lesson_type, series_id)
+SELECT %s, %s, %s, d, %s, %s, %s, %s
+FROM unnest(%s::date[]) AS d
+"""
+
+# Занятия с отметками посещаемости правка и отмена серии не трогают
+UNMARKED_LESSON_SQL = """NOT EXISTS (SELECT 1 FROM attendance a
+                  WHERE a.schedule_id = s.id AND a.lesson_date = s.lesson_date)"""
+
+# Занятия других серий и разовые занятия группы на новом времени серии
+SERIES_BUSY_SLOTS_SQL = """
+SELECT DISTINCT o.lesson_date
+FROM schedule s
+JOIN schedule o ON o.group_id = s.group_id AND o.lesson_date = s.lesson_date
+WHERE s.series_id = %s AND s.lesson_date >= %s AND """ + UNMARKED_LESSON_SQL + """
+  AND o.lesson_time = %s AND o.series_id IS DISTINCT FROM s.series_id
+ORDER BY o.lesson_date
+"""
+
+
+def parse_dates(text):
+    """Даты через запятую, пробел или с новой строки (ГГГГ-ММ-ДД или ДД.ММ.ГГГГ).
+
+    Возвращает (список дат, нераспознанные значения).
+    """
+    dates, invalid = [], []
+    for value in re.split(r'[\s,;]+', text or ''):
+        if not value:
+            continue
+        for fmt in DATE_FORMATS:
+            try:
+                dates.append(datetime.strptime(value, fmt).date())
+                break
+            except ValueError:
+                pass
+        else:
+            invalid.append(value)
+    return sorted(set(dates)), invalid
+
+
+def occurrences(weekday, start_date, end_date, excluded_dates=()):
+    """Даты занятий серии: день недели weekday (1 - понедельник) в периоде без исключенных"""
+    excluded = set(excluded_dates)
+    day = start_date + timedelta(days=(weekday - 1 - start_date.weekday()) % 7)
+    dates = []
+    while day <= end_date:
+        if day not in excluded:
+            dates.append(day)
+        day += timedelta(weeks=1)
+    return dates
+
+
+def create_series(db, discipline_id, group_id, teacher_id, weekday, lesson_time, classroom, lesson_type,
+                  start_date, end_date, excluded_dates=(), skip_conflicts=False):
+    """Создать серию и все ее занятия в одной транзакции.
+
+    Если у группы уже есть занятия в это время, серия не создается, а
+    занятые даты возвращаются в 'conflicts'; при skip_conflicts эти даты
+    пропускаются. Серия без единого занятия не создается (series_id None,
+    conflicts пуст, если в периоде нет дат). Возвращает {'series_id',
+    'created', 'conflicts'} или None при ошибке БД.
+    """
+    dates = occurrences(weekday, start_date, end_date, excluded_dates)
+    if not dates:
+        return {'series_id': None, 'created': 0, 'conflicts': []}
+    try:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(BUSY_SLOTS_SQL, (group_id, lesson_time, dates))
+            conflicts = [row[0] for row in cur.fetchall()]
+            busy = set(conflicts)
+            free = [day for day in dates if day not in busy]
+            if not free or (conflicts and not skip_conflicts):
+                cur.close()
+                conn.rollback()
+                return {'series_id': None, 'created': 0, 'conflicts': conflicts}
+
+            # Недостающие месяцы периода - в той же транзакции
+            cur.execute("SELECT create_month_partitions(%s, %s)", (start_date, end_date))
+            cur.execute("""
+            INSERT INTO schedule_series (discipline_id, group_id, teacher_id, weekday, lesson_time,
+                                         classroom, lesson_type, start_date, end_date, excluded_dates)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::date[])
+            RETURNING id
+            """, (discipline_id, group_id, teacher_id, weekday, lesson_time, classroom, lesson_type,
+                  start_date, end_date, list(excluded_dates)))
+            series_id = cur.fetchone()[0]
+
+            cur.execute(INSERT_LESSONS_SQL, (discipline_id, group_id, teacher_id, lesson_time, classroom,
+                                             lesson_type, series_id, free))
+            conn.commit()
+            cur.close()
+            return {'series_id': series_id, 'created': len(free), 'conflicts': conflicts}
+    except Error as e:
+        print(f"Ошибка создания серии занятий: {e}")
+        return None
+
+
+def update_series(db, series_id, teacher_id, lesson_time, classroom, lesson_type, from_date):
+    """Изменить преподавателя, время, аудиторию и тип занятий серии с from_date,
+    кроме уже отмеченных.
+
+    Если новое время занято у группы другими занятиями, ничего не меняется.
+    Возвращает {'updated', 'kept', 'conflicts', 'group_id'} (kept - занятия
+    с отметками; group_id равен None, если серии нет) или None при ошибке БД.
+    """
+    try:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(SERIES_BUSY_SLOTS_SQL, (series_id, from_date, lesson_time))
+            conflicts = [row[0] for row in cur.fetchall()]
+            if conflicts:
+                cur.close()
+                conn.rollback()
+                return {'updated': 0, 'kept': 0, 'conflicts': conflicts}
+
+            cur.execute("""
+            WITH changed AS (
+                UPDATE schedule s
+                SET teacher_id = %s, lesson_time = %s, classroom = %s, lesson_type = %s
+                WHERE s.series_id = %s AND s.lesson_date >= %s AND """ + UNMARKED_LESSON_SQL + """
+                RETURNING s.id
+            )
+            SELECT (SELECT COUNT(*) FROM changed),
+                   (SELECT COUNT(*) FROM schedule
+                    WHERE series_id = %s AND lesson_date >= %s) - (SELECT COUNT(*) FROM changed)
+            """, (teacher_id, lesson_time, classroom, lesson_type, series_id, from_date, series_id, from_date))
+            updated, kept = cur.fetchone()
+            cur.execute("""
+            UPDATE schedule_series
+            SET teacher_id = %s, lesson_time = %s, classroom = %s, lesson_type = %s
+            WHERE id = %s
+            RETURNING group_id
+            """, (teacher_id, lesson_time, classroom, lesson_type, series_id))
+            row = cur.fetchone()
+            if row is None:
+                cur.close()
+                conn.rollback()
+                return {'updated': 0, 'kept': 0, 'conflicts': [], 'group_id': None}
+            group_id = row[0]
+            conn.commit()
+            cur.close()
+            return {'updated': updated, 'kept': kept, 'conflicts': [], 'group_id': group_id}
+    except Error as e:
+        print(f"Ошибка изменения серии занятий: {e}")
+        return None
+
+
+def cancel_series(db, series_id, from_date):
+    """Отменить серию: удалить ее занятия с from_date, кроме уже отмеченных.
+
+    Возвращает {'deleted', 'kept', 'group_id'} (kept - занятия с отметками;
+    group_id равен None, если серии нет) или None при ошибке БД.
+    """
+    try:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+            WITH removed AS (
+                DELETE FROM schedule s
+                WHERE s.series_id = %s AND s.lesson_date >= %s AND """ + UNMARKED_LESSON_SQL + """
+                RETURNING s.id
+            )
+            SELECT (SELECT COUNT(*) FROM removed),
+                   (SELECT COUNT(*) FROM schedule
+                    WHERE series_id = %s AND lesson_date >= %s) - (SELECT COUNT(*) FROM removed)
+            """, (series_id, from_date, series_id, from_date))
+            deleted, kept = cur.fetchone()
+            cur.execute("UPDATE schedule_series SET cancelled_at = CURRENT_TIMESTAMP WHERE id = %s "
+                        "RETURNING group_id", (series_id,))
+            row = cur.fetchone()
+            if row is None:
+                cur.close()
+                conn.rollback()
+                return {'deleted': 0, 'kept': 0, 'group_id': None}
+            group_id = row[0]
+            conn.commit()
+            cur.close()
+            return {'deleted': deleted, 'kept': kept, 'group_id': group_id}
+    except Error as e:
+        print(f"Ошибка отмены серии занятий: {e}")
+        return None
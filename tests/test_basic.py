@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import sys
 import os
 from datetime import date, datetime, timedelta
@@ -19,6 +19,16 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Кэши модуля main не должны переживать тест"""
+    import main
+    main.reference_cache.clear()
+    main.schedule_cache.clear()
+    yield
+    main.reference_cache.clear()
+    main.schedule_cache.clear()
+
 @pytest.fixture
 def mock_db():
     """Создаем мок базы данных с расширенной функциональностью"""
@@ -91,6 +101,14 @@ def mock_db():
     
     mock.get_user_by_login.side_effect = get_user_by_login
     mock.execute_query.side_effect = execute_query
+    def execute_prepared(name, params=None, fetch=True):
+        from main import HOT_STATEMENTS
+        return mock.execute_query(HOT_STATEMENTS[name], params)
+    
+    mock.execute_prepared.side_effect = execute_prepared
+    mock.statement_stats.return_value = {}
+    mock.execute_batch.side_effect = lambda queries: {
+        name: mock.execute_query(query, params) for name, (query, params) in queries.items()}
     mock.execute_insert.return_value = True
     mock.connect.return_value = True
     mock.close.return_value = None
@@ -113,18 +131,22 @@ def test_get_today_schedule_function():
     from main import get_today_schedule
     
     with patch('main.db') as mock_db:
-        # Мок для студента
-        mock_db.execute_query.return_value = [
-            (1, 'Математика', '09:00', '301', 'Лекция', 'Иванова М.П.', date.today())
+        # Мок для студента: расписание недели группы, из него берется сегодняшний день
+        mock_db.execute_prepared.return_value = [
+            (1, 'Математика', date.today(), '09:00', '301', 'Лекция', 'Иванова М.П.'),
+            (2, 'Физика', date.today() + timedelta(days=7), '11:00', '302', 'Практика', 'Петров И.И.')
         ]
         
         result = get_today_schedule(1, 'Студент', 1)
+        start = date.today() - timedelta(days=date.today().weekday())
+        assert mock_db.execute_prepared.call_args[0] == (
+            'group_schedule', (1, start, start + timedelta(days=6)))
         assert len(result) == 1
         assert result[0][1] == 'Математика'
         assert result[0][3] == '301'
         
         # Мок для преподавателя
-        mock_db.execute_query.return_value = [
+        mock_db.execute_prepared.return_value = [
             (1, 'Математика', '09:00', '301', 'Лекция', 'ИВТ-101', date.today())
         ]
         
@@ -133,7 +155,7 @@ def test_get_today_schedule_function():
         assert result[0][5] == 'ИВТ-101'
         
         # Мок для администратора
-        mock_db.execute_query.return_value = [
+        mock_db.execute_prepared.return_value = [
             (1, 'Математика', '09:00', '301', 'Лекция', 'ИВТ-101', 'Иванова М.П.', date.today())
         ]
         
@@ -146,7 +168,7 @@ def test_get_student_attendance_function():
     from main import get_student_attendance
     
     with patch('main.db') as mock_db:
-        mock_db.execute_query.return_value = [
+        mock_db.execute_prepared.return_value = [
             (1, 'Математика', date.today(), '09:00', 'Присутствовал', '', 'Иванова М.П.', '301'),
             (2, 'Физика', date.today(), '11:00', 'Отсутствовал', 'Болел', 'Петров А.С.', '302')
         ]
@@ -162,9 +184,7 @@ def test_get_student_attendance_function():
         start_date = date.today() - timedelta(days=7)
         end_date = date.today()
         result = get_student_attendance(1, start_date, end_date)
-        assert mock_db.execute_query.called
-        call_args = mock_db.execute_query.call_args[0][1]
-        assert len(call_args) == 3  # student_id, start_date, end_date
+        assert mock_db.execute_prepared.call_args[0] == ('student_attendance', (1, start_date, end_date, start_date, end_date))
 
 def test_get_teacher_disciplines_function():
     """Тест функции получения дисциплин преподавателя"""
@@ -626,17 +646,84 @@ def test_database_connection():
     assert db.database == 'test_db'
     assert db.user == 'test_user'
     assert db.password == 'test_pass'
-    assert db.conn is None
-    
+    assert db.pool is None
+
     # Тест подключения
     with patch('db.psycopg2.connect') as mock_connect:
         mock_connect.return_value = MagicMock()
         assert db.connect() == True
-        assert db.conn is not None
-        
+        assert db.pool is not None
+
         # Тест закрытия
         db.close()
-        assert db.conn.close.called
+        assert mock_connect.return_value.close.called
+
+def make_mock_connection():
+    """Мок соединения psycopg2 в состоянии простоя"""
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = 0
+    return conn
+
+def test_connection_pool_reuses_connections():
+    """Пул выдает уже открытые соединения и не превышает maxconn"""
+    from db import ConnectionPool
+    from psycopg2.pool import PoolError
+
+    connect = Mock(side_effect=lambda: make_mock_connection())
+    pool = ConnectionPool(connect, minconn=1, maxconn=2, timeout=0.05)
+    assert connect.call_count == 1
+
+    first = pool.getconn()
+    second = pool.getconn()
+    assert first is not second
+    assert connect.call_count == 2
+
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+    pool.putconn(first)
+    assert pool.getconn() is first
+    assert connect.call_count == 2
+
+def test_connection_pool_replaces_broken_connections():
+    """Закрытое или разорванное соединение заменяется новым при выдаче"""
+    import psycopg2
+    from db import ConnectionPool
+
+    connect = Mock(side_effect=lambda: make_mock_connection())
+    pool = ConnectionPool(connect, minconn=1, maxconn=1, check_interval=0)
+
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.closed = 1
+
+    replacement = pool.getconn()
+    assert replacement is not conn
+    assert connect.call_count == 2
+
+    # Соединение, не прошедшее проверку SELECT 1, тоже заменяется
+    pool.putconn(replacement)
+    replacement.cursor.return_value.execute.side_effect = psycopg2.OperationalError("server closed")
+    assert pool.getconn() is not replacement
+    assert connect.call_count == 3
+
+def test_database_holds_one_connection_per_request():
+    """В рамках запроса все обращения к БД идут через одно соединение"""
+    from db import Database
+
+    db = Database()
+    with patch('db.psycopg2.connect', side_effect=lambda **kw: make_mock_connection()):
+        assert db.connect()
+        db.begin_request()
+        with db.connection() as first:
+            pass
+        with db.connection() as second:
+            pass
+        assert first is second
+        db.end_request()
+
+        assert db.pool._idle[-1][0] is first
 
 def test_nonexistent_route(client):
     """Запрос несуществующего маршрута"""
@@ -646,4 +733,1287 @@ def test_nonexistent_route(client):
 def test_method_not_allowed(client):
     """Использование неправильного метода HTTP"""
     response = client.post('/')  # POST на главную страницу
-    assert response.status_code == 405  # Method Not Allowed
\ No newline at end of file
+    assert response.status_code == 405  # Method Not Allowed
+# ========== ПАКЕТНАЯ ОТМЕТКА ПОСЕЩАЕМОСТИ ==========
+
+def login_as_teacher(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 2
+        session['login'] = 'teacher1'
+        session['full_name'] = 'Иванова Мария'
+        session['role'] = 'Преподаватель'
+
+def test_mark_attendance_batch(client, mock_db):
+    """Отметки группы сохраняются одним вызовом, ошибки возвращаются по студентам"""
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = [(10,)]
+    mock_db.upsert_attendance_batch.return_value = {1}
+
+    with patch('main.db', mock_db):
+        response = client.post('/teacher/attendance/mark/batch', json={
+            'schedule_id': 10,
+            'lesson_date': '2024-03-01',
+            'marks': [
+                {'student_id': 1, 'status': 'Присутствовал', 'notes': ''},
+                {'student_id': 5, 'status': 'Опоздал'},
+                {'student_id': 7, 'status': 'Не отмечен'}
+            ]
+        })
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['saved'] == 1
+    assert data['success'] is False
+    results = {item['student_id']: item for item in data['results']}
+    assert results[1]['success'] is True
+    assert results[5]['error'] == 'Студент не найден в группе'
+    assert results[7]['error'] == 'Некорректный статус'
+
+    mock_db.upsert_attendance_batch.assert_called_once_with(
+        10, date(2024, 3, 1), [(1, 'Присутствовал', ''), (5, 'Опоздал', '')], 2
+    )
+    # Занятие ищется вместе с датой: читается одна секция schedule
+    assert mock_db.execute_query.call_args[0][1] == (10, date(2024, 3, 1), 2)
+
+def test_mark_attendance_batch_reports_invalid_marks(client, mock_db):
+    """Отметки без корректного student_id и с примечанием не строкой не теряются молча"""
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = [(10,)]
+    mock_db.upsert_attendance_batch.return_value = {1}
+
+    with patch('main.db', mock_db):
+        response = client.post('/teacher/attendance/mark/batch', json={
+            'schedule_id': 10,
+            'lesson_date': '2024-03-01',
+            'marks': [
+                {'student_id': '1', 'status': 'Присутствовал'},
+                {'status': 'Опоздал'},
+                {'student_id': 'abc', 'status': 'Опоздал'},
+                {'student_id': 2.5, 'status': 'Опоздал'},
+                {'student_id': 3, 'status': 'Опоздал', 'notes': {'text': 'пробки'}},
+            ]
+        })
+
+    data = response.get_json()
+    assert data['success'] is False
+    assert data['saved'] == 1
+    assert {'student_id': 1, 'success': True, 'error': None} in data['results']
+    assert {'student_id': 3, 'success': False, 'error': 'Примечание должно быть строкой'} in data['results']
+    invalid = [item for item in data['results'] if 'index' in item]
+    assert [(item['index'], item['student_id']) for item in invalid] == [(1, None), (2, 'abc'), (3, 2.5)]
+    assert all(item['error'] == 'Некорректный student_id' for item in invalid)
+    mock_db.upsert_attendance_batch.assert_called_once_with(
+        10, date(2024, 3, 1), [(1, 'Присутствовал', '')], 2)
+
+def test_mark_attendance_batch_requires_lesson_date(client, mock_db):
+    """Без даты занятия отметки не принимаются"""
+    login_as_teacher(client)
+
+    with patch('main.db', mock_db):
+        response = client.post('/teacher/attendance/mark/batch', json={
+            'schedule_id': 10,
+            'lesson_date': '01.03.2024',
+            'marks': [{'student_id': 1, 'status': 'Присутствовал'}]
+        })
+
+    assert response.status_code == 400
+    assert not mock_db.execute_query.called
+    assert not mock_db.upsert_attendance_batch.called
+
+def test_mark_attendance_batch_foreign_class(client, mock_db):
+    """Нельзя отметить посещаемость чужого занятия"""
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = []
+
+    with patch('main.db', mock_db):
+        response = client.post('/teacher/attendance/mark/batch', json={
+            'schedule_id': 99,
+            'lesson_date': '2024-03-01',
+            'marks': [{'student_id': 1, 'status': 'Присутствовал'}]
+        })
+
+    assert response.status_code == 404
+    assert not mock_db.upsert_attendance_batch.called
+
+def test_upsert_attendance_batch_single_statement():
+    """Пакетная запись выполняется одним запросом и одним commit"""
+    from db import Database
+
+    db = Database()
+    conn = make_mock_connection()
+    conn.cursor.return_value.fetchall.return_value = [(1,), (2,)]
+    with patch('db.psycopg2.connect', return_value=conn):
+        assert db.connect()
+        saved = db.upsert_attendance_batch(10, date(2024, 3, 1),
+                                           [(1, 'Присутствовал', ''), (2, 'Опоздал', 'пробки')], 3)
+
+    assert saved == {1, 2}
+    cur = conn.cursor.return_value
+    # Первый вызов на соединении подготавливает запрос, дальше - только EXECUTE
+    (prepare,), (execute, params) = [c[0] for c in cur.execute.call_args_list]
+    assert prepare.startswith('PREPARE attendance_upsert AS')
+    assert 'ON CONFLICT (student_id, schedule_id, lesson_date) DO UPDATE' in prepare
+    assert "pg_notify('attendance_changes'" in prepare
+    assert 'WHERE s.id = $1 AND s.lesson_date = $2' in prepare and '%s' not in prepare
+    assert execute == 'EXECUTE attendance_upsert (%s, %s, %s, %s, %s, %s)'
+    assert params == (10, date(2024, 3, 1), 3, [1, 2], ['Присутствовал', 'Опоздал'], ['', 'пробки'])
+    assert conn.commit.call_count == 1
+
+def test_prepared_statements_per_connection():
+    """Запрос готовится один раз на соединение и заново - на новом или сброшенном соединении"""
+    from db import Database
+    from psycopg2.errors import InvalidSqlStatementName
+
+    db = Database(minconn=1, maxconn=1)
+    db.prepare('group_students', "SELECT id FROM users WHERE group_id = %s AND login LIKE 'st%%'")
+    conn = make_mock_connection()
+    conn.prepared = set()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [(1,)]
+    with patch('db.psycopg2.connect', return_value=conn):
+        db.connect()
+        assert db.execute_prepared('group_students', (5,)) == [(1,)]
+        assert db.execute_prepared('group_students', (6,)) == [(1,)]
+        # Сервер потерял подготовленный запрос (DISCARD ALL): подготовить заново и повторить
+        cur.execute.side_effect = [InvalidSqlStatementName(), None, None]
+        assert db.execute_prepared('group_students', (7,)) == [(1,)]
+
+    statements = [c[0][0] for c in cur.execute.call_args_list]
+    assert statements == [
+        "PREPARE group_students AS SELECT id FROM users WHERE group_id = $1 AND login LIKE 'st%'",
+        'EXECUTE group_students (%s)', 'EXECUTE group_students (%s)',
+        'EXECUTE group_students (%s)',
+        "PREPARE group_students AS SELECT id FROM users WHERE group_id = $1 AND login LIKE 'st%'",
+        'EXECUTE group_students (%s)',
+    ]
+    conn.rollback.assert_called()
+    assert db.statement_stats()['group_students'] == {'calls': 3, 'prepares': 2}
+
+def test_mark_attendance_single_upsert(client, mock_db):
+    """Одиночная отметка записывается через upsert без предварительного SELECT"""
+    login_as_teacher(client)
+    mock_db.upsert_attendance.return_value = True
+
+    with patch('main.db', mock_db):
+        response = client.post('/teacher/attendance/mark', data={
+            'schedule_id': '10',
+            'lesson_date': '2024-03-01',
+            'student_id': '1',
+            'status': 'Опоздал',
+            'notes': ''
+        }, headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    assert response.get_json() == {'success': True}
+    mock_db.upsert_attendance.assert_called_once_with(1, 10, date(2024, 3, 1), 'Опоздал', '', 2)
+    assert not mock_db.execute_query.called
+
+def test_mark_attendance_rejects_invalid_student(client, mock_db):
+    """Некорректный student_id отклоняется до обращения к БД"""
+    login_as_teacher(client)
+    form = {'schedule_id': '10', 'lesson_date': '2024-03-01', 'student_id': '1 OR 1=1', 'status': 'Опоздал'}
+
+    with patch('main.db', mock_db):
+        ajax = client.post('/teacher/attendance/mark', data=form, headers={'X-Requested-With': 'XMLHttpRequest'})
+        del form['student_id']
+        page = client.post('/teacher/attendance/mark', data=form, follow_redirects=True)
+
+    assert ajax.status_code == 400
+    assert ajax.get_json() == {'success': False, 'error': 'Некорректный студент или занятие'}
+    assert 'Некорректный студент или занятие' in page.data.decode('utf-8')
+    assert not mock_db.upsert_attendance.called
+
+# ========== СВОДНАЯ СТАТИСТИКА ==========
+
+def executed_queries(mock_db):
+    return [call[0][0] for call in mock_db.execute_query.call_args_list]
+
+def test_student_dashboard_reads_rollup(client, mock_db):
+    """Статистика студента считается по сводке, а не по сырой посещаемости"""
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['login'] = 'student1'
+        session['full_name'] = 'Сидоров Иван'
+        session['role'] = 'Студент'
+        session['group_id'] = 1
+
+    with patch('main.db', mock_db):
+        response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    queries = executed_queries(mock_db)
+    assert any('FROM attendance_daily_stats' in q for q in queries)
+    assert not any('FROM attendance a' in q for q in queries)
+
+def test_teacher_statistics_reads_rollup(client, mock_db):
+    """Статистика преподавателя группируется по сводке с фильтром по группе"""
+    login_as_teacher(client)
+
+    with patch('main.db', mock_db):
+        response = client.get('/teacher/statistics?group_id=1')
+
+    assert response.status_code == 200
+    stats_call = [call for call in mock_db.execute_query.call_args_list
+                  if 'FROM attendance_daily_stats st' in call[0][0]]
+    assert len(stats_call) == 1
+    query, params = stats_call[0][0]
+    assert 'st.group_id = %s' in query
+    assert params[0] == 2 and params[-1] == '1'
+
+def test_teacher_groups_from_maintained_relation(client, mock_db):
+    """Группы преподавателя читаются из teacher_groups, по желанию - за текущий семестр"""
+    from main import semester_bounds
+
+    assert semester_bounds(date(2024, 10, 5)) == (date(2024, 9, 1), date(2025, 1, 31))
+    assert semester_bounds(date(2025, 1, 20)) == (date(2024, 9, 1), date(2025, 1, 31))
+    assert semester_bounds(date(2025, 3, 1)) == (date(2025, 2, 1), date(2025, 8, 31))
+
+    login_as_teacher(client)
+    with patch('main.db', mock_db):
+        client.get('/teacher/statistics')
+        client.get('/teacher/statistics?current_semester=1')
+
+    groups_calls = [call[0][0]['groups'] for call in mock_db.execute_batch.call_args_list]
+    assert all('FROM teacher_groups tg' in query for query, _ in groups_calls)
+    assert 'FROM schedule' not in groups_calls[0][0]
+    assert groups_calls[0][1] == [2]
+    # Пересечение периода с семестром уточняется проверкой занятия в самом семестре
+    assert 'EXISTS (SELECT 1 FROM schedule s' in groups_calls[1][0]
+    assert groups_calls[1][1] == [2, *semester_bounds(date.today()) * 2]
+
+def test_student_disciplines_read_counters(client, mock_db):
+    """Дисциплины студента читают счетчики по статусам одним запросом"""
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['full_name'] = 'Сидоров Иван'
+        session['role'] = 'Студент'
+        session['group_id'] = 1
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = [
+        (1, 'Математика', None, 72, 1, 'Иванова М.П.', 12, 9, 1, 1, 1)
+    ]
+
+    with patch('main.db', mock_db):
+        response = client.get('/student/disciplines')
+
+    assert response.status_code == 200
+    assert mock_db.execute_query.call_count == 1
+    query, params = mock_db.execute_query.call_args[0]
+    assert 'student_discipline_stats' in query and 'FROM attendance' not in query
+    assert params == (1, 1)
+    html = response.data.decode('utf-8')
+    assert '12/72' in html and 'Присутствовал: 9' in html
+
+# ========== МИГРАЦИИ ==========
+
+def test_migrate_applies_only_pending_versions():
+    """Уже примененные миграции пропускаются, новые записываются в schema_migrations"""
+    import migrations
+    from db import Database
+
+    db = Database()
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    # Версия 1 уже применена, остальные - нет
+    cur.fetchone.side_effect = lambda: (1,) if cur.execute.call_args[0][1] == (1,) else None
+
+    with patch('db.psycopg2.connect', return_value=conn):
+        assert db.connect()
+        applied = migrations.migrate(db)
+
+    expected = [version for version, _, _ in migrations.MIGRATIONS if version != 1]
+    assert applied == expected
+    recorded = [call[0][1][0] for call in cur.execute.call_args_list
+                if 'INSERT INTO schema_migrations' in call[0][0]]
+    assert recorded == expected
+
+def test_migration_versions_are_ordered():
+    """Версии миграций уникальны и идут по возрастанию"""
+    import migrations
+
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+def test_future_partitions_cover_months_ahead():
+    """Секции создаются с текущего месяца на заданное число месяцев вперед"""
+    import partitions
+
+    assert partitions.add_months(date(2024, 11, 15), 3) == date(2025, 2, 1)
+    assert partitions.add_months(date(2024, 1, 31), -1) == date(2023, 12, 1)
+
+    db = MagicMock()
+    cur = db.connection.return_value.__enter__.return_value.cursor.return_value
+    cur.fetchone.return_value = (4,)
+    assert partitions.ensure_future_partitions(db, 2, today=date(2024, 11, 15)) == 4
+    assert cur.execute.call_args[0] == ("SELECT create_month_partitions(%s, %s)",
+                                        (date(2024, 11, 1), date(2025, 1, 1)))
+
+def test_detach_partitions_before_date():
+    """Отсоединяются только месяцы раньше даты: attendance раньше schedule, без внешнего ключа"""
+    import partitions
+
+    db = MagicMock()
+    db.execute_query.return_value = [
+        ('attendance_2024_01', 1000), ('attendance_2024_02', 900), ('attendance_2024_03', 800),
+        ('schedule_2024_01', 100), ('schedule_2024_02', 90), ('schedule_2024_03', 80),
+    ]
+    conn = db.connection.return_value.__enter__.return_value
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [('attendance_schedule_id_lesson_date_fkey',)]
+
+    detached = partitions.detach_before(db, date(2024, 3, 1))
+
+    assert detached == ['attendance_2024_01', 'schedule_2024_01', 'attendance_2024_02', 'schedule_2024_02']
+    statements = [' '.join(call[0][0].split()) for call in cur.execute.call_args_list]
+    assert [q for q in statements if 'DETACH' in q][:2] == [
+        'ALTER TABLE attendance DETACH PARTITION attendance_2024_01',
+        'ALTER TABLE schedule DETACH PARTITION schedule_2024_01',
+    ]
+    assert ('ALTER TABLE attendance_2024_01 DROP CONSTRAINT "attendance_schedule_id_lesson_date_fkey"'
+            in statements)
+    assert conn.commit.call_count == 2
+
+# ========== КЭШ СПРАВОЧНИКОВ ==========
+
+def test_ttl_cache_expiry_and_eviction():
+    """Записи устаревают по TTL, при переполнении вытесняются самые старые"""
+    from cache import TTLCache
+
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'a' становится самым свежим
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    with patch('cache.time.monotonic', return_value=10 ** 9):
+        assert cache.get('a') is None
+    assert len(cache) == 1
+
+def test_reference_lists_cached_until_invalidated(client, mock_db):
+    """Список групп читается из БД один раз и перечитывается после изменения групп"""
+    with client.session_transaction() as session:
+        session['user_id'] = 3
+        session['login'] = 'admin'
+        session['full_name'] = 'Администратор'
+        session['role'] = 'Администратор'
+
+    def groups_queries():
+        return [q for q in executed_queries(mock_db)
+                if q == "SELECT id, group_code FROM student_groups ORDER BY group_code"]
+
+    with patch('main.db', mock_db):
+        client.get('/admin/user/add')
+        client.get('/admin/schedule/add')
+        assert len(groups_queries()) == 1
+
+        client.post('/admin/group/add', data={'group_code': 'ИВТ-301', 'year_of_study': '3'})
+        client.get('/admin/user/add')
+        assert len(groups_queries()) == 2
+
+def test_ttl_cache_single_flight():
+    """Одновременные промахи по одному ключу ждут единственную загрузку"""
+    import threading
+    from cache import TTLCache
+
+    cache = TTLCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ['row']
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader)))
+               for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [['row']] * 5
+
+def test_ttl_cache_invalidate_during_load():
+    """Сброс во время загрузки не дает сохранить устаревшее значение"""
+    from cache import TTLCache
+
+    cache = TTLCache(ttl=60)
+    cache.set(('g', 1), 'a')
+    cache.set(('g', 2), 'b')
+    cache.invalidate_where(lambda key: key[1] == 1)
+    assert cache.get(('g', 1)) is None and cache.get(('g', 2)) == 'b'
+
+    def loader():
+        cache.invalidate('k')
+        return 'old'
+
+    assert cache.get_or_load('k', loader) == 'old'
+    assert cache.get('k') is None
+
+def test_group_schedule_shared_between_students(client, mock_db):
+    """Студенты одной группы читают неделю из общего кэша до изменения расписания"""
+    def schedule_loads():
+        return [call for call in mock_db.execute_prepared.call_args_list
+                if call[0][0] == 'group_schedule']
+
+    with patch('main.db', mock_db):
+        for user_id in (1, 4):
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+                session['role'] = 'Студент'
+                session['group_id'] = 1
+                session['full_name'] = 'Студент'
+            assert client.get('/student/schedule').status_code == 200
+            client.get('/dashboard')
+        assert len(schedule_loads()) == 1
+
+        login_as_admin(client)
+        client.post('/admin/schedule/add', data={
+            'discipline_id': '1', 'group_id': '1', 'teacher_id': '2',
+            'lesson_date': date.today().isoformat(), 'lesson_time': '09:00',
+            'classroom': '301', 'lesson_type': 'Лекция'})
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'Студент'
+            session['group_id'] = 1
+        client.get('/student/schedule')
+        assert len(schedule_loads()) == 2
+
+# ========== СТАТИСТИКА АДМИНИСТРАТОРА ==========
+
+def login_as_admin(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 3
+        session['login'] = 'admin'
+        session['full_name'] = 'Администратор'
+        session['role'] = 'Администратор'
+
+def test_admin_statistics_single_query(client, mock_db):
+    """Страница статистики администратора собирается одним запросом"""
+    login_as_admin(client)
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = [(
+        150, 20, 10, 45, 15, 120,
+        85.5, 8.2, 4.3, 2.0,
+        [['ИВТ-101', 300, 91.2]],
+        [[7, 'Сидоров Иван', 'Математика', 'Опоздал', '2024-03-01T09:15:00', 'ИВТ-101']]
+    )]
+
+    with patch('main.db', mock_db):
+        response = client.get('/admin/statistics')
+
+    assert response.status_code == 200
+    assert mock_db.execute_query.call_count == 1
+    html = response.data.decode('utf-8')
+    assert '91.2%' in html
+    assert '09:15 01.03.2024' in html
+
+def test_admin_dashboard_runs_stats_once(client, mock_db):
+    """Счетчики панели администратора запрашиваются один раз"""
+    login_as_admin(client)
+
+    with patch('main.db', mock_db):
+        response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    stats_calls = [q for q in executed_queries(mock_db) if 'SELECT COUNT(*) FROM users' in q]
+    assert len(stats_calls) == 1
+
+# ========== АСИНХРОННЫЙ ДОСТУП ==========
+
+def test_dashboard_fans_out_through_async_pool(client, mock_db):
+    """Панель студента отправляет независимые запросы одним пакетом в асинхронный пул"""
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['full_name'] = 'Сидоров Иван'
+        session['role'] = 'Студент'
+        session['group_id'] = 1
+
+    adb = Mock(pool=object())
+    adb.gather = AsyncMock(return_value={
+        'disciplines': [('Математика', 72, 1)],
+        'group': [('ИВТ-101',)], 'stats': [(10, 8, 1, 1, 0)],
+    })
+    with patch('main.db', mock_db), patch('main.adb', adb):
+        response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    assert 'ИВТ-101' in response.data.decode('utf-8')
+    queries = adb.gather.call_args[0][0]
+    # Расписание на сегодня берется из общего кэша группы
+    assert set(queries) == {'disciplines', 'group', 'stats'}
+    assert 'FROM attendance_daily_stats' in queries['stats'][0]
+    assert mock_db.execute_prepared.call_args[0][0] == 'group_schedule'
+
+def test_async_database_gather_runs_concurrently():
+    """AsyncDatabase.gather выполняет запросы одновременно и возвращает их по именам"""
+    import asyncio
+    from async_db import AsyncDatabase
+
+    adb = AsyncDatabase()
+    seen = []
+    adb.add_query_observer(lambda query, seconds, rows: seen.append((query, rows)))
+    running = {'now': 0, 'max': 0}
+
+    async def fake_query(query, params, fetch):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(0.05)
+        running['now'] -= 1
+        return [(query, params)]
+
+    pool = MagicMock(open=AsyncMock(), close=AsyncMock())
+    with patch('async_db.AsyncConnectionPool', return_value=pool):
+        assert adb.connect() is True
+    try:
+        with patch.object(adb, '_query', fake_query):
+            result = asyncio.run(adb.gather({'a': ("SELECT 1", None), 'b': ("SELECT %s", (2,))}))
+    finally:
+        adb.close()
+
+    assert result == {'a': [("SELECT 1", None)], 'b': [("SELECT %s", (2,))]}
+    assert running['max'] == 2
+    assert sorted(seen) == [("SELECT %s", 1), ("SELECT 1", 1)]
+    pool.close.assert_awaited_once()
+
+def test_execute_batch_runs_queries_concurrently():
+    """execute_batch выполняет запросы на разных соединениях одновременно"""
+    import time
+    from db import Database
+
+    def slow_connection(**kwargs):
+        conn = make_mock_connection()
+        cur = conn.cursor.return_value
+        cur.execute.side_effect = lambda query, params=None: time.sleep(0.1)
+        cur.fetchall.side_effect = lambda: [(conn,)]
+        return conn
+
+    db = Database(minconn=1, maxconn=4)
+    with patch('db.psycopg2.connect', side_effect=slow_connection):
+        db.connect()
+        db.begin_request()
+        started = time.perf_counter()
+        result = db.execute_batch({name: ("SELECT %s", (name,)) for name in 'abc'})
+        elapsed = time.perf_counter() - started
+        db.end_request()
+        db.close()
+
+    assert list(result) == ['a', 'b', 'c']
+    assert len({rows[0][0] for rows in result.values()}) == 3
+    assert elapsed < 0.25
+
+def test_execute_batch_falls_back_to_request_connection():
+    """Без свободных соединений пакет выполняется на соединении запроса, не дожидаясь пула"""
+    import time
+    from db import Database
+
+    def connection(**kwargs):
+        conn = make_mock_connection()
+        conn.cursor.return_value.fetchall.side_effect = lambda: [(conn,)]
+        return conn
+
+    db = Database(minconn=1, maxconn=2)
+    with patch('db.psycopg2.connect', side_effect=connection):
+        db.connect()
+        db.begin_request()
+        busy = db.pool.getconn()  # второе соединение занято другим запросом
+        started = time.perf_counter()
+        result = db.execute_batch({name: ("SELECT %s", (name,)) for name in 'abc'})
+        elapsed = time.perf_counter() - started
+        pinned = db._local.conn
+        db.pool.putconn(busy)
+        db.end_request()
+        db.close()
+
+    assert {rows[0][0] for rows in result.values()} == {pinned}
+    assert elapsed < db.pool.timeout
+
+# ========== ОТМЕТКИ ЗАНЯТИЯ ==========
+
+def test_attendance_class_single_query_with_etag(client, mock_db):
+    """Данные занятия приходят одним запросом, повторное открытие дает 304"""
+    login_as_teacher(client)
+    payload = {
+        'class_info': {'id': 5, 'name': 'Математика', 'date': '01.03.2024', 'time': '09:00:00',
+                       'group': 'ИВТ-101', 'classroom': '301', 'type': 'Лекция'},
+        'students': [{'id': 1, 'name': 'Сидоров Иван', 'login': 'student1', 'email': None,
+                      'status': 'Опоздал', 'notes': ''}],
+    }
+    marked_at = [datetime(2024, 3, 1, 9, 5)]
+    mock_db.execute_query.side_effect = lambda query, params=None: [(payload, 1, 1, marked_at[0])]
+
+    with patch('main.db', mock_db):
+        first = client.get('/teacher/attendance/class/5?date=2024-03-01')
+        etag = first.headers['ETag']
+        repeated = client.get('/teacher/attendance/class/5?date=2024-03-01', headers={'If-None-Match': etag})
+        marked_at[0] = datetime(2024, 3, 1, 9, 7)
+        changed = client.get('/teacher/attendance/class/5?date=2024-03-01', headers={'If-None-Match': etag})
+        undated = client.get('/teacher/attendance/class/5')
+
+    assert first.status_code == 200
+    assert first.get_json() == payload
+    assert 'no-cache' in first.headers['Cache-Control']
+    assert mock_db.execute_query.call_count == 3
+    query, params = mock_db.execute_query.call_args[0]
+    assert 'LEFT JOIN attendance a' in query and params == (date(2024, 3, 1), 5, date(2024, 3, 1), 2)
+    assert repeated.status_code == 304 and repeated.data == b''
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert undated.status_code == 400
+
+def test_attendance_class_not_found(client, mock_db):
+    """Чужое или несуществующее занятие - 404"""
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = lambda query, params=None: []
+
+    with patch('main.db', mock_db):
+        response = client.get('/teacher/attendance/class/999?date=2024-03-01')
+
+    assert response.status_code == 404
+
+# ========== ЖИВЫЕ ОБНОВЛЕНИЯ ==========
+
+def test_attendance_feed_routes_and_replays_events():
+    """Подписка на занятие получает только его отметки, пропущенные повторяются"""
+    from live_updates import AttendanceFeed
+
+    feed = AttendanceFeed(connect=Mock())
+    with patch.object(feed, 'start'):
+        everything = feed.subscribe()
+        one_class = feed.subscribe(schedule_id=5)
+        first = feed.publish({'schedule_id': 5, 'student_id': 1, 'status': 'Опоздал'})
+        feed.publish({'schedule_id': 6, 'student_id': 2, 'status': 'Присутствовал'})
+        replayed = feed.subscribe(schedule_id=6, last_event_id=first)
+        slow = feed.subscribe(schedule_id=7)
+
+    assert everything.queue.qsize() == 2
+    assert one_class.queue.get_nowait() == (first, {'schedule_id': 5, 'student_id': 1, 'status': 'Опоздал'})
+    assert one_class.queue.empty()
+    assert replayed.queue.get_nowait()[1]['student_id'] == 2
+
+    # Переполненная очередь: клиент отключается, поток просит перезагрузку
+    for _ in range(slow.queue.maxsize + 1):
+        feed.publish({'schedule_id': 7})
+    assert slow.lost
+    assert list(feed.stream(slow))[-1] == 'event: reload\ndata: {}\n\n'
+
+def test_attendance_class_events_stream(client, mock_db):
+    """Преподаватель получает отметки своего занятия потоком SSE"""
+    from live_updates import AttendanceFeed
+
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = lambda query, params=None: [(1,)]
+    feed = AttendanceFeed(connect=Mock())
+
+    with patch('main.db', mock_db), patch('main.attendance_feed', feed), patch.object(feed, 'start'):
+        response = client.get('/teacher/attendance/class/5/events?date=2024-03-01')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        chunks = response.response
+        assert next(chunks).startswith(b'retry:')
+        event_id = feed.publish({'schedule_id': 5, 'student_id': 1, 'status': 'Опоздал'})
+        chunk = next(chunks).decode('utf-8')
+        response.close()
+
+    assert chunk.startswith(f'id: {event_id}\nevent: mark\ndata: ')
+    assert '"status": "Опоздал"' in chunk
+    assert feed._subscriptions == set()
+    assert mock_db.execute_query.call_args[0][1] == (5, date(2024, 3, 1), 2)
+
+def test_attendance_events_access(client, mock_db):
+    """Чужое занятие - 404, общая лента - только администратору"""
+    login_as_teacher(client)
+    mock_db.execute_query.side_effect = lambda query, params=None: []
+
+    with patch('main.db', mock_db):
+        assert client.get('/teacher/attendance/class/5/events?date=2024-03-01').status_code == 404
+        assert client.get('/teacher/attendance/class/5/events').status_code == 400
+        assert client.get('/admin/attendance/events').status_code == 403
+
+# ========== ВЫГРУЗКА ОТЧЕТОВ ==========
+
+def test_iter_query_reads_named_cursor():
+    """iter_query читает строки серверным курсором и возвращает соединение в пул"""
+    from db import Database
+
+    db = Database()
+    conn = make_mock_connection()
+    named = MagicMock()
+    named.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+    conn.cursor.side_effect = lambda name=None: named
+    with patch('db.psycopg2.connect', return_value=conn):
+        db.connect()
+        rows = db.iter_query("SELECT id FROM users", itersize=2)
+        assert db.pool._idle != []  # соединение берется только при чтении
+        assert list(rows) == [(1,), (2,), (3,)]
+
+    assert conn.cursor.call_args[1]['name'].startswith('iter_')
+    assert named.itersize == 2
+    named.fetchmany.assert_called_with(2)
+    assert [c for c, _ in db.pool._idle] == [conn]
+
+def test_iter_chunks_uses_default_itersize():
+    """iter_chunks отдает пачки размера Database.itersize и закрывает курсор"""
+    from db import Database
+
+    db = Database(itersize=3)
+    conn = make_mock_connection()
+    named = MagicMock()
+    named.fetchmany.side_effect = [[(1,), (2,), (3,)], [(4,)], []]
+    conn.cursor.side_effect = lambda name=None: named
+    with patch('db.psycopg2.connect', return_value=conn):
+        db.connect()
+        chunks = list(db.iter_chunks("SELECT id FROM users"))
+
+    assert chunks == [[(1,), (2,), (3,)], [(4,)]]
+    assert named.itersize == 3
+    named.close.assert_called_once()
+    assert [c for c, _ in db.pool._idle] == [conn]
+
+def test_export_aborts_on_read_error(client):
+    """Ошибка чтения обрывает выгрузку, а сломанное соединение не возвращается в пул"""
+    from db import Database
+    from psycopg2 import OperationalError
+
+    db = Database(itersize=1)
+    conn = make_mock_connection()
+    named = MagicMock()
+    named.fetchmany.side_effect = [[('ИВТ-101', 'Сидоров Иван', 'Математика', 10, 8, 1, 1, 0, 80.0)],
+                                   OperationalError('server closed the connection')]
+    conn.cursor.side_effect = lambda name=None: named
+    login_as_teacher(client)
+    with patch('db.psycopg2.connect', return_value=conn):
+        db.connect()
+        with patch('main.db', db), pytest.raises(OperationalError):
+            client.get('/teacher/statistics/export?format=csv').get_data()
+
+    conn.close.assert_called_once()
+    assert db.pool._idle == []
+
+def test_teacher_statistics_export_csv(client, mock_db):
+    """Статистика преподавателя выгружается в CSV из потока строк"""
+    login_as_teacher(client)
+    mock_db.iter_query.side_effect = lambda query, params: iter([
+        ('ИВТ-101', 'Сидоров Иван', 'Математика', 10, 8, 1, 1, 0, 80.0)])
+
+    with patch('main.db', mock_db):
+        response = client.get('/teacher/statistics/export?group_id=1&start_date=2024-02-01'
+                              '&end_date=2024-02-29&format=csv')
+
+    assert response.status_code == 200
+    assert response.content_type == 'text/csv; charset=utf-8'
+    assert 'attachment' in response.headers['Content-Disposition']
+    lines = response.data.decode('utf-8-sig').splitlines()
+    assert lines[0].startswith('Группа,Студент,Дисциплина')
+    assert lines[1] == 'ИВТ-101,Сидоров Иван,Математика,10,8,1,1,0,80.0'
+    query, params = mock_db.iter_query.call_args[0]
+    assert 'teacher_id = %s' in query and 'group_id = %s' in query
+    assert params == [date(2024, 2, 1), date(2024, 2, 29), 2, '1']
+    mock_db.execute_query.assert_not_called()
+
+def test_xlsx_stream_builds_workbook():
+    """XLSX собирается потоком и открывается как zip с листом данных"""
+    import io
+    import zipfile
+    from reports import xlsx_stream
+
+    rows = iter([(1, 'Сидоров <Иван> & Ко', date(2024, 3, 1), None)])
+    data = b''.join(xlsx_stream(('№', 'ФИО', 'Дата', 'Примечание'), rows, chunk_rows=1))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert 'Сидоров &lt;Иван&gt; &amp; Ко' in sheet
+    assert '<c s="1"><v>45352</v></c>' in sheet
+    assert 'sheet1.xml' in archive.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+
+def test_admin_schedule_export_streams_whole_period(client, mock_db):
+    """Расписание выгружается целиком, без LIMIT, из серверного курсора"""
+    from datetime import time
+    login_as_admin(client)
+    mock_db.iter_query.side_effect = lambda query, params: iter([
+        (7, 'Математика', date(2024, 3, 4), time(9, 0), '101', 'Лекция', 'ИВТ-101', 'Иванова Мария')])
+
+    with patch('main.db', mock_db):
+        response = client.get('/admin/schedule/export?group_id=1&start_date=2024-02-01'
+                              '&end_date=2024-06-30&format=csv')
+
+    assert response.status_code == 200
+    lines = response.data.decode('utf-8-sig').splitlines()
+    assert lines[0] == 'Дата,Время,Группа,Дисциплина,Тип,Аудитория,Преподаватель'
+    assert lines[1] == '2024-03-04,09:00:00,ИВТ-101,Математика,Лекция,101,Иванова Мария'
+    query, params = mock_db.iter_query.call_args[0]
+    assert 'LIMIT' not in query
+    assert query.rstrip().endswith('ORDER BY s.lesson_date, s.lesson_time, g.group_code, s.id')
+    assert params == [date(2024, 2, 1), date(2024, 6, 30), '1']
+
+def test_exports_require_role(client):
+    """Выгрузки доступны только своей роли"""
+    login_as_teacher(client)
+    assert client.get('/student/attendance/export').status_code == 302
+    assert client.get('/admin/statistics/export').status_code == 302
+    assert client.get('/admin/users/export').status_code == 302
+    assert client.get('/admin/schedule/export').status_code == 302
+
+# ========== ИМПОРТ ИЗ CSV ==========
+
+def test_import_schedule_validation():
+    """Формат, тип занятия и повторы слотов внутри файла проверяются до БД"""
+    from imports import read_csv, validate_schedule, SCHEDULE_COLUMNS, SCHEDULE_OPTIONAL_COLUMNS
+
+    data = ('\ufeffgroup_code;discipline;teacher_login;lesson_date;lesson_time;lesson_type;classroom\n'
+            'ИВТ-101;Математика;teacher1;01.09.2024;09:00;Лекция;101\n'
+            'ИВТ-101;Физика;teacher1;2024-09-01;09:00;Практика;\n'
+            'ИВТ-101;Физика;teacher1;2024-09-31;10:40;Практика;\n'
+            '\n'
+            'ИВТ-101;Физика;teacher1;2024-09-02;10:40;Экзамен;\n').encode('utf-8')
+    rows, errors = read_csv(data, SCHEDULE_COLUMNS, SCHEDULE_OPTIONAL_COLUMNS)
+    assert errors == []
+    valid, invalid = validate_schedule(rows)
+
+    assert valid == [(2, 'ИВТ-101', 'Математика', 'teacher1', '2024-09-01', '09:00:00', 'Лекция', '101')]
+    assert [line for line, _ in invalid] == [3, 4, 6]
+    assert 'строке 2' in invalid[0][1]
+
+def test_import_students_stages_and_inserts_once():
+    """Студенты загружаются через COPY и одну вставку; ошибки БД сливаются с ошибками файла"""
+    import imports
+
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [(3, 'Группа не найдена')]
+    cur.rowcount = 1
+    db = MagicMock()
+    db.connection.return_value.__enter__.return_value = conn
+
+    data = ('login,password,full_name,group_code\n'
+            'st1,pass1,Петров Петр,ИВТ-101\n'
+            'st2,pass2,Сидоров Иван,НЕТ-000\n'
+            'st1,pass3,Иванов Иван,ИВТ-101\n')
+    result = imports.import_students(db, data)
+
+    assert result == {'total': 3, 'imported': 1, 'dry_run': False,
+                      'errors': [(3, 'Группа не найдена'), (4, 'Логин повторяет строку 2')]}
+    copy_sql, buffer = cur.copy_expert.call_args[0]
+    assert copy_sql.startswith('COPY import_students')
+    assert buffer.getvalue().splitlines() == ['2,st1,pass1,Петров Петр,ИВТ-101,,', '3,st2,pass2,Сидоров Иван,НЕТ-000,,']
+    statements = [c[0][0] for c in cur.execute.call_args_list]
+    assert sum('INSERT INTO users' in sql for sql in statements) == 1
+    conn.commit.assert_called_once()
+
+def test_admin_import_route(client, mock_db):
+    """Загрузка файла передается импорту расписания, отчет выводится на странице"""
+    import io
+    login_as_admin(client)
+    result = {'total': 2, 'imported': 1, 'dry_run': True, 'errors': [(3, 'Группа не найдена')]}
+
+    with patch('main.db', mock_db), patch('main.imports.import_schedule', return_value=result) as load:
+        response = client.post('/admin/import', data={
+            'kind': 'schedule', 'dry_run': '1',
+            'file': (io.BytesIO(b'group_code,discipline\n'), 'schedule.csv'),
+        }, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert load.call_args[0][1] == b'group_code,discipline\n'
+    assert load.call_args[1] == {'dry_run': True}
+    assert 'Группа не найдена' in response.data.decode('utf-8')
+
+# ========== ПОВТОРЯЮЩИЕСЯ ЗАНЯТИЯ ==========
+
+def test_series_occurrences_skip_holidays():
+    """Серия разворачивается по дню недели в периоде, праздники пропускаются"""
+    from recurrence import occurrences, parse_dates
+
+    excluded, invalid = parse_dates('04.11.2024, 2024-11-18 завтра')
+    assert excluded == [date(2024, 11, 4), date(2024, 11, 18)]
+    assert invalid == ['завтра']
+    # 2024-11-01 - пятница, серия по понедельникам
+    assert occurrences(1, date(2024, 11, 1), date(2024, 11, 25), excluded) == [
+        date(2024, 11, 11), date(2024, 11, 25)]
+
+def test_create_series_checks_slots_in_one_query():
+    """Занятые слоты находятся одним запросом; без skip_conflicts серия не создается"""
+    import recurrence
+
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [(date(2024, 9, 9),)]
+    cur.fetchone.return_value = (5,)
+    db = MagicMock()
+    db.connection.return_value.__enter__.return_value = conn
+    args = (db, 1, 2, 3, 1, '09:00', '101', 'Лекция', date(2024, 9, 2), date(2024, 9, 16))
+
+    result = recurrence.create_series(*args)
+    assert result == {'series_id': None, 'created': 0, 'conflicts': [date(2024, 9, 9)]}
+    assert cur.execute.call_count == 1
+    assert cur.execute.call_args[0][1][2] == [date(2024, 9, 2), date(2024, 9, 9), date(2024, 9, 16)]
+    conn.commit.assert_not_called()
+
+    cur.execute.reset_mock()
+    result = recurrence.create_series(*args, skip_conflicts=True)
+    assert result == {'series_id': 5, 'created': 2, 'conflicts': [date(2024, 9, 9)]}
+    insert_sql, insert_params = cur.execute.call_args[0]
+    assert 'unnest(%s::date[])' in insert_sql
+    assert insert_params[-2:] == (5, [date(2024, 9, 2), date(2024, 9, 16)])
+    conn.commit.assert_called_once()
+
+def test_create_series_without_lessons():
+    """Серия без занятий не создается: нет дат в периоде или все даты заняты"""
+    import recurrence
+
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    db = MagicMock()
+    db.connection.return_value.__enter__.return_value = conn
+
+    # 2024-09-03..08 - вторник..воскресенье, понедельника нет
+    result = recurrence.create_series(db, 1, 2, 3, 1, '09:00', '101', 'Лекция',
+                                      date(2024, 9, 3), date(2024, 9, 8))
+    assert result == {'series_id': None, 'created': 0, 'conflicts': []}
+    # Единственная дата исключена
+    result = recurrence.create_series(db, 1, 2, 3, 1, '09:00', '101', 'Лекция',
+                                      date(2024, 9, 2), date(2024, 9, 8), [date(2024, 9, 2)])
+    assert result == {'series_id': None, 'created': 0, 'conflicts': []}
+    db.connection.assert_not_called()
+
+    cur.fetchall.return_value = [(date(2024, 9, 2),)]
+    result = recurrence.create_series(db, 1, 2, 3, 1, '09:00', '101', 'Лекция',
+                                      date(2024, 9, 2), date(2024, 9, 8), skip_conflicts=True)
+    assert result == {'series_id': None, 'created': 0, 'conflicts': [date(2024, 9, 2)]}
+    assert cur.execute.call_count == 1
+    conn.commit.assert_not_called()
+
+def test_update_series_keeps_marked_lessons():
+    """Правка серии не меняет занятия с отметками и сообщает, сколько их осталось"""
+    import recurrence
+
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = []
+    cur.fetchone.side_effect = [(3, 2), (7,)]
+    db = MagicMock()
+    db.connection.return_value.__enter__.return_value = conn
+
+    result = recurrence.update_series(db, 5, 4, '10:40', '205', 'Практика', date(2024, 9, 2))
+
+    assert result == {'updated': 3, 'kept': 2, 'conflicts': [], 'group_id': 7}
+    busy_sql = cur.execute.call_args_list[0][0][0]
+    update_sql = cur.execute.call_args_list[1][0][0]
+    for sql in (busy_sql, update_sql):
+        assert 'NOT EXISTS (SELECT 1 FROM attendance a' in sql
+    conn.commit.assert_called_once()
+
+def test_series_routes_missing_series(client, mock_db):
+    """Несуществующая серия: откат и сообщение вместо ошибки 500"""
+    conn = make_mock_connection()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = []
+    cur.fetchone.side_effect = [(0, 0), None, (0, 0), None]
+    series_db = MagicMock()
+    series_db.connection.return_value.__enter__.return_value = conn
+    login_as_admin(client)
+
+    with patch('main.db', series_db):
+        edited = client.post('/admin/schedule/series/404/edit', data={
+            'teacher_id': '3', 'lesson_time': '10:40', 'lesson_type': 'Практика',
+            'from_date': '2024-09-02'}, follow_redirects=True)
+        cancelled = client.post('/admin/schedule/series/404/cancel', data={'from_date': '2024-09-02'},
+                                follow_redirects=True)
+
+    for response in (edited, cancelled):
+        assert response.status_code == 200
+        assert 'Серия занятий не найдена' in response.data.decode('utf-8')
+    assert conn.rollback.call_count == 2
+    conn.commit.assert_not_called()
+
+def test_series_routes_validate_from_date(client, mock_db):
+    """Некорректная дата начала не доходит до БД"""
+    login_as_admin(client)
+
+    with patch('main.db', mock_db), patch('main.recurrence.update_series') as update, \
+            patch('main.recurrence.cancel_series') as cancel:
+        edited = client.post('/admin/schedule/series/7/edit', data={
+            'teacher_id': '3', 'lesson_time': '10:40', 'lesson_type': 'Практика',
+            'from_date': '02.09.2024; DROP'}, follow_redirects=True)
+        cancelled = client.post('/admin/schedule/series/7/cancel', data={'from_date': '2024-13-01'},
+                                follow_redirects=True)
+        cancel.return_value = {'deleted': 3, 'kept': 0, 'group_id': 2}
+        client.post('/admin/schedule/series/7/cancel', data={'from_date': '2024-09-02'})
+
+    assert 'Некорректная дата начала изменений' in edited.data.decode('utf-8')
+    assert 'Некорректная дата начала отмены' in cancelled.data.decode('utf-8')
+    update.assert_not_called()
+    cancel.assert_called_once_with(mock_db, 7, date(2024, 9, 2))
+
+def test_schedule_series_create_route(client, mock_db):
+    """Форма серии передает период, день недели и праздники в create_series"""
+    login_as_admin(client)
+    result = {'series_id': 7, 'created': 16, 'conflicts': []}
+
+    with patch('main.db', mock_db), patch('main.recurrence.create_series', return_value=result) as create:
+        response = client.post('/admin/schedule/series', data={
+            'discipline_id': '1', 'group_id': '2', 'teacher_id': '3', 'weekday': '3',
+            'lesson_time': '10:40', 'classroom': '205', 'lesson_type': 'Практика',
+            'start_date': '2024-09-02', 'end_date': '2024-12-29', 'excluded_dates': '04.11.2024',
+        }, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert 'Создано занятий: 16' in response.data.decode('utf-8')
+    assert create.call_args[0][4:] == (3, '10:40', '205', 'Практика', date(2024, 9, 2),
+                                       date(2024, 12, 29), [date(2024, 11, 4)])
+
+    empty = {'series_id': None, 'created': 0, 'conflicts': []}
+    with patch('main.db', mock_db), patch('main.recurrence.create_series', return_value=empty):
+        response = client.post('/admin/schedule/series', data={
+            'discipline_id': '1', 'group_id': '2', 'teacher_id': '3', 'weekday': '1',
+            'lesson_time': '10:40', 'lesson_type': 'Практика',
+            'start_date': '2024-09-03', 'end_date': '2024-09-08',
+        }, follow_redirects=True)
+    page = response.data.decode('utf-8')
+    assert 'В выбранном периоде нет ни одного занятия серии' in page
+    assert 'Создано занятий' not in page
+
+# ========== ПОСТРАНИЧНЫЙ ВЫВОД ==========
+
+def paged_query(mock_db):
+    """Последний постраничный запрос (текст и параметры)"""
+    calls = [c[0] for c in mock_db.execute_query.call_args_list if 'LIMIT %s' in c[0][0]]
+    return calls[-1]
+
+def test_admin_users_keyset_pagination(client, mock_db):
+    """Список пользователей отдается страницами, курсор продолжает с последней строки"""
+    import main
+    login_as_admin(client)
+    rows = [(i, f'user{i}', f'Студент {i:03d}', 'Студент', None, None, 'ИВТ-101')
+            for i in range(1, main.PAGE_SIZE + 2)]
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = rows
+
+    with patch('main.db', mock_db):
+        response = client.get('/admin/users?role=Студент&group_id=1')
+        assert response.status_code == 200
+        query, params = paged_query(mock_db)
+        assert params[-1] == main.PAGE_SIZE + 1
+        assert 'u.role = %s' in query and 'u.group_id = %s' in query
+
+        html = response.data.decode('utf-8')
+        assert f'Студент {main.PAGE_SIZE + 1:03d}' not in html
+        cursor = main.encode_cursor(('Студент', f'Студент {main.PAGE_SIZE:03d}', main.PAGE_SIZE))
+        assert f'after={cursor}' in html
+
+        client.get(f'/admin/users?role=Студент&group_id=1&after={cursor}')
+        query, params = paged_query(mock_db)
+        assert '(u.role, u.full_name, u.id) > (%s, %s, %s)' in query
+        assert params[-4:] == ['Студент', f'Студент {main.PAGE_SIZE:03d}', main.PAGE_SIZE, main.PAGE_SIZE + 1]
+
+    mock_db.estimate_count.assert_not_called()
+
+def test_admin_schedule_cursor_and_estimate(client, mock_db):
+    """Расписание продолжается по курсору, испорченный курсор дает первую страницу"""
+    import main
+    login_as_admin(client)
+    mock_db.estimate_count.return_value = 1234
+    cursor = main.encode_cursor((date(2024, 3, 1), '09:00:00', 'ИВТ-101', 17))
+
+    with patch('main.db', mock_db):
+        response = client.get(f'/admin/schedule?group_id=1&after={cursor}&count=1')
+        assert response.status_code == 200
+        assert 'примерно: 1234' in response.data.decode('utf-8')
+        query, params = paged_query(mock_db)
+        assert '(s.lesson_date, s.lesson_time, g.group_code, s.id) > (%s, %s, %s, %s)' in query
+        assert params[2:] == ['1', '2024-03-01', '09:00:00', 'ИВТ-101', 17, main.PAGE_SIZE + 1]
+
+        client.get('/admin/schedule?after=not-a-cursor')
+        query, params = paged_query(mock_db)
+        assert ') > (' not in query
+
+# ========== ПОИСК ПОЛЬЗОВАТЕЛЕЙ ==========
+
+def test_admin_users_search_ranked_by_similarity(client, mock_db):
+    """Поиск идет по ФИО, логину и email и упорядочен по похожести"""
+    login_as_admin(client)
+
+    with patch('main.db', mock_db):
+        response = client.get('/admin/users?search=50%_ив')
+
+    assert response.status_code == 200
+    query, params = paged_query(mock_db)
+    assert 'word_similarity' in query and 'u.login ILIKE' in query and 'u.email ILIKE' in query
+    assert '(found.distance, found.id)' not in query  # первая страница без курсора
+    assert 'ORDER BY found.distance, found.id' in query
+    assert params[:3] == ['50%_ив'] * 3
+    assert '%50\\%\\_ив%' in params
+
+def test_autocomplete_users(client, mock_db):
+    """Подсказки: префиксный поиск с небольшим лимитом, короткие запросы не идут в БД"""
+    import main
+    login_as_admin(client)
+    mock_db.execute_query.side_effect = None
+    mock_db.execute_query.return_value = [(1, 'Сидоров Иван', 'student1', 'Студент', 'ИВТ-101')]
+
+    with patch('main.db', mock_db):
+        assert client.get('/admin/users/autocomplete?q=С').get_json() == []
+        assert not mock_db.execute_query.called
+
+        response = client.get('/admin/users/autocomplete?q=Сид')
+
+    assert response.get_json() == [{'id': 1, 'full_name': 'Сидоров Иван', 'login': 'student1',
+                                    'role': 'Студент', 'group_code': 'ИВТ-101'}]
+    query, params = mock_db.execute_query.call_args[0]
+    assert 'LIMIT %s' in query and params[-1] == main.AUTOCOMPLETE_LIMIT
+    assert params[0] == 'Сид%'
+
+def test_autocomplete_users_admin_only(client):
+    """Подсказки доступны только администратору"""
+    login_as_teacher(client)
+    assert client.get('/admin/users/autocomplete?q=Сид').status_code == 403
+
+# ========== ЗАМЕРЫ ЗАПРОСОВ ==========
+
+def test_database_reports_queries_to_observers():
+    """Database сообщает наблюдателям о каждом запросе: текст, время, строки"""
+    from db import Database
+
+    db = Database()
+    seen = []
+    db.add_query_observer(lambda query, seconds, rows: seen.append((query, seconds, rows)))
+
+    conn = make_mock_connection()
+    conn.cursor.return_value.fetchall.return_value = [(1,), (2,)]
+    with patch('db.psycopg2.connect', return_value=conn):
+        db.connect()
+        assert db.execute_query("SELECT id FROM users") == [(1,), (2,)]
+        assert db.execute_insert("DELETE FROM users WHERE id = %s", (5,)) is True
+
+    assert [(query, rows) for query, _, rows in seen] == [
+        ("SELECT id FROM users", 2), ("DELETE FROM users WHERE id = %s", 0)]
+    assert all(seconds >= 0 for _, seconds, _ in seen)
+
+def test_server_timing_header_and_route_metrics(client, mock_db):
+    """Ответ содержит Server-Timing, маршрут попадает в гистограммы /admin/metrics"""
+    import instrumentation
+    instrumentation.route_stats.reset()
+    login_as_admin(client)
+
+    plain_execute = mock_db.execute_query.side_effect
+
+    def timed_execute(query, params=None, fetch=True):
+        result = plain_execute(query, params, fetch)
+        instrumentation.current_metrics().add_query(query, 0.004, len(result or []))
+        return result
+
+    mock_db.execute_query.side_effect = timed_execute
+
+    with patch('main.db', mock_db):
+        response = client.get('/admin/users')
+        metrics = client.get('/admin/metrics?endpoint=admin_users').get_json()
+
+    timing = response.headers['Server-Timing']
+    assert 'db;dur=' in timing and 'render;dur=' in timing and 'total;dur=' in timing
+    assert f'desc="{mock_db.execute_query.call_count} queries"' in timing
+
+    route = metrics['routes']['admin_users']
+    assert route['requests'] == 1
+    assert route['queries_per_request'] == mock_db.execute_query.call_count
+    assert route['db']['count'] == 1 and route['db']['p50_ms'] >= 4
+
+def test_admin_metrics_admin_only(client):
+    """Метрики доступны только администратору"""
+    login_as_teacher(client)
+    assert client.get('/admin/metrics').status_code == 403
+
+def test_histogram_percentiles():
+    """Перцентиль - верхняя граница корзины, не больше максимума"""
+    from instrumentation import Histogram
+
+    histogram = Histogram(buckets=(10, 100, 1000))
+    for value in [3] * 90 + [50] * 9 + [700]:
+        histogram.add(value)
+
+    assert histogram.percentile(0.5) == 10
+    assert histogram.percentile(0.95) == 100
+    assert histogram.percentile(0.999) == 700
+    assert histogram.snapshot()['counts'] == [90, 9, 1, 0]
+
+# ========== НАГРУЗОЧНЫЙ ТЕСТ ==========
+
+def test_benchmark_summary_and_regressions():
+    """Сводка прогона считает перцентили, сравнение находит ухудшения"""
+    import benchmark
+
+    samples = [('Студент /dashboard', 200, float(ms), 4, True) for ms in range(1, 101)]
+    samples.append(('Студент /dashboard', 500, 1000.0, None, False))
+    # Ошибка отметки приходит редиректом и тоже считается
+    samples.append(('Преподаватель POST /teacher/attendance/mark', 302, 5.0, 2, False))
+    result = benchmark.summarize(samples, duration=10)
+
+    route = result['routes']['Студент /dashboard']
+    assert route['requests'] == 101 and route['rps'] == 10.1 and route['errors'] == 1
+    assert route['p50_ms'] == 51.0 and route['p95_ms'] == 96.0 and route['p99_ms'] == 100.0
+    assert route['queries_per_request'] == 4.0
+    assert result['routes']['Преподаватель POST /teacher/attendance/mark']['errors'] == 1
+    assert result['totals']['errors'] == 2
+
+    assert benchmark.expect_status(302)(302, b'') and not benchmark.expect_status(200)(302, b'')
+    assert benchmark.mark_saved(200, b'{"success": true}')
+    assert not benchmark.mark_saved(200, b'{"success": false}')
+    assert not benchmark.mark_saved(400, b'{"success": false, "error": "x"}')
+
+    assert benchmark.compare(result, result) == []
+    baseline = {'routes': {'Студент /dashboard': dict(route, p95_ms=50.0, queries_per_request=2.0)}}
+    regressions = benchmark.compare(result, baseline)
+    assert len(regressions) == 2
+    assert 'p95' in regressions[0]
+
+# ========== ГЕНЕРАТОР ДАННЫХ ==========
+
+def test_datagen_copy_stream_and_statuses():
+    """Поток COPY отдает данные генератора по частям, веса статусов проверяются"""
+    from datagen import CopyStream, parse_statuses
+
+    stream = CopyStream(['1\tа\n', '', '2\tб\n'])
+    data = b''
+    while True:
+        piece = stream.read(3)
+        if not piece:
+            break
+        assert len(piece) <= 3
+        data += piece
+    assert data.decode('utf-8') == '1\tа\n2\tб\n'
+
+    assert parse_statuses('Присутствовал=70, Опоздал=30') == {'Присутствовал': 70.0, 'Опоздал': 30.0}
+    with pytest.raises(ValueError):
+        parse_statuses('Прогулял=10')
+
+def test_datagen_is_deterministic():
+    """Одинаковый seed дает одинаковые данные для COPY"""
+    import datagen
+
+    def run(seed):
+        db = MagicMock()
+        cur = db.connection.return_value.__enter__.return_value.cursor.return_value
+        cur.fetchone.return_value = (False,)
+        cur.fetchall.return_value = []
+        loaded = {}
+        cur.copy_expert.side_effect = lambda sql, stream, size: loaded.__setitem__(
+            sql.split()[1], stream.read())
+        counts = datagen.generate(db, groups=3, students_per_group=4, weeks=2, seed=seed,
+                                  today=date(2024, 3, 13), log=lambda message: None)
+        return counts, loaded
+
+    counts, first = run(7)
+    assert counts['users'] == 3 // 2 + 1 + 12
+    assert counts['attendance'] == first['attendance'].count(b'\n')
+    assert counts['schedule'] == first['schedule'].count(b'\n')
+    assert run(7)[1] == first
+    assert run(8)[1] != first
@@ -0,0 +1,348 @@
+"""Проверка планов запросов на заполненной локальной БД PostgreSQL.
+
+Тест прогоняет маршруты main.py для всех ролей и для каждого SELECT
+выполняет EXPLAIN. Если хотя бы один запрос читает большую таблицу
+последовательным сканированием, тест падает.
+
+Нужна отдельная БД, которая будет ПЕРЕСОЗДАНА (схема public удаляется):
+
+    TEST_DB_NAME=attendance_test TEST_DB_USER=postgres TEST_DB_PASSWORD=... pytest tests/test_query_plans.py
+
+Без TEST_DB_NAME тест пропускается.
+"""
+import os
+import re
+import sys
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import Database
+import migrations
+
+LARGE_TABLES = {'attendance', 'schedule', 'attendance_daily_stats', 'student_discipline_stats'}
+
+SEED_SQL = """
+INSERT INTO student_groups (group_code, specialization, year_of_study)
+SELECT 'ГР-' || g, 'Информатика', 1 + g % 4 FROM generate_series(1, 40) g;
+
+INSERT INTO users (login, password_hash, full_name, role, email)
+SELECT 'teacher' || t, 'teacher123', 'Преподаватель ' || t, 'Преподаватель', 'teacher' || t || '@university.ru'
+FROM generate_series(1, 50) t;
+
+INSERT INTO users (login, password_hash, full_name, role)
+VALUES ('admin', 'admin123', 'Администратор Системы', 'Администратор');
+
+INSERT INTO users (login, password_hash, full_name, role, email, group_id)
+SELECT 'student' || g.id || '_' || i, 'student123', 'Студент ' || g.id || '-' || i, 'Студент',
+       'student' || g.id || '_' || i || '@university.ru', g.id
+FROM student_groups g CROSS JOIN generate_series(1, 25) i;
+
+INSERT INTO disciplines (name, total_hours, teacher_id)
+SELECT 'Дисциплина ' || d, 72, t.id
+FROM generate_series(1, 100) d
+JOIN (SELECT id, row_number() OVER (ORDER BY id) AS rn FROM users WHERE role = 'Преподаватель') t
+  ON t.rn = 1 + d % 50;
+
+INSERT INTO group_disciplines (group_id, discipline_id, semester)
+SELECT g.id, (g.id * 5 + k) % 100 + 1, 1
+FROM student_groups g CROSS JOIN generate_series(0, 4) k;
+
+SELECT create_month_partitions(CURRENT_DATE - 240, CURRENT_DATE + 14);
+
+INSERT INTO schedule (discipline_id, group_id, teacher_id, lesson_date, lesson_time, classroom, lesson_type)
+SELECT d.id, g.id, d.teacher_id, day::date, TIME '09:00' + slot * INTERVAL '100 minutes', '10' || slot, 'Лекция'
+FROM student_groups g
+CROSS JOIN generate_series((CURRENT_DATE - 240)::timestamp, (CURRENT_DATE + 14)::timestamp, INTERVAL '1 day') day
+CROSS JOIN generate_series(0, 3) slot
+JOIN disciplines d ON d.id = (g.id * 5 + slot) % 100 + 1
+WHERE extract(isodow FROM day) < 6;
+
+ALTER TABLE attendance DISABLE TRIGGER USER;
+
+INSERT INTO attendance (student_id, schedule_id, lesson_date, status, marked_by, marked_at)
+SELECT u.id, s.id, s.lesson_date,
+       (ARRAY['Присутствовал', 'Присутствовал', 'Присутствовал', 'Присутствовал',
+              'Отсутствовал', 'Опоздал', 'По уважительной причине'])[1 + (u.id + s.id) % 7],
+       s.teacher_id, s.lesson_date + s.lesson_time
+FROM schedule s
+JOIN users u ON u.group_id = s.group_id AND u.role = 'Студент'
+WHERE s.lesson_date <= CURRENT_DATE;
+
+ALTER TABLE attendance ENABLE TRIGGER USER;
+""" + migrations.REBUILD_STATS_SQL
+
+
+def seq_scans(plan):
+    """Таблицы, которые план читает последовательным сканированием"""
+    found = set()
+    # Пустые секции будущих месяцев читаются последовательно за нулевую стоимость
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Total Cost', 0) > 0:
+        # Секция schedule_2024_09 считается таблицей schedule
+        found.add(re.sub(r'_\d{4}_\d{2}$', '', plan.get('Relation Name')))
+    for child in plan.get('Plans', []):
+        found |= seq_scans(child)
+    return found
+
+
+def scanned_partitions(plan):
+    """Секции, которые план читает: {таблица: множество секций}"""
+    found = {}
+    match = re.match(r'^(schedule|attendance)_\d{4}_\d{2}$', plan.get('Relation Name', ''))
+    if match:
+        found.setdefault(match.group(1), set()).add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        for table, names in scanned_partitions(child).items():
+            found.setdefault(table, set()).update(names)
+    return found
+
+
+class PlanCheckingDatabase(Database):
+    """Database, который перед каждым SELECT сохраняет его план"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.violations = []
+        self.explained = 0
+        self.plans = []
+
+    def check_plan(self, query, params):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params or None)
+            plan = cur.fetchone()[0][0]['Plan']
+            cur.close()
+        self.explained += 1
+        self.plans.append((' '.join(query.split()), plan))
+        scanned = seq_scans(plan) & LARGE_TABLES
+        if scanned:
+            self.violations.append((sorted(scanned), ' '.join(query.split())))
+
+    def execute_query(self, query, params=None, fetch=True):
+        if query.strip().upper().startswith(('SELECT', 'WITH')):
+            self.check_plan(query, params)
+        return super().execute_query(query, params, fetch)
+
+    def execute_prepared(self, name, params=None, fetch=True):
+        self.check_plan(self.statement_sql(name), params)
+        return super().execute_prepared(name, params, fetch)
+
+    def iter_query(self, query, params=None, itersize=None):
+        self.check_plan(query, params)
+        return super().iter_query(query, params, itersize)
+
+
+@pytest.fixture(scope='module')
+def plan_db():
+    if not os.environ.get('TEST_DB_NAME'):
+        pytest.skip('TEST_DB_NAME не задан: нет локальной БД для проверки планов')
+
+    db = PlanCheckingDatabase(
+        host=os.environ.get('TEST_DB_HOST', 'localhost'),
+        database=os.environ['TEST_DB_NAME'],
+        user=os.environ.get('TEST_DB_USER', 'postgres'),
+        password=os.environ.get('TEST_DB_PASSWORD', ''),
+    )
+    if not db.connect():
+        pytest.skip('Не удалось подключиться к тестовой БД')
+    # Частые запросы main.py зарегистрированы на main.db, маршруты же пойдут в эту БД
+    from main import HOT_STATEMENTS
+    for name, sql in HOT_STATEMENTS.items():
+        db.prepare(name, sql)
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        conn.commit()
+    migrations.migrate(db)
+    with db.connection() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(SEED_SQL)
+        cur.execute("VACUUM ANALYZE")
+        conn.autocommit = False
+
+    yield db
+    db.close()
+
+
+def sample_ids(db):
+    def one(query):
+        rows = Database.execute_query(db, query)
+        return rows[0] if rows else (None,)
+
+    student_id, group_id = one("SELECT id, group_id FROM users WHERE role = 'Студент' ORDER BY id LIMIT 1")
+    admin_id, = one("SELECT id FROM users WHERE role = 'Администратор' LIMIT 1")
+    teacher_id, schedule_id, lesson_date = one("""
+        SELECT teacher_id, id, lesson_date FROM schedule
+        WHERE lesson_date <= CURRENT_DATE ORDER BY lesson_date DESC, id LIMIT 1
+    """)
+    discipline_id, = one(f"SELECT id FROM disciplines WHERE teacher_id = {teacher_id} LIMIT 1")
+    return {
+        'student': (student_id, 'Студент', group_id),
+        'teacher': (teacher_id, 'Преподаватель', None),
+        'admin': (admin_id, 'Администратор', None),
+        'group_id': group_id,
+        'schedule_id': schedule_id,
+        'lesson_date': lesson_date,
+        'discipline_id': discipline_id,
+    }
+
+
+def test_main_queries_use_indexes(plan_db):
+    """Ни один запрос main.py не читает большие таблицы целиком"""
+    from main import app, encode_cursor
+
+    ids = sample_ids(plan_db)
+    users_cursor = encode_cursor(('Студент', 'Студент 1-1', 0))
+    routes = {
+        'student': ['/dashboard', '/student/schedule', '/student/attendance', '/student/disciplines',
+                    '/student/attendance/export?format=xlsx'],
+        'teacher': [
+            '/dashboard',
+            '/teacher/disciplines',
+            '/teacher/attendance/mark',
+            f"/teacher/attendance/class/{ids['schedule_id']}?date={ids['lesson_date']}",
+            f"/teacher/statistics?group_id={ids['group_id']}",
+            '/teacher/statistics?current_semester=1',
+            f"/teacher/statistics/export?group_id={ids['group_id']}&format=csv",
+            f"/teacher/discipline/manage_groups/{ids['discipline_id']}",
+        ],
+        'admin': [
+            '/dashboard',
+            '/admin/users',
+            f"/admin/users?role=Студент&group_id={ids['group_id']}",
+            f"/admin/users?role=Студент&after={users_cursor}&count=1",
+            '/admin/users?search=Студнет 12',
+            '/admin/users/autocomplete?q=teacher1',
+            '/admin/groups',
+            '/admin/schedule',
+            f"/admin/schedule?group_id={ids['group_id']}",
+            f"/admin/schedule?after={encode_cursor((date.today(), '10:40:00', 'ГР-1', 0))}",
+            '/admin/statistics',
+            f"/admin/group/{ids['group_id']}/disciplines",
+        ],
+    }
+
+    app.config['TESTING'] = True
+    with patch('main.db', plan_db), app.test_client() as client:
+        for role, paths in routes.items():
+            user_id, role_name, group_id = ids[role]
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+                session['login'] = role
+                session['full_name'] = role
+                session['role'] = role_name
+                session['group_id'] = group_id
+            for path in paths:
+                response = client.get(path)
+                assert response.status_code in (200, 302), path
+                response.get_data()
+
+    assert plan_db.explained > 0
+    assert not plan_db.violations, '\n'.join(
+        f"{tables}: {query}" for tables, query in plan_db.violations
+    )
+
+
+
+def test_lesson_lookups_prune_partitions(plan_db):
+    """Занятие ищется по id и дате: читается одна секция schedule и attendance"""
+    from db import ATTENDANCE_UPSERT_SQL
+    from main import app
+
+    ids = sample_ids(plan_db)
+    teacher_id, role_name, _ = ids['teacher']
+    path = f"/teacher/attendance/class/{ids['schedule_id']}"
+    lesson_date = ids['lesson_date'].isoformat()
+
+    plan_db.plans = []
+    app.config['TESTING'] = True
+    with patch('main.db', plan_db), patch('main.event_stream', return_value=''), \
+            app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_id'] = teacher_id
+            session['role'] = role_name
+        assert client.get(f"{path}?date={lesson_date}").status_code == 200
+        assert client.get(f"{path}/events?date={lesson_date}").status_code == 200
+        response = client.post('/teacher/attendance/mark/batch', json={
+            'schedule_id': ids['schedule_id'], 'lesson_date': lesson_date, 'marks': []})
+        assert response.status_code == 200
+    assert len(plan_db.plans) == 3
+
+    # Запись отметок: EXPLAIN без ANALYZE не выполняет INSERT
+    student_id, _, _ = ids['student']
+    plan_db.check_plan(ATTENDANCE_UPSERT_SQL, (ids['schedule_id'], ids['lesson_date'], teacher_id,
+                                                [student_id], ['Присутствовал'], ['']))
+
+    for query, plan in plan_db.plans:
+        partitions = scanned_partitions(plan)
+        assert partitions, query
+        for table, names in partitions.items():
+            assert len(names) == 1, f"{table}: {sorted(names)}: {query}"
+
+
+def test_reschedule_keeps_attendance(plan_db):
+    """Перенос отмеченного занятия в другой месяц и внутри месяца сохраняет отметки и сводку"""
+    def check_day(cur, group_id, day):
+        cur.execute("""
+            SELECT (SELECT coalesce(sum(total), 0) FROM attendance_daily_stats
+                    WHERE group_id = %(group)s AND lesson_date = %(day)s),
+                   (SELECT count(*) FROM attendance a
+                    JOIN schedule s ON s.id = a.schedule_id AND s.lesson_date = a.lesson_date
+                    WHERE s.group_id = %(group)s AND s.lesson_date = %(day)s)
+        """, {'group': group_id, 'day': day})
+        stats, marked = cur.fetchone()
+        assert stats == marked, day
+
+    with plan_db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT s.id, s.group_id, s.lesson_date, count(*) FROM schedule s
+            JOIN attendance a ON a.schedule_id = s.id AND a.lesson_date = s.lesson_date
+            WHERE s.lesson_date < CURRENT_DATE - 60
+            GROUP BY s.id, s.group_id, s.lesson_date ORDER BY s.lesson_date LIMIT 1
+        """)
+        schedule_id, group_id, lesson_date, marks = cur.fetchone()
+        try:
+            for shift in (45, 1):
+                cur.execute("SELECT create_month_partitions(%s, %s + %s)", (lesson_date, lesson_date, shift))
+                cur.execute("UPDATE schedule SET lesson_date = lesson_date + %s WHERE id = %s RETURNING lesson_date",
+                            (shift, schedule_id))
+                old_date, (lesson_date,) = lesson_date, cur.fetchone()
+                cur.execute("SELECT count(*) FROM attendance WHERE schedule_id = %s", (schedule_id,))
+                assert cur.fetchone()[0] == marks
+                check_day(cur, group_id, old_date)
+                check_day(cur, group_id, lesson_date)
+        finally:
+            conn.rollback()
+
+
+def test_rebuild_stats_counts_each_mark_once(plan_db):
+    """Пересчет сводки не удваивает счетчики по дисциплинам и оставляет триггер включенным"""
+    def totals(cur):
+        cur.execute("""
+            SELECT (SELECT SUM(total) FROM student_discipline_stats),
+                   (SELECT SUM(total) FROM attendance_daily_stats),
+                   (SELECT COUNT(*) FROM attendance a JOIN users u ON u.id = a.student_id
+                    WHERE u.role = 'Студент')
+        """)
+        return cur.fetchone()
+
+    with plan_db.connection() as conn:
+        cur = conn.cursor()
+        try:
+            for rebuild in (migrations.REBUILD_ATTENDANCE_STATS_SQL, migrations.REBUILD_STATS_SQL):
+                cur.execute(rebuild)
+                discipline_total, daily_total, marks = totals(cur)
+                assert discipline_total == daily_total == marks
+            cur.execute("""
+                SELECT tgenabled FROM pg_trigger
+                WHERE tgrelid = 'attendance_daily_stats'::regclass AND tgname = 'discipline_stats_on_write'
+            """)
+            assert cur.fetchone()[0] == 'O'
+        finally:
+            conn.rollback()